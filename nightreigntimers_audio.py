@@ -0,0 +1,215 @@
+import array
+import collections
+import heapq
+import io
+import itertools
+import logging
+import math
+import sys
+import threading
+import time
+import wave
+
+import nightreigntimers_metrics as metrics
+import nightreigntimers_trace as tracing
+
+SAMPLE_RATE = 22050
+# Storm warning: three descending tones as (frequency Hz, duration ms)
+WARNING_TONES = [(130, 400), (110, 300), (98, 500)]
+FADE_MS = 5  # Short fade in/out per tone to avoid clicks
+LATENCY_HISTORY = 1024  # Cue latencies kept, hours of play at a few cues a phase
+
+CUE_LATENCY = metrics.histogram('nightreign_cue_latency_seconds', "How late each audio cue started against its deadline")
+CUES = metrics.counter('nightreign_cues_played_total', "Audio cues played")
+CUE_FAILURES = metrics.counter('nightreign_cue_failures_total', "Audio cues the sink failed to play")
+
+
+def render_tones(tones, sample_rate=SAMPLE_RATE, volume=0.6):
+    # Synthesize a tone sequence into 16-bit mono PCM
+    samples = array.array('h')
+    fade = int(sample_rate * FADE_MS / 1000)
+    for freq, ms in tones:
+        count = int(sample_rate * ms / 1000)
+        step = 2 * math.pi * freq / sample_rate
+        for i in range(count):
+            envelope = min(1.0, i / fade, (count - i) / fade) if fade else 1.0
+            samples.append(int(32767 * volume * envelope * math.sin(step * i)))
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def to_wav(pcm, sample_rate=SAMPLE_RATE):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        out.writeframes(pcm)
+    return buffer.getvalue()
+
+
+class WinsoundSink:
+    name = 'winsound'
+
+    def __init__(self):
+        import winsound
+        self._winsound = winsound
+
+    def play(self, wav):
+        # Blocks until done, which is fine on the audio worker thread
+        self._winsound.PlaySound(wav, self._winsound.SND_MEMORY)
+
+
+class CommandSink:
+    # Pipes the WAV into a player reading stdin: aplay (ALSA) or paplay (PulseAudio)
+    PLAYERS = {
+        'paplay': ['paplay'],
+        'aplay': ['aplay', '-q', '-'],
+    }
+
+    def __init__(self, player):
+        self.name = player
+        self.command = self.PLAYERS[player]
+
+    def play(self, wav):
+        import subprocess
+        # check: e.g. paplay with no sound server exits non-zero, see AudioCues' fallback
+        subprocess.run(self.command, input=wav, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+
+class NullSink:
+    # Records what would have been played and when, for tests and benchmarks
+    name = 'null'
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.played = []
+
+    def play(self, wav):
+        self.played.append((self.clock(), len(wav)))
+
+
+class BellSink:
+    # Last resort: ring the Tk bell, posted back to the Tk thread
+    name = 'bell'
+
+    def __init__(self, post):
+        self.post = post
+
+    def play(self, wav):
+        self.post('bell')
+
+
+def default_sink(post=None):
+    import shutil
+    if sys.platform == 'win32':
+        try:
+            return WinsoundSink()
+        except ImportError:
+            pass
+    for player in ('paplay', 'aplay'):
+        if shutil.which(player):
+            return CommandSink(player)
+    if post is not None:
+        return BellSink(post)
+    return NullSink()
+
+
+class AudioCues:
+    # One long-lived worker thread plays pre-rendered cues at exact deadlines.
+    # The warning WAV is rendered once at startup, on the worker so it does
+    # not hold up the window; schedule() just pushes a (deadline, cue) entry
+    # and the worker sleeps until the earliest one, so a cue fires once, on
+    # time, independent of how busy the Tk thread is.
+    # Deadlines are on the time.monotonic() clock.
+
+    def __init__(self, sink=None, clock=time.monotonic, post=None):
+        self.sink = sink
+        self._post = post
+        self.clock = clock
+        self.cues = {}
+        self.latencies = collections.deque(maxlen=LATENCY_HISTORY)  # Seconds from each cue's deadline to playback
+        self._heap = []
+        self._ids = itertools.count()
+        self._cancelled = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='audio-cues', daemon=True)
+        self._thread.start()
+
+    def schedule(self, cue, deadline):
+        # Returns a handle for cancel()
+        handle = next(self._ids)
+        tracing.record(tracing.CUE_SCHEDULED, cue, deadline)
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, handle, cue))
+            self._cond.notify()
+        return handle
+
+    def play(self, cue):
+        return self.schedule(cue, self.clock())
+
+    def cancel(self, handle):
+        with self._cond:
+            if any(entry[1] == handle for entry in self._heap):
+                self._cancelled.add(handle)
+                self._cond.notify()
+
+    def cancel_all(self):
+        tracing.record(tracing.CUE_CANCELLED)
+        with self._cond:
+            self._cancelled.update(entry[1] for entry in self._heap)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _prepare(self):
+        if self.sink is None:
+            self.sink = default_sink(self._post)
+        self.cues['warning'] = to_wav(render_tones(WARNING_TONES))
+
+    def _run(self):
+        self._prepare()
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    while self._heap and self._heap[0][1] in self._cancelled:
+                        self._cancelled.discard(heapq.heappop(self._heap)[1])
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    timeout = self._heap[0][0] - self.clock()
+                    if timeout <= 0:
+                        deadline, handle, cue = heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(timeout)
+            late = self.clock() - deadline
+            self.latencies.append(late)
+            CUE_LATENCY.add(max(0, int(late * 1e9)))
+            CUES.inc()
+            tracing.record(tracing.CUE_PLAYED, cue, late)
+            try:
+                self.sink.play(self.cues[cue])
+            except Exception:
+                # e.g. the player went away or the device is busy: a bell
+                # beats a dead worker and no more warnings
+                CUE_FAILURES.inc()
+                failed, self.sink = self.sink, self._fallback_sink()
+                logging.exception(f"Audio cue failed on {failed.name}, using {self.sink.name} from now on")
+                try:
+                    self.sink.play(self.cues[cue])
+                except Exception:
+                    # Keep the worker alive for later cues; the next failure moves on again
+                    CUE_FAILURES.inc()
+                    logging.exception(f"Audio cue failed on {self.sink.name} too")
+
+    def _fallback_sink(self):
+        if self._post is not None and not isinstance(self.sink, BellSink):
+            return BellSink(self._post)
+        return NullSink(self.clock)
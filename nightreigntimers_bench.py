@@ -0,0 +1,1451 @@
+import argparse
+import asyncio
+import contextlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+from nightreigntimers_audio import AudioCues, CommandSink, NullSink
+from nightreigntimers_daemon import TimerDaemon
+import nightreigntimers_detect as detection
+from nightreigntimers_engine import NS, TimerEngine, percentile
+import nightreigntimers_history as run_history
+import nightreigntimers_metrics as metrics
+import nightreigntimers_pace as run_pace
+import nightreigntimers_schedule as schedule
+from nightreigntimers_scheduler import CommandQueue, DeadlineScheduler
+from nightreigntimers_sim import (FRONTENDS, SYNTHETIC_FIRES, DummyRoot, Expedition, FakeProcessTable, StandInClient,
+                                  VirtualClock, VirtualScheduler, dummy_tk, synthetic_frames)
+from nightreigntimers_view import WidgetView
+from nightreigntimers_watch import GAME_PROCESS, X11_STOP_WAIT, ProcessWatcher, X11FocusWatcher
+
+
+class FakeRoot:
+    # Just enough of tk.Tk (after/after_cancel/bind/event_generate) to run
+    # the engine and command queue on this thread without a display.
+    def __init__(self):
+        self._timers = []
+        self._cancelled = set()
+        self._ids = itertools.count()
+        self._bindings = {}
+        self._events = []
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def after(self, ms, callback):
+        handle = next(self._ids)
+        heapq.heappush(self._timers, (time.monotonic() + ms / 1000, handle, callback))
+        return handle
+
+    def after_cancel(self, handle):
+        self._cancelled.add(handle)
+
+    def bind(self, sequence, callback):
+        self._bindings[sequence] = callback
+
+    def event_generate(self, sequence, when=None):
+        with self._lock:
+            self._events.append(sequence)
+        self._wakeup.set()
+
+    def pending_timers(self):
+        return sum(1 for t in self._timers if t[1] not in self._cancelled)
+
+    def run(self, seconds):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            with self._lock:
+                events, self._events = self._events, []
+            for sequence in events:
+                self._bindings[sequence](None)
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, handle, callback = heapq.heappop(self._timers)
+                if handle in self._cancelled:
+                    self._cancelled.discard(handle)
+                    continue
+                callback()
+            timeout = min(end, self._timers[0][0] if self._timers else end) - now
+            self._wakeup.wait(max(0, timeout))
+            self._wakeup.clear()
+
+
+def uniform_timeline(seconds):
+    # The standard expedition with every phase cut to the same length
+    standard = schedule.load()
+    phases = [{'section': standard.sections[i], 'label': standard.labels[i], 'seconds': seconds,
+               'closing': standard.closing[i], 'pause_after': i in standard.pauses} for i in range(len(standard))]
+    return schedule.compile_schedule({'warning_seconds': standard.warning_seconds, 'phases': phases}, 'uniform')
+
+
+def stress(args):
+    # Fire random start/reset/resume/hotkey commands from several threads at
+    # a running engine and check that it never ends up with more than one
+    # active timer loop, never spawns threads and never goes inconsistent.
+    root = FakeRoot()
+    engine = TimerEngine(root.after, root.after_cancel, timeline=uniform_timeline(args.phase_ms / 1000))
+    errors = []
+    handled = [0]
+
+    def check():
+        if engine.paused_for_boss and engine.running:
+            errors.append('running while paused for boss')
+        if not 0 <= engine.phase <= len(engine.timeline):
+            errors.append(f'phase out of range: {engine.phase}')
+        if root.pending_timers() > 1:
+            errors.append(f'{root.pending_timers()} timer loops active')
+
+    def on_command(command):
+        getattr(engine, command)()
+        handled[0] += 1
+        check()
+
+    engine.subscribe(lambda event, phase: check())
+    commands = CommandQueue(root, on_command)
+    baseline_threads = threading.active_count()
+
+    def fire(count):
+        rng = random.Random()
+        for _ in range(count):
+            commands.post(rng.choice(['start', 'reset', 'resume', 'on_hotkey']))
+            time.sleep(rng.random() * 0.002)
+
+    posters = [threading.Thread(target=fire, args=(args.commands,)) for _ in range(args.threads)]
+    for t in posters:
+        t.start()
+    peak_threads = threading.active_count()
+    while any(t.is_alive() for t in posters):
+        root.run(0.05)
+        peak_threads = max(peak_threads, threading.active_count())
+    root.run(0.2)
+    for t in posters:
+        t.join()
+
+    sent = args.commands * args.threads
+    extra_threads = peak_threads - baseline_threads - args.threads
+    print(f"commands sent: {sent}, handled: {handled[0]}")
+    print(f"threads: baseline {baseline_threads}, peak {peak_threads} ({args.threads} posters), extra {extra_threads}")
+    print(f"final state: phase {engine.phase}, running {engine.running}, paused_for_boss {engine.paused_for_boss}")
+    if handled[0] != sent:
+        errors.append(f'lost commands: {sent - handled[0]}')
+    if extra_threads > 0:
+        errors.append(f'{extra_threads} extra threads started')
+    for error in sorted(set(errors)):
+        print(f"FAIL: {error}")
+    if not errors:
+        print("OK")
+    return 1 if errors else 0
+
+
+def legacy_scan(table):
+    # What check_game_focus used to do every second
+    for pid, name in table():
+        if name and name.lower() == GAME_PROCESS:
+            return True
+    return False
+
+
+def measure_watch(process_table, pid_name, seconds):
+    start = time.perf_counter()
+    for _ in range(seconds):
+        legacy_scan(process_table)
+    legacy = time.perf_counter() - start
+
+    watcher = ProcessWatcher(process_table=process_table, pid_name=pid_name)
+    start = time.perf_counter()
+    t = 0.0
+    while t < seconds:
+        watcher.poll()
+        t += watcher.next_interval()
+    cost = time.perf_counter() - start
+    print(f"  legacy: {seconds} scans, {legacy * 1000:.2f} ms")
+    print(f"  watcher: {watcher.scans} scans + {watcher.pid_checks} pid checks, {cost * 1000:.2f} ms")
+
+
+def watch(args):
+    # Simulated overlay uptime with the game running and absent, comparing the
+    # old full scan every second with the watcher
+    if args.real:
+        from nightreigntimers_watch import psutil_pid_name, psutil_process_table
+        print(f"real process table, {args.seconds} s:")
+        measure_watch(psutil_process_table, psutil_pid_name, args.seconds)
+        return 0
+    table = FakeProcessTable(args.processes)
+    for game in (True, False):
+        table.set_game(game)
+        state = "running" if game else "absent"
+        print(f"game {state}, {args.processes} processes, {args.seconds} s:")
+        measure_watch(table, table.pid_name, args.seconds)
+    # The X11 focus thread must end on stop() without an X event to wake it
+    x11 = X11FocusWatcher.__new__(X11FocusWatcher)
+    x11._display = x11._root = QuietXDisplay()
+    x11._X = types.SimpleNamespace(PropertyChangeMask=1 << 22, PropertyNotify=28)
+    x11._title, x11._thread = None, None
+    threads = threading.active_count()
+    x11.start(lambda title: None)
+    started = time.perf_counter()
+    x11.stop()
+    took = time.perf_counter() - started
+    left = threading.active_count() - threads
+    x11._display.close()
+    print(f"X11 focus watcher stop: {took * 1000:.0f} ms with no X events")
+    if left or took > 2 * X11_STOP_WAIT:
+        print("FAIL: X11FocusWatcher.stop left its thread waiting for an X event")
+        return 1
+    print("OK")
+    return 0
+
+
+class QuietXDisplay:
+    # Stands in for an Xlib display (and its root window) that never sends an
+    # event: next_event() blocks on a socket nobody writes to
+    def __init__(self):
+        self._ours, self._theirs = socket.socketpair()
+
+    def change_attributes(self, **attributes):
+        pass
+
+    def fileno(self):
+        return self._ours.fileno()
+
+    def pending_events(self):
+        return 0
+
+    def next_event(self):
+        self._ours.recv(1)
+        raise ConnectionError("X connection closed")
+
+    def close(self):
+        self._theirs.close()
+
+
+class BrokenSink:
+    # A sink whose player is gone
+    name = 'broken'
+
+    def play(self, wav):
+        raise OSError("no such device")
+
+
+def cues(args):
+    # Schedule warning cues on the audio worker and check each fires exactly
+    # once, with how late it was against its deadline
+    sink = NullSink()
+    audio = AudioCues(sink=sink)
+    start = time.monotonic()
+    for i in range(args.count):
+        audio.schedule('warning', start + 0.05 + i * args.spacing_ms / 1000)
+    time.sleep(0.1 + args.count * args.spacing_ms / 1000)
+    audio.close()
+    latencies = sorted(audio.latencies)
+    print(f"cues scheduled: {args.count}, played: {len(sink.played)}")
+    if latencies:
+        print(f"latency ms: p50 {latencies[len(latencies) // 2] * 1000:.3f}, "
+              f"max {latencies[-1] * 1000:.3f}")
+    errors = []
+    if len(sink.played) != args.count:
+        errors.append(f"{len(sink.played)} of {args.count} cues played")
+    # A failing sink falls back to the bell for this cue and the next
+    posted = []
+    audio = AudioCues(sink=BrokenSink(), post=posted.append)
+    logging.disable(logging.ERROR)
+    try:
+        audio.play('warning')
+        time.sleep(0.1)
+        audio.play('warning')
+        time.sleep(0.1)
+    finally:
+        logging.disable(logging.NOTSET)
+        audio.close()
+    if posted != ['bell', 'bell']:
+        errors.append(f"a failing sink left {posted} on the bell, expected two rings")
+    # A player that exits with an error counts as failing
+    player = CommandSink('aplay')
+    player.command = [sys.executable, '-c', 'import sys; sys.exit(1)']
+    try:
+        player.play(b'')
+        errors.append("a player exiting with status 1 passed as played")
+    except subprocess.CalledProcessError:
+        pass
+    # and when the bell fails too the worker stays up for the next cue
+
+    def broken_post(*message):
+        raise RuntimeError("window gone")
+    audio = AudioCues(sink=BrokenSink(), post=broken_post)
+    logging.disable(logging.ERROR)
+    try:
+        audio.play('warning')
+        time.sleep(0.1)
+        audio.play('warning')
+        time.sleep(0.1)
+        alive = audio._thread.is_alive()
+    finally:
+        logging.disable(logging.NOTSET)
+        audio.close()
+    if not alive or audio.sink.name != 'null':
+        errors.append(f"with the bell failing too the worker ended {'on ' + audio.sink.name if alive else 'dead'}")
+    for error in errors:
+        print(f"FAIL: {error}")
+    if not errors:
+        print("OK")
+    return 1 if errors else 0
+
+
+def simulate(frontend, args, runs, trace_allocations=False):
+    scheduler = VirtualScheduler(lateness_ms=args.lateness_ms, jitter_ms=args.jitter_ms, seed=args.seed)
+    app = FRONTENDS[frontend](scheduler, timeline=schedule.load(args.schedule, minute=args.minute))
+    scheduler.wakeups = 0
+    scheduler.tick_costs = []
+    expedition = Expedition(app, scheduler, seed=args.seed, reset_rate=args.reset_rate)
+    if trace_allocations:
+        tracemalloc.start()
+        scheduler.trace_allocations = True
+    start = time.perf_counter()
+    for _ in range(runs):
+        expedition.run()
+    wall = time.perf_counter() - start
+    if trace_allocations:
+        tracemalloc.stop()
+    return app, scheduler, expedition, wall
+
+
+def undo_in_boss_pause():
+    # Reset in the boss pause, then undo: the phase that ran into the pause
+    # must come back finished. Returns the GUI's phase label colours before
+    # the reset and after the undo
+    scheduler = VirtualScheduler()
+    app = FRONTENDS['gui'](scheduler, timeline=schedule.load())
+    app.on_hotkey()
+    while not app.engine.paused_for_boss:
+        app.engine.skip()
+        scheduler.run_for(0)
+    before = [label.cget('bg') for label in app.labels]
+    app.engine.reset()
+    app.engine.undo_reset()
+    scheduler.run_for(0)
+    return before, [label.cget('bg') for label in app.labels]
+
+
+def split_lateness(transition_ms=9, cue_ms=3):
+    # One run without readout where every phase transition wakeup lands
+    # transition_ms late and every warning cue wakeup cue_ms late; returns
+    # the engine, which should have kept the two apart
+    clock = VirtualClock()
+    timeline = uniform_timeline(120)
+    pending = []
+    engine = TimerEngine(lambda ms, callback: pending.append(callback) or callback, pending.remove,
+                         clock=clock, timeline=timeline, readout=False)
+    engine.start()
+    while engine.running or engine.paused_for_boss:
+        if engine.paused_for_boss:
+            engine.resume()
+            continue
+        cue = engine._target - engine.origin in timeline.cues
+        clock.now_ns = engine._target + (cue_ms if cue else transition_ms) * 1_000_000
+        pending.pop()()
+    return engine
+
+
+def sim(args):
+    # Replay whole expeditions on a virtual clock against the real frontend
+    # code with a dummy Tk, and report what each one costs
+    import nightreigntimers_gui
+    import nightreigntimers_overlay
+    import nightreigntimers_render
+    logging.getLogger().setLevel(logging.WARNING)
+    frontends = list(FRONTENDS) if args.frontend == 'all' else [args.frontend]
+    with dummy_tk(nightreigntimers_gui, nightreigntimers_overlay, nightreigntimers_render):
+        for frontend in frontends:
+            app, scheduler, expedition, wall = simulate(frontend, args, args.runs)
+            minutes = expedition.simulated_ns / NS / 60
+            costs = sorted(scheduler.tick_costs)
+            errors = sorted(abs(e) for e in expedition.cue_errors)
+            lateness = sorted(app.engine.lateness)
+            print(f"[{frontend}] {expedition.runs} runs ({expedition.resets} reset early), "
+                  f"{minutes:.0f} simulated minutes in {wall:.2f} s ({minutes * 60 / wall:.0f}x real time)")
+            print(f"  wakeups: {scheduler.wakeups / minutes:.1f} per simulated minute")
+            print(f"  tick cost: p50 {percentile(costs, 0.5) / 1000:.1f} us, "
+                  f"p99 {percentile(costs, 0.99) / 1000:.1f} us")
+            print(f"  cues: {len(errors)} played, timing error p50 {percentile(errors, 0.5) / 1e6:.3f} ms, "
+                  f"max {(errors[-1] if errors else 0) / 1e6:.3f} ms")
+            print(f"  last run transition lateness: p50 {percentile(lateness, 0.5) / 1e6:.2f} ms, "
+                  f"p99 {percentile(lateness, 0.99) / 1e6:.2f} ms")
+            if args.alloc_runs:
+                app, scheduler, expedition, wall = simulate(frontend, args, args.alloc_runs, trace_allocations=True)
+                allocations = sorted(scheduler.tick_allocations)
+                print(f"  allocations: p50 {percentile(allocations, 0.5)} B, "
+                      f"p99 {percentile(allocations, 0.99)} B peak per tick")
+        before, after = undo_in_boss_pause()
+    if args.metrics:
+        print(metrics.REGISTRY.render(), end='')
+    errors = []
+    if before != after:
+        errors.append(f"undo in the boss pause redrew the phases as {after}, expected {before}")
+    engine = split_lateness()
+    timeline = engine.timeline
+    if set(engine.lateness) != {9_000_000} or len(engine.lateness) != len(timeline):
+        errors.append(f"transition lateness {engine.lateness}, expected {len(timeline)} times 9 ms")
+    cues = sum(cue is not None for cue in timeline.cues)
+    if set(engine.cue_lateness) != {3_000_000} or len(engine.cue_lateness) != cues:
+        errors.append(f"cue lateness {engine.cue_lateness}, expected {cues} times 3 ms")
+    for error in errors:
+        print(f"FAIL: {error}")
+    if not errors:
+        print("OK")
+    return 1 if errors else 0
+
+
+def paced_runs(frontend, args, paced, hidden):
+    # Wakeups and Tk calls per simulated minute over whole expeditions,
+    # with the RenderPacing policy or the old one frame per second; hidden
+    # is the overlay withdrawn or the GUI minimized for the whole run
+    import nightreigntimers_engine
+    scheduler = VirtualScheduler(lateness_ms=args.lateness_ms, jitter_ms=args.jitter_ms, seed=args.seed)
+    app = FRONTENDS[frontend](scheduler)
+    if not paced:
+        app.engine.pacing = None
+    scheduler.run_for(0)  # The overlay's game watcher shows it first
+    if hidden and paced and frontend == 'overlay':
+        # Another window in front: the game watcher hides it, and checks less often
+        app.game_watcher.on_focus("Desktop")
+    elif hidden:
+        app.window.withdraw()
+        if paced:
+            app.set_visible(False)
+    scheduler.wakeups = 0
+    engine_wakeups = nightreigntimers_engine.WAKEUPS.value
+    calls = app.view.calls
+    expedition = Expedition(app, scheduler, seed=args.seed, reset_rate=0)
+    for _ in range(args.runs):
+        expedition.run()
+    minutes = expedition.simulated_ns / NS / 60
+    catch_up = None
+    if hidden and paced:
+        # Show again halfway through a closing phase: everything in one frame
+        app.on_hotkey()
+        scheduler.run_for(app.timeline.offsets[1] / NS + app.timeline.durations[1] / 2)
+        before = app.view.calls
+        app.set_visible(True)
+        catch_up = app.view.calls - before
+    return {
+        'wakeups': scheduler.wakeups / minutes,
+        'engine': (nightreigntimers_engine.WAKEUPS.value - engine_wakeups) / minutes,
+        'calls': (app.view.calls - calls - (catch_up or 0)) / minutes,
+        'cue_errors': expedition.cue_errors,
+        'catch_up': catch_up,
+    }
+
+
+# Wakeups per minute of a run under way in the versions before the engine,
+# from their timers: the GUI's 200 ms instruction loop and 100 ms phase loop,
+# the overlay's 200 ms UI loop and 1 s focus check, hidden or not
+ORIGINAL_WAKEUPS = {'gui': 60_000 / 200 + 60_000 / 100, 'overlay': 60_000 / 200 + 60_000 / 1000}
+
+
+def pacing(args):
+    # Before and after the render pacing policy, visible and hidden, against
+    # the original fixed-interval loops
+    import nightreigntimers_gui
+    import nightreigntimers_overlay
+    import nightreigntimers_render
+    logging.getLogger().setLevel(logging.WARNING)
+    frontends = list(FRONTENDS) if args.frontend == 'all' else [args.frontend]
+    errors = []
+    with dummy_tk(nightreigntimers_gui, nightreigntimers_overlay, nightreigntimers_render):
+        for frontend in frontends:
+            print(f"[{frontend}] per simulated minute over {args.runs} expeditions:")
+            print(f"  {'either  original':20}: {ORIGINAL_WAKEUPS[frontend]:6.1f} wakeups (fixed loops, from the code)")
+            for hidden in (False, True):
+                before = paced_runs(frontend, args, False, hidden)
+                after = paced_runs(frontend, args, True, hidden)
+                state = "hidden " if hidden else "visible"
+                for label, result in (("1 fps engine", before), ("paced", after)):
+                    print(f"  {state} {label:12}: {result['wakeups']:6.1f} wakeups ({result['engine']:.1f} engine), "
+                          f"{result['calls']:6.1f} Tk calls")
+                    if any(abs(error) > 1_000_000 for error in result['cue_errors']):
+                        errors.append(f"{frontend} {state} {label}: warning cues off their deadlines")
+                if hidden and after['wakeups'] > 10:
+                    errors.append(f"{frontend} hidden: {after['wakeups']:.1f} wakeups a minute with nothing to draw")
+                if after['catch_up'] is not None:
+                    print(f"  shown again mid-phase: {after['catch_up']} Tk calls in one frame")
+    for error in errors:
+        print(f"FAIL: {error}")
+    if not errors:
+        print("OK")
+    return 1 if errors else 0
+
+
+def record_history(path, args):
+    # args.runs expeditions on a virtual clock recorded through RunHistory,
+    # ending about now: boss fights of 1 to 3 minutes, a break between runs,
+    # some runs reset part way and some of those resets undone. Returns what
+    # the summary should find and the time spent recording each event
+    clock = VirtualClock()
+    scheduler = DeadlineScheduler(clock)
+    engine = TimerEngine(scheduler.after, scheduler.cancel, clock=clock, readout=False)
+    rng = random.Random(args.seed)
+    wall_start = time.time_ns() - args.runs * 40 * 60 * NS  # Roughly ending now
+    recorder = run_history.RunHistory(path, wall=lambda: wall_start + clock.now_ns)
+    costs = []
+    record = recorder.on_timer_event
+
+    def timed(event, phase):
+        start = time.perf_counter_ns()
+        record(event, phase)
+        costs.append(time.perf_counter_ns() - start)
+    recorder.on_timer_event = timed
+    recorder.attach(engine)
+    expected = {'runs': 0, 'completed': 0, 'aborted': 0}
+    pending = []
+
+    def next_run():
+        if expected['runs'] == args.runs:
+            return
+        expected['runs'] += 1
+        engine.start()
+        if rng.random() < args.reset_rate:
+            pending.append(scheduler.after(rng.uniform(0, engine.timeline.total) * 1000, reset))
+
+    def after_run():
+        while pending:
+            scheduler.cancel(pending.pop())
+        pending.append(scheduler.after(rng.uniform(60, 1200) * 1000, next_run))
+
+    def reset():
+        pending.clear()
+        engine.reset()
+        expected['aborted'] += 1
+        if rng.random() < args.undo_rate:
+            pending.append(scheduler.after(5000, undo))
+        else:
+            after_run()
+
+    def undo():
+        pending.clear()
+        engine.undo_reset()
+        expected['aborted'] -= 1
+        if engine.paused_for_boss:
+            # Its resume may have come and gone during the reset
+            scheduler.after(rng.uniform(0, 60) * 1000, engine.resume)
+
+    def on_event(event, phase):
+        if event == 'boss':
+            scheduler.after(rng.uniform(60, 180) * 1000, engine.resume)
+        elif event == 'done':
+            expected['completed'] += 1
+            after_run()
+    engine.subscribe(on_event)
+    next_run()
+    while (deadline := scheduler.next_deadline()) is not None:
+        clock.now_ns = deadline
+        scheduler.run_due(deadline)
+    recorder.close()
+    if expected['runs'] < args.runs:
+        raise RuntimeError(f"the simulation stalled after {expected['runs']} runs")
+    return expected, costs
+
+
+def history(args):
+    # What the run history costs: recording, file size, and summarizing all
+    # of it or only the last 30 days found through the index. Then a torn
+    # record and a lagging index are repaired on the next open.
+    errors = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'history.bin')
+        start = time.perf_counter()
+        expected, costs = record_history(path, args)
+        wall = time.perf_counter() - start
+        costs.sort()
+        size = os.path.getsize(path)
+        index_size = os.path.getsize(path + run_history.INDEX_SUFFIX)
+        print(f"{expected['runs']} runs recorded in {wall:.1f} s: {size // run_history.RECORD_SIZE} records, "
+              f"{size / 1024:.0f} KB + {index_size / 1024:.0f} KB index, {size / expected['runs']:.0f} bytes per run")
+        print(f"  per engine event: p50 {percentile(costs, 0.5) / 1000:.1f} us, "
+              f"p99 {percentile(costs, 0.99) / 1000:.1f} us")
+        modes = [False]
+        try:
+            import numpy  # noqa: F401
+            modes.append(True)
+        except ImportError:
+            print("  (numpy not installed: plain memoryview columns only)")
+        with run_history.HistoryReader(path) as reader:
+            since = reader.starts[-1] - run_history.SUMMARY_DAYS * 86_400_000
+            best_ms = {}  # label -> the best run's time, found through best_run()
+            for use_numpy in modes:
+                label = "numpy" if use_numpy else "plain"
+                for scope, begin in (("all", None), (f"last {run_history.SUMMARY_DAYS} days", since)):
+                    start = time.perf_counter_ns()
+                    summary = reader.summary(begin, timeline=schedule.load(), use_numpy=use_numpy)
+                    cost = time.perf_counter_ns() - start
+                    print(f"  summary of {scope} ({summary['runs']} runs), {label}: {cost / 1e6:.1f} ms")
+                    if begin is None:
+                        found = {key: summary[key] for key in expected}
+                        if found != expected:
+                            errors.append(f"{label} summary found {found}, expected {expected}")
+                        fastest = summary['best_run_ms']
+                start = time.perf_counter_ns()
+                best = reader.best_run(schedule.load(), use_numpy=use_numpy)
+                cost = time.perf_counter_ns() - start
+                print(f"  best run ({best}), {label}: {cost / 1e6:.1f} ms")
+                best_ms[label] = next((record[5] for record in reader.run_records(best)
+                                       if record[3] == run_history.DONE), None) if best is not None else None
+            for label, ms in best_ms.items():
+                if ms != fastest:
+                    errors.append(f"{label} best run took {ms} ms, the summary's best is {fastest}")
+            print("\n".join("  | " + line for line in run_history.format_summary(summary, schedule.load())))
+        # A crash mid-write: half a record at the end, the index a few runs behind
+        with open(path, 'ab') as f:
+            f.write(b'\0' * 5)
+        os.truncate(path + run_history.INDEX_SUFFIX, index_size - 3 * run_history.INDEX_SIZE)
+        run_history.RunHistory(path).close()
+        with run_history.HistoryReader(path) as reader:
+            if reader.runs() != expected['runs'] or os.path.getsize(path) != size:
+                errors.append(f"after repair: {reader.runs()} runs, {os.path.getsize(path)} bytes")
+    for error in errors:
+        print(f"FAIL: {error}")
+    if not errors:
+        print("OK")
+    return 1 if errors else 0
+
+
+def replay_reference(reference, extra_boss_ms=0):
+    # One run that fights each boss extra_boss_ms longer than the reference
+    # did; returns the pace delta at the start of each phase and at the end
+    clock = VirtualClock()
+    scheduler = DeadlineScheduler(clock)
+    engine = TimerEngine(scheduler.after, scheduler.cancel, clock=clock, timeline=reference.timeline, readout=False)
+    tracker = run_pace.PaceTracker(engine, reference)
+    deltas = []
+
+    def on_event(event, phase):
+        if event == 'boss':
+            scheduler.after(reference.boss_ms.get(phase, 60_000) + extra_boss_ms, engine.resume)
+        elif event == 'phase':
+            deltas.append(tracker.delta_ns()[1])
+    engine.subscribe(on_event)
+    engine.start()
+    while (deadline := scheduler.next_deadline()) is not None:
+        clock.now_ns = deadline
+        scheduler.run_due(deadline)
+    return deltas, tracker.final_ns
+
+
+def time_readouts(tracker, clock, calls, step_ns):
+    # ns per readout() with the clock moving step_ns between calls, the
+    # bytes the pace module still holds afterwards (its cached readout),
+    # and the peak of everything allocated meanwhile
+    begin = clock.now_ns
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        clock.now_ns += step_ns
+        tracker.readout()
+    cost = (time.perf_counter_ns() - start) / calls
+    clock.now_ns = begin
+    tracemalloc.start()
+    tracker.readout()
+    base = tracemalloc.get_traced_memory()[0]
+    for _ in range(calls):
+        clock.now_ns += step_ns
+        tracker.readout()
+    peak = tracemalloc.get_traced_memory()[1]
+    held = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, run_pace.__file__)])
+    tracemalloc.stop()
+    return cost, sum(stat.size for stat in held.statistics('filename')), peak - base
+
+
+def first_personal_best(path):
+    # From an empty history: the first run has nothing to compare with, and
+    # the second is compared with the first from its start. Returns the pace
+    # line during each
+    reference = run_pace.load_reference('best', schedule.load(), path)
+    scheduler = VirtualScheduler()
+    recorder = run_history.RunHistory(path)
+    app = FRONTENDS['gui'](scheduler, reference=reference, history=recorder)
+    expedition = Expedition(app, scheduler, reset_rate=0)
+    lines = []
+    try:
+        for _ in range(2):
+            app.on_hotkey()
+            scheduler.run_for(30)
+            lines.append(app.pace.readout()[0])
+            app.engine.reset()
+            expedition.run()
+            scheduler.run_for(0)  # The history's run end, after the frame
+    finally:
+        recorder.close()
+    return lines
+
+
+def paced_against(frontend, args, reference):
+    scheduler = VirtualScheduler(lateness_ms=args.lateness_ms, jitter_ms=args.jitter_ms, seed=args.seed)
+    app = FRONTENDS[frontend](scheduler, reference=reference)
+    scheduler.run_for(0)
+    scheduler.wakeups = 0
+    scheduler.tick_costs = []
+    calls = app.view.calls
+    expedition = Expedition(app, scheduler, seed=args.seed, reset_rate=args.reset_rate)
+    for _ in range(args.sim_runs):
+        expedition.run()
+    minutes = expedition.simulated_ns / NS / 60
+    return sorted(scheduler.tick_costs), scheduler.wakeups / minutes, (app.view.calls - calls) / minutes
+
+
+def pace(args):
+    # What the live pace comparison costs: loading the personal best out of
+    # a history, readout() per frame in a phase and in a boss fight (time
+    # and allocations), and whole expeditions in the Tk frontends with and
+    # without it. Replaying the reference's own boss times must come out
+    # level, and slower fights behind by as much.
+    import nightreigntimers_gui
+    import nightreigntimers_overlay
+    import nightreigntimers_render
+    logging.getLogger().setLevel(logging.WARNING)
+    errors = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'history.bin')
+        args.undo_rate = 0
+        record_history(path, args)
+        start = time.perf_counter_ns()
+        reference = run_pace.Reference.from_history(path, schedule.load())
+        cost = time.perf_counter_ns() - start
+    if reference is None:
+        print("FAIL: no completed run to take the personal best of")
+        return 1
+    print(f"personal best of {args.runs} runs ({run_history.format_ms(reference.run_ms)}) loaded in {cost / 1e6:.1f} ms")
+
+    with tempfile.TemporaryDirectory() as directory, \
+            dummy_tk(nightreigntimers_gui, nightreigntimers_overlay, nightreigntimers_render):
+        first, second = first_personal_best(os.path.join(directory, 'history.bin'))
+    print(f"from an empty history: first run {first!r}, second run {second!r}")
+    if first != run_pace.NO_REFERENCE[0] or not second.startswith(run_pace.PACE):
+        errors.append("the first completed run did not become the personal best for the second")
+
+    deltas, level = replay_reference(reference)
+    final = level
+    if max(abs(delta) for delta in deltas) > NS // 2 or abs(final) > NS // 2:
+        errors.append(f"replaying the reference: deltas up to {max(map(abs, deltas)) / NS:.3f} s, "
+                      f"finished {final / NS:+.3f} s")
+    slower = 10_000
+    deltas, final = replay_reference(reference, slower)
+    expected = slower * 1_000_000 * len(reference.boss_ms)
+    if abs(final - expected) > NS // 2:
+        errors.append(f"{slower / 1000:.0f} s slower boss fights finished {final / NS:+.1f} s, "
+                      f"expected {expected / NS:+.1f} s")
+    print(f"replays: own boss times finish {run_pace.format_delta(round(level / NS))}, "
+          f"{slower / 1000:.0f} s slower fights {run_pace.format_delta(round(final / NS))} "
+          f"({len(reference.boss_ms)} fights)")
+
+    clock = VirtualClock()
+    scheduler = DeadlineScheduler(clock)
+    engine = TimerEngine(scheduler.after, scheduler.cancel, clock=clock, timeline=reference.timeline)
+    tracker = run_pace.PaceTracker(engine, reference)
+    engine.start()
+    clock.now_ns += 30 * NS
+    for state in ("phase", "boss fight"):
+        if state == "boss fight":
+            while not engine.paused_for_boss:
+                clock.now_ns = scheduler.next_deadline()
+                scheduler.run_due(clock.now_ns)
+        per_call, held, peak = time_readouts(tracker, clock, args.calls, 1_000_000)
+        print(f"readout() in a {state}: {per_call:.0f} ns per call, {held} B held afterwards, {peak} B peak "
+              f"over {args.calls} calls")
+        # At most the one cached readout, however many calls
+        if held > 256:
+            errors.append(f"readout() in a {state} holds {held} B after {args.calls} calls")
+
+    with dummy_tk(nightreigntimers_gui, nightreigntimers_overlay, nightreigntimers_render):
+        for frontend in FRONTENDS:
+            print(f"[{frontend}] {args.sim_runs} expeditions, best of {args.repeats}:")
+            results = {}
+            # Alternated and the best median kept, so a busy moment on the machine doesn't count against one side
+            for _ in range(args.repeats):
+                for label, against in (("without pace", None), ("with pace", reference)):
+                    result = paced_against(frontend, args, against)
+                    if label not in results or percentile(result[0], 0.5) < percentile(results[label][0], 0.5):
+                        results[label] = result
+            for label, (costs, wakeups, calls) in results.items():
+                print(f"  {label:12}: tick p50 {percentile(costs, 0.5) / 1000:.1f} us, "
+                      f"p99 {percentile(costs, 0.99) / 1000:.1f} us, {wakeups:.1f} wakeups and "
+                      f"{calls:.1f} Tk calls per simulated minute")
+            extra = percentile(results["with pace"][0], 0.5) - percentile(results["without pace"][0], 0.5)
+            if extra > args.budget_us * 1000:
+                errors.append(f"{frontend}: pace adds {extra / 1000:.1f} us to the median tick "
+                              f"(budget {args.budget_us} us)")
+    for error in errors:
+        print(f"FAIL: {error}")
+    if not errors:
+        print("OK")
+    return 1 if errors else 0
+
+
+def trace(args):
+    # What the always-on event trace costs: per event against the DEBUG
+    # logging line it stands in for, events per minute of a replayed
+    # expedition (so how much of a run the ring holds), and dumping a full
+    # ring to Chrome trace JSON
+    import io
+    import json
+    import nightreigntimers_gui
+    import nightreigntimers_overlay
+    import nightreigntimers_render
+    import nightreigntimers_trace as tracing
+    logging.getLogger().setLevel(logging.WARNING)
+    recorder = tracing.Trace()
+    logger = logging.getLogger('nightreigntimers.bench')
+    logger.propagate = False
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+
+    def empty(kind, a=None, b=None):
+        pass
+
+    def log(kind, a=None, b=None):
+        logger.debug(f"{kind}: late {a / 1e6:.3f} ms, cost {b / 1000:.1f} us")
+    print(f"per event, {args.events} events:")
+    for label, call in (("empty call", empty), ("trace record", recorder.record), ("logging.debug", log)):
+        start = time.perf_counter_ns()
+        for i in range(args.events):
+            call(tracing.WAKEUP, i, 1234)
+        print(f"  {label:14} {(time.perf_counter_ns() - start) / args.events:7.0f} ns")
+
+    errors = []
+    with dummy_tk(nightreigntimers_gui, nightreigntimers_overlay, nightreigntimers_render):
+        for frontend in FRONTENDS:
+            tracing.TRACE.events.clear()
+            scheduler = VirtualScheduler(lateness_ms=1.0, jitter_ms=4.0, seed=args.seed)
+            app = FRONTENDS[frontend](scheduler)
+            expedition = Expedition(app, scheduler, seed=args.seed, reset_rate=0)
+            expedition.run()
+            events = tracing.TRACE.events.copy()
+            minutes = expedition.simulated_ns / NS / 60
+            if len(events) == events.maxlen:
+                errors.append(f"{frontend}: one expedition overflowed the {events.maxlen} event ring")
+                continue
+            print(f"[{frontend}] {len(events) / minutes:.0f} events per minute of a run, "
+                  f"the ring holds the last {events.maxlen / (len(events) / minutes):.0f} minutes")
+            while len(events) < events.maxlen:
+                events.extend(list(events)[:events.maxlen - len(events)])
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'trace.json')
+                start = time.perf_counter_ns()
+                tracing.TRACE.dump(path, app.timeline.title, events)
+                cost = time.perf_counter_ns() - start
+                size = os.path.getsize(path)
+                with open(path, encoding='utf-8') as f:
+                    dumped = json.load(f)['traceEvents']
+            spans = sum(1 for event in dumped if event['ph'] == 'X' and event['tid'] == 0)
+            print(f"  full ring dump: {cost / 1e6:.0f} ms, {size / 1024:.0f} KB, {len(dumped)} trace events, "
+                  f"{spans} phase spans")
+            if not spans:
+                errors.append(f"{frontend}: no phase spans in the dump")
+    for error in errors:
+        print(f"FAIL: {error}")
+    if not errors:
+        print("OK")
+    return 1 if errors else 0
+
+
+# Runs a Tk frontend as its main() would for a while, with a run going,
+# then reports what it cost; without a display only the imports are counted
+FOOTPRINT_TK = """
+import importlib.util, sys, time
+import nightreigntimers_startup as startup
+import tkinter as tk
+import nightreigntimers_schedule as schedule
+import {module} as frontend
+
+def report(prefix=''):
+    print(f"{{prefix}}peak_rss_mb={{startup.peak_rss_mb():.1f}} cpu_s={{time.process_time():.3f}}", file=sys.stderr)
+
+try:
+    window = tk.Tk()
+except tk.TclError:
+    report('no_display ')
+    raise SystemExit
+app = frontend.{cls}(window, timeline=schedule.load(minute={minute}))
+if importlib.util.find_spec('keyboard'):
+    try:
+        app.hotkeys.register(startup.timed_import('keyboard'))
+    except Exception:
+        pass
+if hasattr(app, 'start_tray') and importlib.util.find_spec('pystray'):
+    window.after_idle(app.start_tray)
+app.engine.start()
+window.after({ms}, window.quit)
+window.mainloop()
+report()
+"""
+
+
+def parse_footprint(text):
+    for line in text.splitlines():
+        if 'peak_rss_mb=' in line:
+            fields = dict(field.split('=') for field in line.split() if '=' in field)
+            return float(fields['peak_rss_mb']), float(fields['cpu_s']), line.startswith('no_display')
+    return None
+
+
+def run_in_pty(command, rows=30, columns=100):
+    # The terminal frontend needs a real terminal: give it a pseudo-terminal
+    # and throw away what it draws; its report goes to stderr
+    import fcntl
+    import pty
+    import struct
+    import subprocess
+    import termios
+    master, slave = pty.openpty()
+    fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack('HHHH', rows, columns, 0, 0))
+    process = subprocess.Popen(command, stdin=slave, stdout=slave, stderr=subprocess.PIPE,
+                               env=dict(os.environ, TERM=os.environ.get('TERM', 'xterm-256color')))
+    os.close(slave)
+    drawn = []
+
+    def drain():
+        while True:
+            try:
+                data = os.read(master, 65536)
+            except OSError:
+                break
+            if not data:
+                break
+            drawn.append(len(data))
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    stderr = process.communicate()[1].decode(errors='replace')
+    os.close(master)
+    return stderr, sum(drawn)
+
+
+def footprint(args):
+    # Peak RSS and CPU time of each frontend over the same stretch of a run
+    # (a sped-up schedule so every kind of event shows up), side by side
+    import subprocess
+    import sys
+    here = os.path.dirname(os.path.abspath(__file__))
+    rows = []
+    if os.name == 'posix':
+        stderr, drawn = run_in_pty([sys.executable, os.path.join(here, 'nightreigntimers_term.py'),
+                                    '--profile', str(args.seconds), '--minute', str(args.minute), '--no-bell'])
+        result = parse_footprint(stderr)
+        if result is None:
+            print(f"term: failed\n{stderr}")
+            return 1
+        rows.append(('term', *result, f"{drawn / args.seconds:.0f} bytes/s to the terminal"))
+    else:
+        print("term: needs a POSIX pseudo-terminal to measure")
+    for name, module, cls in (('gui', 'nightreigntimers_gui', 'NIGHTREIGNTimers'),
+                              ('overlay', 'nightreigntimers_overlay', 'OverlayTimers')):
+        code = FOOTPRINT_TK.format(module=module, cls=cls, minute=args.minute, ms=int(args.seconds * 1000))
+        completed = subprocess.run([sys.executable, '-c', code], cwd=here, capture_output=True, text=True)
+        result = parse_footprint(completed.stderr)
+        if result is None:
+            print(f"{name}: failed\n{completed.stderr[-2000:]}")
+            return 1
+        rows.append((name, *result, "imports only, no display" if result[2] else ""))
+    base = rows[0][1] if rows and rows[0][0] == 'term' else None
+    print(f"{'frontend':10} {'peak RSS':>10} {'CPU':>8}")
+    for name, rss, cpu, _, note in rows:
+        ratio = f" ({rss / base:.1f}x term)" if base and name != 'term' else ""
+        print(f"{name:10} {rss:7.1f} MB {cpu:6.2f} s{ratio}  {note}")
+    return 0
+
+
+def replay_frames(renderer, view):
+    # Send a renderer what the overlay sends it over one expedition, one
+    # frame per second: safe phases green, closing phases flashing red
+    from nightreigntimers_render import CLOSING, FLASH, SAFE
+    durations = [int(d) for d in schedule.load().durations]
+    total = sum(durations)
+    run_elapsed = 0
+    renderer.reset("idle")
+    for phase, duration in enumerate(durations):
+        renderer.phase(f"Phase {phase + 1}", duration, total)
+        for second in range(duration):
+            if phase % 2 == 0:
+                color = SAFE
+            else:
+                color = CLOSING if second % 2 == 0 else FLASH
+            with renderer.frame():
+                renderer.progress(second, run_elapsed, color)
+                renderer.status(f"{(duration - second) // 60:02}:{(duration - second) % 60:02} remaining")
+            view.end_tick()
+            run_elapsed += 1
+
+
+def frames(args):
+    # Frame cost of each overlay renderer on the overlay's own borderless,
+    # topmost, translucent window. Each frame flushes with update_idletasks()
+    # so Tk's redraw is part of its cost. Without a display this falls back
+    # to a dummy Tk, which still shows how many Tk calls each frame makes.
+    import nightreigntimers_render as render
+    make_window = None
+    if not args.dummy:
+        import tkinter
+        try:
+            tkinter.Tk().destroy()
+            make_window = tkinter.Tk
+        except tkinter.TclError as e:
+            print(f"no display ({e}), using a dummy Tk: Tk call counts only")
+    renderers = list(render.RENDERERS) if args.renderer == 'all' else [args.renderer]
+    with contextlib.ExitStack() as stack:
+        if make_window is None:
+            stack.enter_context(dummy_tk(render))
+            make_window = lambda: DummyRoot(VirtualScheduler())
+        for name in renderers:
+            window = make_window()
+            render.setup_window(window)
+            view = WidgetView()
+            renderer = render.RENDERERS[name](window, view, window.destroy)
+            window.update()
+            renderer.flush = True
+            for _ in range(args.runs):
+                replay_frames(renderer, view)
+            window.destroy()
+            print(f"[{name}] {view.calls_per_tick():.2f} Tk calls per frame (max {view.max_tick_calls})")
+            print(f"  frame cost: {renderer.stats.summary()}")
+    return 0
+
+
+async def run_daemon(args, directory):
+    loop = asyncio.get_running_loop()
+    server = TimerDaemon(loop, uniform_timeline(args.phase_ms / 1000))
+    sent = []  # perf_counter_ns of each broadcast
+    broadcast = server.broadcast
+
+    def timed_broadcast(message):
+        sent.append(time.perf_counter_ns())
+        broadcast(message)
+    server.broadcast = timed_broadcast
+
+    if hasattr(socket, 'AF_UNIX') and os.name != 'nt':
+        address = os.path.join(directory, 'daemon.sock')
+    else:
+        address = ('127.0.0.1', 0)
+    lines, ws = await server.serve(address, ws_port=0)
+    if not isinstance(address, str):
+        address = lines.sockets[0].getsockname()[:2]
+    ws_port = ws.sockets[0].getsockname()[1]
+
+    # Only the daemon's own page, local files and non-browsers get a WebSocket
+    errors = []
+    for origin, allowed in ((None, True), ('null', True), (f"http://localhost:{ws_port}", True),
+                            ('https://example.com', False), (f"http://127.0.0.1:{ws_port + 1}", False)):
+        probe = StandInClient()
+        try:
+            await probe.connect_ws('127.0.0.1', ws_port, origin=origin)
+        except ConnectionError:
+            if allowed:
+                errors.append(f"WebSocket with Origin {origin} refused")
+        else:
+            if not allowed:
+                errors.append(f"WebSocket with Origin {origin} accepted")
+        probe.close()
+    # and a web page posting commands to the line protocol is hung up on
+    probe = StandInClient()
+    await probe.connect_line(address)
+    probe._writer.write(b"POST / HTTP/1.1\r\nHost: 127.0.0.1:8764\r\nContent-Type: text/plain\r\n"
+                        b"Content-Length: 6\r\n\r\nstart\n")
+    try:
+        await asyncio.wait_for(probe._reader.read(), 2)
+    except asyncio.TimeoutError:
+        errors.append("the line protocol kept an HTTP request's connection open")
+    probe.close()
+    if server.engine.running:
+        errors.append("an HTTP request started the timer through the line protocol")
+
+    clients = []
+    for i in range(args.clients):
+        client = StandInClient()
+        if i % 2:
+            await client.connect_ws('127.0.0.1', ws_port)
+        else:
+            await client.connect_line(address)
+        clients.append(client)
+    readers = [asyncio.create_task(client.run()) for client in clients]
+    await asyncio.sleep(0.05)
+
+    engine = server.engine
+    start = time.perf_counter()
+    await clients[0].send('start')
+    while time.perf_counter() - start < 60:
+        await asyncio.sleep(0.01)
+        if engine.paused_for_boss:
+            await clients[-1].send('hotkey')
+            while engine.paused_for_boss:
+                await asyncio.sleep(0.001)
+        if engine.phase >= len(engine.timeline):
+            break
+    await asyncio.sleep(0.1)
+    for client in clients:
+        client.close()
+    await asyncio.gather(*readers)
+    lines.close()
+    ws.close()
+    return server, clients, sent, errors
+
+
+def daemon(args):
+    # Run the timer daemon on a fast schedule with stand-in clients, half on
+    # the Unix socket and half on the WebSocket, and check they all saw the
+    # whole run and how long each broadcast took to reach every one of them
+    with tempfile.TemporaryDirectory() as directory:
+        server, clients, sent, errors = asyncio.run(run_daemon(args, directory))
+    expected = 1 + server.broadcasts
+    for i, client in enumerate(clients):
+        if len(client.messages) != expected:
+            errors.append(f"client {i} ({client.framing}) got {len(client.messages)} of {expected} messages")
+        if client.state.get('status') != 'idle' or client.state.get('phase') != len(server.engine.timeline):
+            errors.append(f"client {i} ({client.framing}) ended in {client.state.get('status')}, "
+                          f"phase {client.state.get('phase')}")
+    fanout = []
+    for k, when in enumerate(sent):
+        arrivals = [client.arrivals[k + 1] for client in clients if len(client.arrivals) > k + 1]
+        if arrivals:
+            fanout.append(max(arrivals) - when)
+    fanout.sort()
+    print(f"clients: {len(clients)}, broadcasts: {server.broadcasts}, engine wakeups: {server.engine.wakeups}")
+    print(f"bytes per client per broadcast: {server.bytes_sent / max(1, server.broadcasts * len(clients)):.0f}")
+    print(f"broadcast to last client: p50 {percentile(fanout, 0.5) / 1e6:.2f} ms, "
+          f"p99 {percentile(fanout, 0.99) / 1e6:.2f} ms, max {(fanout[-1] if fanout else 0) / 1e6:.2f} ms")
+    for error in errors[:10]:
+        print(f"FAIL: {error}")
+    if not errors:
+        print("OK")
+    return 1 if errors else 0
+
+
+def follow_synthetic(fired, fps):
+    # Feed the synthetic cues to PhaseSync on 1 s phases as they would
+    # arrive, on the frame that completes the hold, and check the run is
+    # lined up with the frame each was first seen on, not the arrival
+    import nightreigntimers_detect as detection
+    clock = VirtualClock()
+    scheduler = DeadlineScheduler(clock)
+    engine = TimerEngine(scheduler.after, scheduler.cancel, clock=clock, timeline=uniform_timeline(1), readout=False)
+    sync = detection.PhaseSync(engine)
+    period = NS // fps
+    errors = []
+    for index, cue, seen in sorted((index, cue, seen) for index, _, cue, _, seen in fired):
+        arrival = index * period
+        while (deadline := scheduler.next_deadline()) is not None and deadline <= arrival:
+            clock.now_ns = deadline
+            scheduler.run_due()
+        clock.now_ns = arrival
+        action = sync.on_detection(cue, seen * period)
+        began = engine.origin + engine.timeline.offsets[engine.phase]
+        if action is not None and began != seen * period:
+            errors.append(f"{cue} ({action}) started phase {engine.phase} at {began / NS:.2f} s, "
+                          f"first seen at {seen * period / NS:.2f} s")
+    actions = [action for _, _, action in sync.log]
+    if actions != ['start', 'resume', 'resync 5', None]:
+        errors.append(f"PhaseSync took {actions}, expected start, resume, resync 5 and nothing")
+    return errors
+
+
+def detect(args):
+    # Cost of frame detection over a folder of sample frames against the
+    # frame budget at --fps on one core: PNG decode and crop, then the
+    # downsampling and template matching. With --worker the folder also goes
+    # through the detector process at --fps to check it keeps up there.
+    # --synthetic draws its own frames and templates instead, with cues
+    # that must fire (or not) on given frames, then follows them with PhaseSync.
+    for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[name] = '1'  # Before numpy is imported
+    with contextlib.ExitStack() as stack:
+        try:
+            if args.synthetic:
+                directory = stack.enter_context(tempfile.TemporaryDirectory())
+                args.frames, args.templates = synthetic_frames(directory)
+            elif args.frames is None:
+                print("give a folder of frames, or --synthetic")
+                return 2
+            detector = detection.Detector(*detection.load_templates(args.templates))
+            source = detection.FolderSource(args.frames, detector)
+        except detection.DetectError as e:
+            print(e)
+            return 1
+        return measure_detection(args, detector, source)
+
+
+def measure_detection(args, detector, source):
+    read_costs, match_costs, fired = [], [], []
+    for index, path in enumerate(source.paths):
+        start = time.perf_counter_ns()
+        crops = source.read()
+        middle = time.perf_counter_ns()
+        fired.extend((index, path, cue, score, seen) for cue, seen, score in detector.process(crops, index))
+        read_costs.append(middle - start)
+        match_costs.append(time.perf_counter_ns() - middle)
+    totals = sorted(r + m for r, m in zip(read_costs, match_costs))
+    read_costs.sort()
+    match_costs.sort()
+    budget = NS / args.fps
+    print(f"frames: {len(totals)}, regions: {', '.join(detector.used)}, templates: {len(detector.templates)}")
+    for label, costs in (("decode+crop", read_costs), ("match", match_costs), ("total", totals)):
+        print(f"  {label:12} p50 {percentile(costs, 0.5) / 1e6:.2f} ms, p99 {percentile(costs, 0.99) / 1e6:.2f} ms, "
+              f"max {costs[-1] / 1e6:.2f} ms")
+    print(f"  one core keeps up with {NS / (sum(totals) / len(totals)):.0f} fps (budget {budget / 1e6:.0f} ms "
+          f"at {args.fps:g} fps)")
+    for index, path, cue, score, seen in fired:
+        print(f"  frame {index} ({os.path.basename(path)}): {cue}, score {score:.2f}, first seen on frame {seen}")
+    errors = []
+    if percentile(totals, 0.99) > budget:
+        errors.append(f"p99 frame cost {percentile(totals, 0.99) / 1e6:.1f} ms is over the {budget / 1e6:.0f} ms budget")
+    if args.synthetic:
+        found = [(seen, cue) for _, _, cue, _, seen in fired]
+        if found != SYNTHETIC_FIRES:
+            errors.append(f"cues fired as {found}, expected {SYNTHETIC_FIRES} (first frame, cue)")
+        else:
+            errors.extend(follow_synthetic(fired, args.fps))
+    if args.worker:
+        worker = detection.DetectorWorker(lambda *message: None, args.frames, args.templates, args.fps).start()
+        worker._thread.join()
+        worker.stop()
+        print(f"worker: {worker.summary()}")
+        if worker.error:
+            errors.append(f"worker: {worker.error}")
+        elif worker.late:
+            errors.append(f"worker fell behind on {worker.late} frames")
+    for error in errors:
+        print(f"FAIL: {error}")
+    if not errors:
+        print("OK")
+    return 1 if errors else 0
+
+
+def load_sessions(count, readout, seed, minute):
+    # count sessions started over the first minute on a virtual clock, each
+    # resumed after a boss fight of 1 to 3 minutes, all on one scheduler.
+    # Returns the bytes tracemalloc saw them take and the scheduler's cost.
+    import nightreigntimers_sessions as sessions
+    clock = VirtualClock()
+    service = sessions.SessionService(clock=clock, minute=minute, max_sessions=count)
+    scheduler = service.scheduler
+    rng = random.Random(seed)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(count):
+        session = service.open(f"player-{i}")
+        session.engine.readout = readout
+
+        def on_boss(event, phase, engine=session.engine):
+            if event == 'boss':
+                scheduler.after(rng.uniform(60, 180) * 1000, engine.resume)
+        session.engine.subscribe(on_boss)
+        scheduler.after(rng.uniform(0, 60) * 1000, session.engine.start)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    batches = []  # (callbacks run, perf_counter_ns) per scheduler wakeup
+    start = time.perf_counter_ns()
+    while (deadline := scheduler.next_deadline()) is not None:
+        clock.now_ns = deadline
+        batch = time.perf_counter_ns()
+        scheduler.run_due(deadline)
+        batches.append(time.perf_counter_ns() - batch)
+    wall = time.perf_counter_ns() - start
+    unfinished = sum(1 for session in service.sessions.values()
+                     if session.engine.phase != len(session.engine.timeline))
+    return memory, scheduler.fired, len(batches), wall, clock.now_ns, unfinished
+
+
+class ReplyRecorder:
+    # Stands in for a session client's Connection, keeping what it is sent
+    def __init__(self):
+        self.replies = []
+
+    def send(self, data):
+        self.replies.append(json.loads(data))
+        return True
+
+
+def malformed_session_messages():
+    # Messages a client could send that must get an error reply, not end
+    # the connection. Returns the ones that didn't
+    import nightreigntimers_sessions as sessions
+    service = sessions.SessionService()
+    messages = [b'not json', b'[]', b'{"session": "alice"}', b'{"session": [1], "command": "start"}',
+                b'{"session": {}, "command": "open"}', b'{"session": null, "command": "close"}',
+                ('{"session": "%s", "command": "open"}' % ('x' * 100)).encode(),
+                b'{"session": "alice", "command": "open", "schedule": []}',
+                b'{"session": "alice", "command": "resync", "args": [{}]}']
+    failed = []
+    for message in messages:
+        client = ReplyRecorder()
+        try:
+            service.handle_message(client, message)
+        except Exception as e:
+            failed.append(f"{message!r} raised {e!r}")
+            continue
+        if len(client.replies) != 1 or 'error' not in client.replies[0]:
+            failed.append(f"{message!r} answered {client.replies}")
+    return failed
+
+
+async def live_sessions(count, minute):
+    # The same load on the real asyncio loop with a sped-up schedule:
+    # process CPU time, and how late phase transitions landed
+    import nightreigntimers_sessions as sessions
+    loop = asyncio.get_running_loop()
+    service = sessions.SessionService(loop, minute=minute, max_sessions=count)
+    rng = random.Random(0)
+    done = asyncio.Event()
+    finished = []
+    for i in range(count):
+        engine = service.open(f"player-{i}").engine
+
+        def on_event(event, phase, engine=engine):
+            if event == 'boss':
+                service.scheduler.after(rng.uniform(1, 3) * minute * 1000, engine.resume)
+            elif event == 'done':
+                finished.append(engine)
+                if len(finished) == count:
+                    done.set()
+        engine.subscribe(on_event)
+        service.scheduler.after(rng.uniform(0, minute) * 1000, engine.start)
+    service._arm()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    await asyncio.wait_for(done.wait(), 60 * minute + 60)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - start
+    lateness = sorted(late for engine in finished for late in engine.lateness)
+    return cpu, wall, lateness
+
+
+def sessions(args):
+    # Many headless sessions on one shared deadline heap: memory per
+    # session, and what driving them costs. Virtual time replays whole
+    # expeditions for every session; the live pass runs them for real on
+    # the asyncio loop with a sped-up schedule. --ticks-up-to adds, for
+    # the smaller counts, the cost with per-second readout wakeups as in a
+    # windowed frontend, which is what one Tk process per timer pays.
+    # Malformed messages are checked first.
+    errors = [f"malformed message {failure}" for failure in malformed_session_messages()]
+    for count in args.counts:
+        memory, fired, batches, wall, simulated, unfinished = load_sessions(count, False, args.seed,
+                                                                            schedule.MINUTE)
+        hours = simulated / NS / 3600
+        print(f"[{count} sessions] {memory / count / 1024:.1f} KB per session, "
+              f"{fired} deadlines ({fired / count:.0f} per session) over {hours:.2f} simulated hours")
+        print(f"  scheduler: {batches} wakeups, {wall / max(1, fired) / 1000:.1f} us per deadline, "
+              f"{wall / 1e6 / (hours * 60):.2f} ms CPU per simulated minute for all sessions")
+        if count <= args.ticks_up_to:
+            _, tick_fired, _, tick_wall, _, _ = load_sessions(count, True, args.seed, schedule.MINUTE)
+            print(f"  with 1 s readout ticks: {tick_fired} deadlines, "
+                  f"{tick_wall / 1e6 / (hours * 60):.2f} ms CPU per simulated minute")
+        cpu, live_wall, lateness = asyncio.run(live_sessions(count, args.live_minute))
+        print(f"  live ({args.live_minute:g} s per game minute): {cpu / live_wall * 100:.1f}% of one core, "
+              f"transition lateness p50 {percentile(lateness, 0.5) / 1e6:.2f} ms, "
+              f"p99 {percentile(lateness, 0.99) / 1e6:.2f} ms")
+        if unfinished:
+            errors.append(f"{unfinished} of {count} sessions did not finish")
+    for error in errors:
+        print(f"FAIL: {error}")
+    if not errors:
+        print("OK")
+    return 1 if errors else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NIGHTREIGN Timers benchmarks")
+    sub = parser.add_subparsers(dest='bench', required=True)
+    p = sub.add_parser('stress', help="hammer the command queue from several threads")
+    p.add_argument('--threads', type=int, default=4)
+    p.add_argument('--commands', type=int, default=250, help="commands per thread")
+    p.add_argument('--phase-ms', type=float, default=20, help="phase duration in milliseconds")
+    p.set_defaults(func=stress)
+    p = sub.add_parser('watch', help="game process detection scan cost")
+    p.add_argument('--processes', type=int, default=300)
+    p.add_argument('--seconds', type=int, default=600, help="simulated uptime")
+    p.add_argument('--real', action='store_true', help="scan the real process table with psutil")
+    p.set_defaults(func=watch)
+    p = sub.add_parser('cues', help="audio cue deadline accuracy")
+    p.add_argument('--count', type=int, default=50)
+    p.add_argument('--spacing-ms', type=float, default=20)
+    p.set_defaults(func=cues)
+    p = sub.add_parser('sim', help="replay expeditions on a virtual clock with a dummy Tk")
+    p.add_argument('--frontend', choices=['all'] + list(FRONTENDS), default='all')
+    p.add_argument('--runs', type=int, default=200)
+    p.add_argument('--alloc-runs', type=int, default=5, help="runs to repeat under tracemalloc (0 to skip)")
+    p.add_argument('--schedule', default=schedule.DEFAULT_SCHEDULE)
+    p.add_argument('--minute', type=float, default=schedule.MINUTE, help="seconds per game minute")
+    p.add_argument('--lateness-ms', type=float, default=1.0, help="fixed after() lateness")
+    p.add_argument('--jitter-ms', type=float, default=4.0, help="random extra after() lateness")
+    p.add_argument('--reset-rate', type=float, default=0.1, help="fraction of runs reset early")
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--metrics', action='store_true', help="print the metrics registry afterwards")
+    p.set_defaults(func=sim)
+    p = sub.add_parser('pacing', help="wakeups and Tk calls per minute with and without render pacing")
+    p.add_argument('--frontend', choices=['all'] + list(FRONTENDS), default='all')
+    p.add_argument('--runs', type=int, default=5)
+    p.add_argument('--lateness-ms', type=float, default=1.0, help="fixed after() lateness")
+    p.add_argument('--jitter-ms', type=float, default=4.0, help="random extra after() lateness")
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=pacing)
+    p = sub.add_parser('history', help="run history recording cost, file size and summary speed")
+    p.add_argument('--runs', type=int, default=20_000)
+    p.add_argument('--reset-rate', type=float, default=0.2, help="fraction of runs reset part way")
+    p.add_argument('--undo-rate', type=float, default=0.1, help="fraction of resets undone")
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=history)
+    p = sub.add_parser('pace', help="live pace comparison cost per frame, and a check of its deltas")
+    p.add_argument('--runs', type=int, default=500, help="runs in the history the personal best comes from")
+    p.add_argument('--reset-rate', type=float, default=0.1, help="fraction of runs reset part way")
+    p.add_argument('--calls', type=int, default=200_000, help="readout() calls timed in each state")
+    p.add_argument('--sim-runs', type=int, default=5, help="expeditions replayed per frontend")
+    p.add_argument('--repeats', type=int, default=3, help="times each frontend is replayed with and without")
+    p.add_argument('--budget-us', type=float, default=10, help="most the comparison may add to the median tick")
+    p.add_argument('--lateness-ms', type=float, default=1.0, help="fixed after() lateness")
+    p.add_argument('--jitter-ms', type=float, default=4.0, help="random extra after() lateness")
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=pace)
+    p = sub.add_parser('trace', help="event trace cost per event, run coverage of the ring and dump cost")
+    p.add_argument('--events', type=int, default=200_000, help="events recorded for the per-event cost")
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=trace)
+    p = sub.add_parser('footprint', help="peak RSS and CPU of the terminal frontend against the Tk ones")
+    p.add_argument('--seconds', type=float, default=10, help="how long each frontend runs")
+    p.add_argument('--minute', type=float, default=1, help="seconds per game minute")
+    p.set_defaults(func=footprint)
+    p = sub.add_parser('frames', help="overlay frame cost, canvas renderer against widgets")
+    p.add_argument('--renderer', choices=['all', 'canvas', 'widgets'], default='all')
+    p.add_argument('--runs', type=int, default=3, help="expeditions replayed per renderer")
+    p.add_argument('--dummy', action='store_true', help="use a dummy Tk even if a display is available")
+    p.set_defaults(func=frames)
+    p = sub.add_parser('daemon', help="timer daemon push updates to many stand-in clients")
+    p.add_argument('--clients', type=int, default=50)
+    p.add_argument('--phase-ms', type=float, default=300, help="phase duration in milliseconds")
+    p.set_defaults(func=daemon)
+    p = sub.add_parser('sessions', help="many headless sessions on one scheduler: memory and overhead")
+    p.add_argument('--counts', type=int, nargs='+', default=[10, 100, 1000])
+    p.add_argument('--ticks-up-to', type=int, default=100, help="largest count to also run with readout ticks")
+    p.add_argument('--live-minute', type=float, default=0.2, help="seconds per game minute in the live pass")
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=sessions)
+    p = sub.add_parser('detect', help="frame detection cost over a folder of sample frames")
+    p.add_argument('frames', nargs='?', help="folder of captured frames (PNG)")
+    p.add_argument('--synthetic', action='store_true',
+                   help="draw frames and templates with known cues and check what fires, and PhaseSync")
+    p.add_argument('--templates', default=detection.TEMPLATES_DIR, metavar='DIR')
+    p.add_argument('--fps', type=float, default=10, help="frame rate the detector must keep up with")
+    p.add_argument('--worker', action='store_true', help="also run the folder through the detector process")
+    p.set_defaults(func=detect)
+    args = parser.parse_args()
+    raise SystemExit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,606 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from nightreigntimers_engine import COMMANDS, NS, TimerEngine
+from nightreigntimers_hotkeys import HotkeyDispatcher, parse_bindings
+import nightreigntimers_detect as detect
+import nightreigntimers_history as run_history
+import nightreigntimers_metrics as metrics
+import nightreigntimers_trace as tracing
+import nightreigntimers_schedule as schedule
+from nightreigntimers_startup import timed_import
+
+SOCKET_PATH = os.path.join(tempfile.gettempdir(), f"nightreigntimers-{getattr(os, 'getuid', lambda: 0)()}.sock")
+LINE_PORT = 8764  # Line protocol over TCP where there are no Unix sockets
+WS_PORT = 8765
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+MAX_FRAME = 64 * 1024  # Commands are tiny; anything bigger from a client is a protocol error
+MAX_BACKLOG = 256 * 1024  # A client this far behind on reading gets dropped
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '[::1]')
+HTTP_METHODS = (b'GET ', b'POST ', b'PUT ', b'HEAD ', b'OPTIONS ', b'DELETE ', b'PATCH ')
+CLIENT_COMMANDS = COMMANDS + ('hotkey',)
+
+_MISSING = object()
+
+BROADCASTS = metrics.counter('nightreign_daemon_broadcasts_total', "State messages pushed to clients")
+BROADCAST_BYTES = metrics.counter('nightreign_daemon_bytes_total', "Bytes queued to clients")
+
+# Served on http://127.0.0.1:WS_PORT/ for an OBS browser source
+OVERLAY_PAGE = b"""<!doctype html>
+<meta charset="utf-8">
+<title>NIGHTREIGN Timers</title>
+<style>
+body { margin: 0; font: bold 20px "Segoe UI", sans-serif; color: #fff; background: transparent; }
+#bar { height: 12px; width: 0; background: #00aa00; }
+#bar.closing { background: #ff2222; }
+</style>
+<div id="title"></div><div id="bar"></div><div id="time"></div>
+<script>
+let state = {};
+const two = n => String(n).padStart(2, "0");
+const fmt = s => two(Math.floor(s / 60)) + ":" + two(Math.floor(s % 60));
+function draw() {
+  const phases = state.schedule ? state.schedule.phases : [];
+  const phase = phases[state.phase];
+  const title = document.getElementById("title"), bar = document.getElementById("bar");
+  const time = document.getElementById("time");
+  if (!phase || state.status === "idle") { title.textContent = ""; time.textContent = ""; bar.style.width = 0; return; }
+  const elapsed = state.elapsed / 1000;
+  title.textContent = (phase[0] ? phase[0] + ": " : "") + phase[1];
+  bar.className = phase[3] ? "closing" : "";
+  bar.style.width = Math.min(100, 100 * elapsed / phase[2]) + "%";
+  time.textContent = state.status === "boss" ? "Boss fight" :
+                     state.status === "paused" ? "Paused" : fmt(Math.max(0, phase[2] - elapsed)) + " remaining";
+}
+function connect() {
+  const ws = new WebSocket("ws://" + location.host + "/");
+  ws.onmessage = e => { const m = JSON.parse(e.data); if (m.full) state = {}; Object.assign(state, m); draw(); };
+  ws.onclose = () => setTimeout(connect, 1000);
+}
+connect();
+</script>
+"""
+
+
+def default_address():
+    # Unix socket path, or (host, port) on platforms without AF_UNIX
+    if hasattr(socket, 'AF_UNIX') and sys.platform != 'win32':
+        return SOCKET_PATH
+    return ('127.0.0.1', LINE_PORT)
+
+
+def parse_address(text):
+    # --socket/--connect value: a socket path, or a TCP port without Unix sockets
+    if not text:
+        return default_address()
+    if isinstance(default_address(), str):
+        return text
+    return ('127.0.0.1', int(text))
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':')).encode()
+
+
+def timeline_spec(timeline):
+    # Enough of a Timeline for a client to rebuild it
+    return {
+        'name': timeline.name,
+        'warning_seconds': timeline.warning_seconds,
+        'phases': [[timeline.sections[i], timeline.labels[i], timeline.durations[i], timeline.closing[i],
+                    i in timeline.pauses] for i in range(len(timeline))],
+    }
+
+
+def timeline_from_spec(spec):
+    return schedule.Timeline(spec['name'], [tuple(phase) for phase in spec['phases']], spec['warning_seconds'])
+
+
+def engine_state(engine):
+    # What a client draws from, apart from elapsed which is sent separately
+    if engine.paused_for_boss:
+        status = 'boss'
+    elif engine.paused:
+        status = 'paused'
+    elif engine.running:
+        status = 'running'
+    else:
+        status = 'idle'
+    return {'status': status, 'phase': engine.phase, 'warned': engine.warned}
+
+
+def valid_resync(args):
+    # [phase] or [phase, clock ns or null] from a client
+    if not isinstance(args, list) or not 1 <= len(args) <= 2:
+        return False
+    return type(args[0]) is int and all(a is None or type(a) is int for a in args[1:])
+
+
+def ws_frame(payload, opcode=0x1):
+    # Unmasked, unfragmented server frame
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_ws_frame(reader):
+    # (opcode, payload) of the next frame; client frames are masked
+    first, second = await reader.readexactly(2)
+    opcode = first & 0x0f
+    length = second & 0x7f
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    if length > MAX_FRAME:
+        raise ConnectionError(f"frame of {length} bytes")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+def ws_accept(key):
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+
+
+def ws_origin_allowed(origin, port):
+    # Browsers say which page opens a WebSocket. Let in the daemon's own page,
+    # local files (OBS sends null or file://) and clients that send none, so
+    # that any other web site can't drive the timer through localhost
+    if origin is None or origin == 'null' or origin.startswith('file://'):
+        return True
+    return origin.lower() in [f"http://{host}:{port}" for host in LOOPBACK_HOSTS]
+
+
+def looks_like_http(line):
+    # A web page can POST to the line port too, with commands in the body;
+    # its request line gives it away
+    return line.startswith(HTTP_METHODS) or b' HTTP/1.' in line
+
+
+class Connection:
+    # One connected client; send() only queues on the transport, so a
+    # broadcast never waits on a slow reader
+    def __init__(self, writer, framing):
+        self.writer = writer
+        self.framing = framing
+        self.peer = writer.get_extra_info('peername') or 'unix'
+
+    def send(self, data):
+        if self.writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+            logging.warning(f"Dropping client {self.peer}: not reading its updates")
+            self.writer.close()
+            return False
+        self.writer.write(ws_frame(data) if self.framing == 'ws' else data + b'\n')
+        return True
+
+
+class TimerDaemon:
+    # The one authoritative timer for every window, overlay, browser source
+    # and script on this machine. Runs a TimerEngine on an asyncio loop:
+    # engine wakeups are loop.call_later(), global hotkeys arrive through
+    # call_soon_threadsafe(). Whatever the engine emits while handling one
+    # wakeup or command is collected, then the state that changed goes out
+    # once, as a single JSON message encoded once for all clients:
+    #
+    #   {"events": [["phase_end", 0], ["phase", 1], ["tick", 1]], "phase": 1, "elapsed": 0}
+    #
+    # A client first gets the full state, with "full": true and the
+    # schedule. "elapsed" (ms into the phase) is in every message. Clients
+    # send {"command": "start"} or just the command name, one per line or
+    # WebSocket text frame; resync also takes "args": [phase, clock ns].
+
+    def __init__(self, loop, timeline=None, audio=None, bindings=None, clock=None):
+        self.loop = loop
+        self.engine = TimerEngine(self._schedule, self._cancel, clock=clock, timeline=timeline)
+        self.engine.subscribe(self.on_timer_event)
+        self.audio = audio
+        self.hotkeys = HotkeyDispatcher(self.post, bindings, clock=self.engine.clock)
+        self.phase_sync = None  # PhaseSync while following the game's screen, see --detect
+        self.clients = set()
+        metrics.gauge('nightreign_daemon_clients', "Connected clients", lambda: len(self.clients))
+        self.state = {}
+        self.broadcasts = 0
+        self.bytes_sent = 0
+        self._events = []
+        self._flush_pending = False
+
+    def _schedule(self, ms, callback):
+        return self.loop.call_later(ms / 1000, callback)
+
+    def _cancel(self, handle):
+        handle.cancel()
+
+    def post(self, command, *args):
+        # Safe from any thread, e.g. the keyboard hook
+        self.loop.call_soon_threadsafe(self.on_command, command, *args)
+
+    def on_command(self, command, *args):
+        if command == 'key':
+            if not self.hotkeys.accept(*args):
+                return
+            command = args[0]
+        if command == 'hotkey':
+            self.engine.on_hotkey()
+        elif command in COMMANDS:
+            getattr(self.engine, command)()
+        elif command == 'resync':
+            self.engine.resync(*args)
+        elif command == 'detect':
+            if self.phase_sync is not None:
+                self.phase_sync.on_detection(*args)
+        elif command == 'trace':
+            print(f"Saving the event trace to {tracing.save(self.engine.timeline.title)}")
+
+    def on_timer_event(self, event, phase):
+        self._events.append([event, phase])
+        if self.audio is not None:
+            if event in ('reset', 'pause'):
+                self.audio.cancel_all()
+            elif event in ('phase', 'unpause', 'restore'):
+                self.audio.cancel_all()
+                delay = self.engine.warning_in(self.engine.clock())
+                if delay is not None:
+                    self.audio.schedule('warning', self.audio.clock() + delay)
+        if not self._flush_pending:
+            self._flush_pending = True
+            self.loop.call_soon(self.flush)
+
+    def elapsed_ms(self):
+        return int(self.engine.elapsed() * 1000)
+
+    def snapshot(self):
+        return dict(engine_state(self.engine), full=True, schedule=timeline_spec(self.engine.timeline), elapsed=self.elapsed_ms())
+
+    def flush(self):
+        self._flush_pending = False
+        state = engine_state(self.engine)
+        message = {key: value for key, value in state.items() if self.state.get(key, _MISSING) != value}
+        self.state = state
+        message['elapsed'] = self.elapsed_ms()
+        if self._events:
+            message['events'], self._events = self._events, []
+        self.broadcast(message)
+        self.hotkeys.rendered()
+
+    def broadcast(self, message):
+        data = encode(message)
+        self.broadcasts += 1
+        BROADCASTS.inc()
+        for client in list(self.clients):
+            if client.send(data):
+                self.bytes_sent += len(data)
+                BROADCAST_BYTES.inc(len(data))
+            else:
+                self.clients.discard(client)
+
+    def handle_message(self, data):
+        text = data.decode('utf-8', 'replace').strip()
+        if not text:
+            return
+        args = ()
+        try:
+            if text.startswith('{'):
+                message = json.loads(text)
+                command, args = message.get('command'), message.get('args', ())
+            else:
+                command = text
+        except (ValueError, AttributeError):
+            command = None
+        if command in CLIENT_COMMANDS and not args:
+            self.on_command(command)
+        elif command == 'resync' and valid_resync(args):
+            self.on_command(command, *args)
+        else:
+            logging.debug(f"Ignoring client message {text[:80]!r}")
+
+    def _join(self, client):
+        client.send(encode(self.snapshot()))
+        self.clients.add(client)
+
+    async def handle_line(self, reader, writer):
+        client = Connection(writer, 'line')
+        self._join(client)
+        try:
+            first = await reader.readline()
+            if looks_like_http(first):
+                logging.warning(f"Dropping client {client.peer}: sent HTTP to the line protocol")
+                return
+            self.handle_message(first)
+            async for line in reader:
+                self.handle_message(line)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    async def handle_ws(self, reader, writer):
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode('latin-1').split('\r\n')
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if headers.get('upgrade', '').lower() != 'websocket' or not key:
+            # Plain HTTP: hand out the browser source page
+            if lines[0].startswith('GET / '):
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n"
+                             b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(OVERLAY_PAGE) + OVERLAY_PAGE)
+            else:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            writer.close()
+            return
+        origin = headers.get('origin')
+        if not ws_origin_allowed(origin, writer.get_extra_info('sockname')[1]):
+            logging.warning(f"Refusing a WebSocket from {origin!r}")
+            writer.write(b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            writer.close()
+            return
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {ws_accept(key)}\r\n\r\n").encode())
+        client = Connection(writer, 'ws')
+        self._join(client)
+        try:
+            while True:
+                opcode, payload = await read_ws_frame(reader)
+                if opcode == 0x1:
+                    self.handle_message(payload)
+                elif opcode == 0x8:
+                    writer.write(ws_frame(payload[:2], 0x8))
+                    break
+                elif opcode == 0x9:
+                    writer.write(ws_frame(payload, 0xA))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    async def serve(self, address=None, ws_port=WS_PORT, ws_host='127.0.0.1'):
+        # Start both listeners; returns the servers (ws_port 0 picks a free port)
+        address = address if address is not None else default_address()
+        if isinstance(address, str):
+            _clear_stale_socket(address)
+            lines = await asyncio.start_unix_server(self.handle_line, path=address)
+        else:
+            lines = await asyncio.start_server(self.handle_line, *address)
+        ws = await asyncio.start_server(self.handle_ws, ws_host, ws_port)
+        return lines, ws
+
+
+def _clear_stale_socket(path):
+    # A socket file left by a daemon that died; refuse if one is still listening
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+    else:
+        raise RuntimeError(f"a timer daemon is already listening on {path}")
+    finally:
+        probe.close()
+
+
+def connect(address=None, timeout=2.0):
+    address = address if address is not None else default_address()
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+    else:
+        sock = socket.create_connection(address, timeout)
+    sock.settimeout(None)
+    return sock
+
+
+class RemoteEngine:
+    # Takes TimerEngine's place in a frontend connected to the daemon, so
+    # the Tk windows become thin clients. The daemon's full state is read
+    # on construction, so the schedule is known before any widget is built.
+    # listen(post) then starts a reader thread that hands each message to
+    # the Tk thread as post('remote', message); the frontend passes it to
+    # apply(), which updates the mirrored state and replays the daemon's
+    # events to the listeners. Commands go back over the socket.
+    #
+    # The daemon plays the warning cues, so warning_in() is always None.
+
+    def __init__(self, address=None, clock=time.monotonic_ns):
+        self.address = address if address is not None else default_address()
+        self.clock = clock
+        self.timeline = None
+        self.phase = 0
+        self.running = False
+        self.paused = False
+        self.paused_for_boss = False
+        self.warned = False
+        self._elapsed_ns = 0
+        self._received = 0
+        self._listeners = []
+        self._sock = connect(self.address)
+        self._file = self._sock.makefile('rb')
+        self.apply(json.loads(self._file.readline()))
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def listen(self, post):
+        threading.Thread(target=self._run, args=(post,), name='daemon-client', daemon=True).start()
+
+    def _run(self, post):
+        try:
+            for line in self._file:
+                post('remote', json.loads(line))
+        except (OSError, ValueError):
+            pass
+        logging.warning("Lost the connection to the timer daemon")
+        post('remote', {'status': 'idle', 'elapsed': 0, 'events': [['reset', 0]]})
+
+    def apply(self, message):
+        # Runs on the Tk thread
+        if message.get('full'):
+            self.timeline = timeline_from_spec(message['schedule'])
+        if 'status' in message:
+            status = message['status']
+            self.running = status == 'running'
+            self.paused = status == 'paused'
+            self.paused_for_boss = status == 'boss'
+        self.phase = message.get('phase', self.phase)
+        self.warned = message.get('warned', self.warned)
+        if 'elapsed' in message:
+            self._elapsed_ns = message['elapsed'] * 1_000_000
+            self._received = self.clock()
+        for event, phase in message.get('events', ()):
+            for listener in self._listeners:
+                listener(event, phase)
+
+    def send(self, command, *args):
+        message = {'command': command, 'args': list(args)} if args else {'command': command}
+        self._sock.sendall(encode(message) + b'\n')
+
+    def close(self):
+        self._sock.close()
+
+    # --- Commands, executed by the daemon ---
+
+    def on_hotkey(self):
+        self.send('hotkey')
+
+    def start(self):
+        self.send('start')
+
+    def resume(self):
+        self.send('resume')
+
+    def reset(self):
+        self.send('reset')
+
+    def undo_reset(self):
+        self.send('undo_reset')
+
+    def pause(self):
+        self.send('pause')
+
+    def skip(self):
+        self.send('skip')
+
+    def refresh(self):
+        # The daemon paces itself; updates keep arriving as they are
+        pass
+
+    def resync(self, phase, at=None):
+        # The clock is monotonic_ns on both ends, which every local process shares
+        self.send('resync', phase, at)
+
+    # --- Queries (seconds), as TimerEngine ---
+
+    def duration(self):
+        return self.timeline.durations[min(self.phase, len(self.timeline) - 1)]
+
+    def elapsed(self, now=None):
+        if not self.running:
+            return self._elapsed_ns / NS
+        if now is None:
+            now = self.clock()
+        return min((self._elapsed_ns + now - self._received) / NS, self.duration())
+
+    def remaining(self, now=None):
+        return self.duration() - self.elapsed(now)
+
+    def run_elapsed(self, now=None):
+        return self.timeline.offsets[min(self.phase, len(self.timeline))] / NS + self.elapsed(now)
+
+    def warning_in(self, now=None):
+        return None
+
+    def is_closing(self, phase=None):
+        if phase is None:
+            phase = self.phase
+        return self.timeline.closing[min(phase, len(self.timeline) - 1)]
+
+    def format_jitter_report(self):
+        return "measured by the daemon"
+
+
+async def run(args, timeline, bindings):
+    loop = asyncio.get_running_loop()
+    audio = None
+    if not args.no_audio:
+        from nightreigntimers_audio import AudioCues
+        audio = AudioCues()
+    daemon = TimerDaemon(loop, timeline, audio=audio, bindings=bindings)
+    history = run_history.start_from_arguments(args)
+    if history is not None:
+        history.attach(daemon.engine)
+    address = parse_address(args.socket)
+    servers = await daemon.serve(address, args.ws_port)
+    if not args.no_hotkeys:
+        daemon.hotkeys.register(timed_import('keyboard'))
+    daemon.phase_sync, detector = detect.start_from_arguments(args, daemon.engine, daemon.post)
+    print(f"Timer daemon on {address} and ws://127.0.0.1:{args.ws_port}/ (schedule {timeline.name})")
+    try:
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+    finally:
+        if detector is not None:
+            detector.stop()
+        if history is not None:
+            history.close()
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NIGHTREIGN Timers daemon: one timer shared by every window")
+    parser.add_argument('--socket', help=f"Unix socket path (default {default_address()}), or a TCP port on Windows")
+    parser.add_argument('--ws-port', type=int, default=WS_PORT, help="localhost WebSocket and browser source port")
+    parser.add_argument('--no-audio', action='store_true', help="don't play the storm warning")
+    parser.add_argument('--no-hotkeys', action='store_true', help="don't hook the global hotkeys")
+    parser.add_argument('--hotkey', action='append', metavar='ACTION=KEY',
+                        help="rebind a hotkey (actions: hotkey, pause, skip, undo_reset, trace)")
+    schedule.add_arguments(parser)
+    metrics.add_arguments(parser)
+    detect.add_arguments(parser)
+    run_history.add_arguments(parser)
+    args = parser.parse_args()
+    try:
+        bindings = parse_bindings(args.hotkey)
+    except ValueError as e:
+        parser.error(str(e))
+    timeline = schedule.from_arguments(parser, args)
+    metrics.start_from_arguments(args)
+    try:
+        asyncio.run(run(args, timeline, bindings))
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        parser.exit(1, f"{e}\n")
+
+
+if __name__ == "__main__":
+    main()
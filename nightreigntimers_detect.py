@@ -0,0 +1,499 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+from nightreigntimers_startup import data_dir, timed_import
+import nightreigntimers_trace as tracing
+
+TEMPLATES_DIR = os.path.join(data_dir(), 'nightreigntimers_templates')
+TEMPLATES_FILE = 'templates.json'
+
+# Regions of interest as (x, y, width, height) fractions of the game frame,
+# with the size each one is averaged down to before matching. Measured on
+# 16:9 captures; another layout can override them in templates.json.
+REGIONS = {
+    'banner': {'box': (0.30, 0.36, 0.40, 0.16), 'size': (24, 96)},  # "DAY I" / "DAY II" title card
+    'storm': {'box': (0.76, 0.03, 0.22, 0.08), 'size': (16, 64)},  # Storm closing notice, top right
+}
+# Cue -> region it shows up in
+CUES = {
+    'day1': 'banner',
+    'day2': 'banner',
+    'closing': 'storm',
+}
+SLACK = 3  # Pixels of movement (after downsampling) a template may be found at
+THRESHOLD = 0.8  # Normalized cross-correlation a match needs
+HOLD_FRAMES = 2  # Consecutive matching frames before a cue fires
+REARM_FRAMES = 10  # Consecutive non-matching frames before it can fire again
+FPS = 10
+STATS_EVERY = 50  # Worker frames between stats messages
+
+
+class DetectError(RuntimeError):
+    pass
+
+
+def need_numpy():
+    try:
+        return timed_import('numpy')
+    except ImportError:
+        raise DetectError("frame detection needs numpy (pip install numpy pillow)") from None
+
+
+def need(module, what):
+    try:
+        return timed_import(module)
+    except ImportError:
+        raise DetectError(f"{what} needs the {module} module") from None
+
+
+def pixel_box(box, width, height):
+    x, y, w, h = box
+    left, top = int(x * width), int(y * height)
+    return left, top, max(1, int(w * width)), max(1, int(h * height))
+
+
+def gray(pixels):
+    # Mean of the colour channels: the same for RGB(A) and BGRA captures
+    np = need_numpy()
+    if pixels.ndim == 2:
+        return pixels.astype(np.float32)
+    return pixels[..., :3].mean(axis=2, dtype=np.float32)
+
+
+def downsample(pixels, size):
+    # Block-average a region to (height, width) = size: a strided mean by the
+    # largest whole factor, then a nearest pick for the remainder
+    np = need_numpy()
+    pixels = gray(pixels)
+    height, width = size
+    factor = max(1, min(pixels.shape[0] // height, pixels.shape[1] // width))
+    if factor > 1:
+        h, w = pixels.shape[0] // factor, pixels.shape[1] // factor
+        pixels = pixels[:h * factor, :w * factor].reshape(h, factor, w, factor).mean(axis=(1, 3))
+    rows = np.linspace(0, pixels.shape[0] - 1, height).round().astype(np.intp)
+    cols = np.linspace(0, pixels.shape[1] - 1, width).round().astype(np.intp)
+    return pixels[np.ix_(rows, cols)]
+
+
+def normalize(template):
+    # Zero mean, unit norm, so matching is a single dot product per offset
+    np = need_numpy()
+    template = template.astype(np.float32) - template.mean()
+    norm = float(np.sqrt((template * template).sum()))
+    if norm < 1e-3:
+        raise DetectError("template has no contrast")
+    return template / norm
+
+
+def match(region, template):
+    # Best normalized cross-correlation of a normalized template over every
+    # offset within the region, all offsets at once on a strided view
+    np = need_numpy()
+    windows = np.lib.stride_tricks.sliding_window_view(region, template.shape)
+    n = template.size
+    sums = windows.sum(axis=(2, 3))
+    squares = np.einsum('ijkl,ijkl->ij', windows, windows)
+    dots = np.einsum('ijkl,kl->ij', windows, template)  # The template's zero mean cancels the window mean
+    variance = np.maximum(squares - sums * sums / n, 1e-6)
+    return float((dots / np.sqrt(variance)).max())
+
+
+class Template:
+    def __init__(self, cue, region, pixels, threshold=THRESHOLD):
+        self.cue = cue
+        self.region = region
+        self.pixels = normalize(pixels)
+        self.threshold = threshold
+
+
+def load_templates(directory=TEMPLATES_DIR):
+    # templates.json: {"regions": {...overrides...}, "templates": {cue: {"image": file, "threshold": x}}}
+    # Images are the downsampled grey regions cropped by SLACK on each side,
+    # as written by make_template().
+    np = need_numpy()
+    image = need('PIL.Image', "reading templates")
+    path = os.path.join(directory, TEMPLATES_FILE)
+    try:
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+    except OSError as e:
+        raise DetectError(f"cannot read templates from {path}: {e.strerror}") from None
+    except json.JSONDecodeError as e:
+        raise DetectError(f"{path}: {e}") from None
+    regions = {name: dict(region) for name, region in REGIONS.items()}
+    for name, region in config.get('regions', {}).items():
+        regions.setdefault(name, {}).update(region)
+    templates = []
+    for cue, spec in config.get('templates', {}).items():
+        region = spec.get('region', CUES.get(cue))
+        if region not in regions:
+            raise DetectError(f"{path}: template {cue!r} has no known region")
+        with image.open(os.path.join(directory, spec['image'])) as picture:
+            pixels = np.asarray(picture.convert('L'), dtype=np.float32)
+        height, width = regions[region]['size']
+        if pixels.shape != (height - 2 * SLACK, width - 2 * SLACK):
+            raise DetectError(f"{path}: template {cue!r} is {pixels.shape[1]}x{pixels.shape[0]}, "
+                              f"expected {width - 2 * SLACK}x{height - 2 * SLACK} for region {region!r}")
+        templates.append(Template(cue, region, pixels, spec.get('threshold', THRESHOLD)))
+    if not templates:
+        raise DetectError(f"{path}: no templates")
+    return regions, templates
+
+
+def make_template(frame_path, cue, directory=TEMPLATES_DIR, region=None, threshold=THRESHOLD):
+    # Cut a template for cue out of a frame captured while it is on screen
+    np = need_numpy()
+    image = need('PIL.Image', "making templates")
+    region = region or CUES[cue]
+    path = os.path.join(directory, TEMPLATES_FILE)
+    config = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+    spec = dict(REGIONS.get(region, {}), **config.get('regions', {}).get(region, {}))
+    with image.open(frame_path) as picture:
+        frame = np.asarray(picture.convert('RGB'))
+    left, top, width, height = pixel_box(spec['box'], frame.shape[1], frame.shape[0])
+    pixels = downsample(frame[top:top + height, left:left + width], spec['size'])[SLACK:-SLACK, SLACK:-SLACK]
+    os.makedirs(directory, exist_ok=True)
+    name = f"{cue}.png"
+    image.fromarray(pixels.round().astype(np.uint8)).save(os.path.join(directory, name))
+    config.setdefault('templates', {})[cue] = {'image': name, 'region': region, 'threshold': threshold}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    return os.path.join(directory, name)
+
+
+class Detector:
+    # Matches every template against its downsampled region of a frame and
+    # turns the scores into cue edges: a cue fires once, stamped with the
+    # first frame of a run of HOLD_FRAMES matches, and only fires again
+    # after REARM_FRAMES frames without it. Banners fade in and out, so
+    # single-frame flickers are never reported.
+
+    def __init__(self, regions, templates, hold=HOLD_FRAMES, rearm=REARM_FRAMES):
+        self.regions = regions
+        self.templates = templates
+        self.hold = hold
+        self.rearm = rearm
+        self.used = sorted({template.region for template in templates})
+        self._seen = {template.cue: 0 for template in templates}
+        self._missed = {template.cue: rearm for template in templates}
+        self._since = {}
+        self.scores = {}
+
+    def boxes(self, width, height):
+        # Pixel box of each region in use, for sources that grab regions directly
+        return {name: pixel_box(self.regions[name]['box'], width, height) for name in self.used}
+
+    def crop(self, frame):
+        height, width = frame.shape[:2]
+        return {name: frame[top:top + h, left:left + w]
+                for name, (left, top, w, h) in self.boxes(width, height).items()}
+
+    def process(self, crops, seen_ns):
+        # crops: region name -> pixels. Returns [(cue, first seen ns, score)]
+        small = {name: downsample(crops[name], self.regions[name]['size']) for name in self.used}
+        fired = []
+        for template in self.templates:
+            score = match(small[template.region], template.pixels)
+            self.scores[template.cue] = score
+            cue = template.cue
+            if score >= template.threshold:
+                if self._seen[cue] == 0:
+                    self._since[cue] = seen_ns
+                self._seen[cue] += 1
+                if self._seen[cue] == self.hold and self._missed[cue] >= self.rearm:
+                    fired.append((cue, self._since[cue], score))
+                if self._seen[cue] >= self.hold:
+                    self._missed[cue] = 0
+            else:
+                self._seen[cue] = 0
+                self._missed[cue] += 1
+        return fired
+
+
+# --- Frame sources, opened inside the worker process ---
+
+class FolderSource:
+    # Recorded frames: image files in name order, one per worker frame, so
+    # a folder captured at the worker's rate replays in real time
+    EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+    def __init__(self, directory, detector, fps=FPS):
+        self.paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                            if name.lower().endswith(self.EXTENSIONS))
+        if not self.paths:
+            raise DetectError(f"no frames in {directory}")
+        self.detector = detector
+        self.image = need('PIL.Image', "reading frames")
+        self.np = need_numpy()
+        self.index = 0
+
+    def read(self):
+        if self.index >= len(self.paths):
+            return None
+        with self.image.open(self.paths[self.index]) as picture:
+            frame = self.np.asarray(picture.convert('RGB'))
+        self.index += 1
+        return self.detector.crop(frame)
+
+
+class VideoSource:
+    def __init__(self, path, detector, fps=FPS):
+        self.cv2 = need('cv2', "reading video")
+        self.capture = self.cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise DetectError(f"cannot open video {path}")
+        self.detector = detector
+        # Only every step-th frame is matched, to the requested rate
+        rate = self.capture.get(self.cv2.CAP_PROP_FPS) or fps
+        self.step = max(1, round(rate / fps))
+
+    def read(self):
+        for _ in range(self.step - 1):
+            self.capture.grab()
+        ok, frame = self.capture.read()
+        return self.detector.crop(frame) if ok else None
+
+
+class ScreenSource:
+    # Live capture: only the regions in use are grabbed, never the whole screen
+    def __init__(self, monitor, detector, fps=FPS):
+        mss = need('mss', "screen capture")
+        self.np = need_numpy()
+        self.grabber = mss.mss()
+        screen = self.grabber.monitors[monitor]
+        self.boxes = {name: {'left': screen['left'] + left, 'top': screen['top'] + top, 'width': w, 'height': h}
+                      for name, (left, top, w, h) in detector.boxes(screen['width'], screen['height']).items()}
+
+    def read(self):
+        return {name: self.np.asarray(self.grabber.grab(box)) for name, box in self.boxes.items()}
+
+
+def open_source(spec, detector, fps=FPS):
+    # "screen" or "screen:N" (mss monitor number), a folder of frames, or a video file
+    if spec == 'screen' or spec.startswith('screen:'):
+        return ScreenSource(int(spec.partition(':')[2] or 1), detector, fps)
+    if os.path.isdir(spec):
+        return FolderSource(spec, detector, fps)
+    if os.path.isfile(spec):
+        return VideoSource(spec, detector, fps)
+    raise DetectError(f"no frames at {spec!r} (expected screen, screen:N, a folder or a video)")
+
+
+def _lower_priority():
+    # Stay out of the game's way
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), BELOW_NORMAL_PRIORITY_CLASS)
+        else:
+            os.nice(10)
+    except (OSError, AttributeError):
+        pass
+
+
+def worker_main(spec, directory, fps, results, stop):
+    # Runs in its own process: capture, match and send back only
+    # ('cue', name, seen_ns, score), ('stats', frames, busy_ns, late) and
+    # finally ('end', error or None). Frames never cross the process boundary.
+    for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[name] = '1'  # One core; set before numpy is imported
+    _lower_priority()
+    error = None
+    try:
+        detector = Detector(*load_templates(directory))
+        source = open_source(spec, detector, fps)
+        period = int(1e9 / fps)
+        deadline = time.monotonic_ns()
+        frames = busy = late = 0
+        while not stop.is_set():
+            start = time.monotonic_ns()
+            crops = source.read()
+            if crops is None:
+                break
+            for cue in detector.process(crops, start):
+                results.put(('cue',) + cue)
+            frames += 1
+            busy += time.monotonic_ns() - start
+            if frames % STATS_EVERY == 0:
+                results.put(('stats', frames, busy, late))
+            deadline += period
+            wait = deadline - time.monotonic_ns()
+            if wait > 0:
+                stop.wait(wait / 1e9)
+            else:
+                # Behind: drop the missed slots instead of bursting to catch up
+                late += 1
+                deadline = time.monotonic_ns()
+        results.put(('stats', frames, busy, late))
+    except Exception as e:
+        error = str(e)
+    results.put(('end', error))
+
+
+class DetectorWorker:
+    # Runs worker_main() in a separate process so matching never competes
+    # with the Tk or asyncio thread, and relays its messages as
+    # post('detect', cue, seen_ns) on the frontend's command queue. The
+    # worker stamps frames with time.monotonic_ns(), the engine's clock,
+    # which is shared by every process on the machine.
+
+    def __init__(self, post, spec, directory=TEMPLATES_DIR, fps=FPS):
+        self.post = post
+        self.spec = spec
+        self.directory = directory
+        self.fps = fps
+        self.frames = self.busy_ns = self.late = 0
+        self.error = None
+        self._process = None
+
+    def start(self):
+        import multiprocessing
+        context = multiprocessing.get_context('spawn')
+        self.results = context.Queue()
+        self.stop_event = context.Event()
+        self._process = context.Process(target=worker_main, name='nightreign-detect', daemon=True,
+                                        args=(self.spec, self.directory, self.fps, self.results, self.stop_event))
+        self._process.start()
+        self._thread = threading.Thread(target=self._relay, name='detect-relay', daemon=True)
+        self._thread.start()
+        return self
+
+    def _relay(self):
+        while True:
+            try:
+                message = self.results.get(timeout=1)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    break
+                continue
+            kind = message[0]
+            if kind == 'cue':
+                self.post('detect', message[1], message[2])
+            elif kind == 'stats':
+                self.frames, self.busy_ns, self.late = message[1:]
+            elif kind == 'end':
+                self.error = message[1]
+                if self.error:
+                    logging.warning(f"Frame detection stopped: {self.error}")
+                break
+
+    def stop(self, timeout=2):
+        if self._process is not None:
+            self.stop_event.set()
+            self._process.join(timeout)
+            self._thread.join(timeout)
+
+    def summary(self):
+        if not self.frames:
+            return "no frames"
+        return (f"{self.frames} frames, {self.busy_ns / self.frames / 1e6:.1f} ms each, "
+                f"{self.late} late at {self.fps:g} fps")
+
+
+class PhaseSync:
+    # Drives the engine from detected cues: the Day I banner starts a run,
+    # the Day II banner ends the boss pause, and the storm starting to close
+    # lines the run up with the closing phase that should be under way.
+    # The cue's first-seen time is used, not the time it arrived.
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.log = []  # (cue, seen_ns, action)
+
+    def on_detection(self, cue, seen_ns):
+        engine = self.engine
+        timeline = engine.timeline
+        action = None
+        if cue == 'day1':
+            if not (engine.running or engine.paused or engine.paused_for_boss):
+                engine.start()
+                engine.resync(0, seen_ns)
+                action = 'start'
+        elif cue == 'day2':
+            if engine.paused_for_boss:
+                phase = engine.phase + 1
+                engine.resume()
+                engine.resync(phase, seen_ns)
+                action = 'resume'
+        elif cue == 'closing':
+            if engine.running:
+                phase = engine.phase if timeline.closing[engine.phase] else engine.phase + 1
+                if phase < len(timeline) and timeline.closing[phase]:
+                    engine.resync(phase, seen_ns)
+                    action = f'resync {phase}'
+        self.log.append((cue, seen_ns, action))
+        tracing.record(tracing.DETECT, cue, action)
+        logging.debug(f"Detected {cue}: {action or 'ignored'}")
+        return action
+
+
+def add_arguments(parser):
+    parser.add_argument('--detect', metavar='SOURCE',
+                        help="follow the game from captured frames: screen, screen:N, a folder of frames or a video "
+                             "(needs numpy and pillow, plus mss for the screen)")
+    parser.add_argument('--detect-templates', default=TEMPLATES_DIR, metavar='DIR',
+                        help="templates made with nightreigntimers_detect.py template")
+    parser.add_argument('--detect-fps', type=float, default=FPS, help=f"frames matched per second (default {FPS})")
+
+
+def start_from_arguments(args, engine, post):
+    # Returns (PhaseSync, DetectorWorker), or (None, None) without --detect
+    if not args.detect:
+        return None, None
+    # numpy stays out of the frontend's process; only check the templates are there
+    if not os.path.exists(os.path.join(args.detect_templates, TEMPLATES_FILE)):
+        raise DetectError(f"no templates in {args.detect_templates}, make them with "
+                          f"nightreigntimers_detect.py template FRAME CUE")
+    sync = PhaseSync(engine)
+    worker = DetectorWorker(post, args.detect, args.detect_templates, args.detect_fps).start()
+    return sync, worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NIGHTREIGN Timers frame detection")
+    commands = parser.add_subparsers(dest='command', required=True)
+    make = commands.add_parser('template', help="cut a cue template out of a captured frame")
+    make.add_argument('frame', help="image with the cue on screen")
+    make.add_argument('cue', choices=list(CUES))
+    make.add_argument('--templates', default=TEMPLATES_DIR, metavar='DIR')
+    make.add_argument('--threshold', type=float, default=THRESHOLD)
+    watch = commands.add_parser('watch', help="print cues as they are detected")
+    watch.add_argument('source', nargs='?', default='screen')
+    watch.add_argument('--templates', default=TEMPLATES_DIR, metavar='DIR')
+    watch.add_argument('--fps', type=float, default=FPS)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'template':
+            print(f"Wrote {make_template(args.frame, args.cue, args.templates, threshold=args.threshold)}")
+        else:
+            load_templates(args.templates)  # Fail here rather than in the worker
+            def post(command, cue, seen_ns):
+                print(f"{time.strftime('%H:%M:%S')} {cue}")
+
+            worker = DetectorWorker(post, args.source, args.templates, args.fps).start()
+            try:
+                worker._thread.join()
+            except KeyboardInterrupt:
+                pass
+            worker.stop()
+            print(f"Detection: {worker.summary()}")
+            if worker.error:
+                parser.exit(1, f"{worker.error}\n")
+    except DetectError as e:
+        parser.exit(1, f"{e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+import time
+
+import nightreigntimers_metrics as metrics
+import nightreigntimers_trace as tracing
+from nightreigntimers_schedule import NS, load as load_schedule
+
+# Commands a frontend may forward straight to TimerEngine methods
+COMMANDS = ('start', 'reset', 'resume', 'pause', 'skip', 'undo_reset')
+
+MAX_CORRECTION_NS = 50_000_000  # Never schedule more than 50 ms early
+EARLY_TOLERANCE_NS = 2_000_000  # Wakeups this early count as on time
+
+
+WAKEUP_COST = metrics.histogram('nightreign_engine_wakeup_seconds',
+                                "Time to handle one engine wakeup, frontend rendering included", metrics.FAST_BUCKETS)
+WAKEUP_LATENESS = metrics.histogram('nightreign_engine_wakeup_lateness_seconds',
+                                    "How late after() delivered each engine wakeup")
+WAKEUPS = metrics.counter('nightreign_engine_wakeups_total', "Engine wakeups")
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p * (len(sorted_values) - 1))))]
+
+
+class TimerEngine:
+    # Headless phase state machine shared by the GUI and the overlay. The
+    # phases, cues and boss pauses come from a compiled schedule Timeline.
+    # Rather than waking up on a fixed tick, the engine works out the next
+    # moment anything visible changes (a phase ending, the warning cue, the
+    # next frame the frontend's RenderPacing asks for, by default the next
+    # whole second on a readout) and schedules a single wakeup for it.
+    # Nothing is scheduled while idle or paused for the boss.
+    #
+    # Timing runs on time.monotonic_ns(). Phase boundaries are absolute
+    # deadlines derived from the run's origin (start, shifted by the boss
+    # pause), so a late wakeup never pushes later phases back, and each
+    # wakeup is requested early by the lateness seen on the previous ones.
+    # Lateness of every transition deadline, and separately of every warning
+    # cue deadline, is kept for jitter_report().
+    #
+    # schedule(delay_ms, callback) -> handle and cancel(handle) are supplied
+    # by the frontend, e.g. window.after / window.after_cancel.
+    # Listeners are called as listener(event, phase) with event one of:
+    # start, resume, phase, phase_end, warning, tick, boss, done, reset,
+    # pause, unpause, restore (after undo_reset or resync: redraw everything).
+    # Every event but tick, and every wakeup with its lateness and cost,
+    # also goes to the event trace (see nightreigntimers_trace.py).
+
+    def __init__(self, schedule, cancel, clock=None, timeline=None, readout=True, trace=tracing.TRACE):
+        self._schedule = schedule
+        self._cancel = cancel
+        self.clock = clock if clock is not None else time.monotonic_ns
+        self.timeline = timeline if timeline is not None else load_schedule()
+        self.readout = readout  # Wake for every second shown; headless sessions only need transitions and cues
+        self.pacing = None  # Frontend's RenderPacing; whole seconds when unset
+        self.phase = 0
+        self.running = False
+        self.paused_for_boss = False
+        self.paused = False  # Paused by hand, see pause()
+        self.paused_at = None
+        self.origin = None  # Clock time at which the run would have started without pauses
+        self.warned = False
+        self.lateness = []  # Transition deadline lateness (ns) for the current run
+        self.cue_lateness = []  # Warning cue deadline lateness (ns) for the current run
+        self.wakeups = 0
+        self._handle = None
+        self._target = None
+        self._target_kind = None  # 'transition', 'cue' or None for a frame
+        self._correction = 0
+        self.now = None  # Clock time being processed during a wakeup
+        self._undo = None
+        self._listeners = []
+        self._record = trace.record
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def _emit(self, event, phase=None):
+        if phase is None:
+            phase = self.phase
+        if event != 'tick':
+            self._record(tracing.ENGINE, event, phase)
+        for listener in self._listeners:
+            listener(event, phase)
+
+    # --- Commands ---
+
+    def on_hotkey(self):
+        if self.paused_for_boss:
+            self.resume()
+        else:
+            self.start()
+
+    def start(self):
+        self.reset()
+        self.running = True
+        self.phase = 0
+        self.lateness = []
+        self.cue_lateness = []
+        self.wakeups = 0
+        self.origin = self.clock()
+        self._emit('start')
+        self._emit('phase')
+        self._wake()
+
+    def resume(self):
+        if not self.paused_for_boss:
+            return
+        self.paused_for_boss = False
+        self.phase += 1
+        # The boss fight shifts the rest of the run
+        self.origin = self.clock() - self.timeline.offsets[self.phase]
+        self.running = True
+        self.warned = False
+        self._emit('resume')
+        self._emit('phase')
+        self._wake()
+
+    def reset(self):
+        self._cancel_wakeup()
+        if self.running or self.paused or self.paused_for_boss:
+            # Keep the interrupted run so an accidental reset can be undone
+            self._undo = (self.phase, self.running, self.paused_for_boss, self.paused, self.paused_at,
+                          self.origin, self.warned, self.lateness, self.cue_lateness)
+        else:
+            self._undo = None
+        self.running = False
+        self.paused_for_boss = False
+        self.paused = False
+        self.phase = 0
+        self.warned = False
+        self._emit('reset')
+
+    def undo_reset(self):
+        # Bring back the run interrupted by the last reset, as if it had kept going
+        if self._undo is None:
+            return
+        self._cancel_wakeup()
+        (self.phase, self.running, self.paused_for_boss, self.paused, self.paused_at,
+         self.origin, self.warned, self.lateness, self.cue_lateness) = self._undo
+        self._undo = None
+        self._emit('restore')
+        self._wake()
+
+    def pause(self):
+        # Toggle a manual pause of the running phase
+        if self.paused:
+            self.paused = False
+            self.origin += self.clock() - self.paused_at
+            self.running = True
+            self._emit('unpause')
+            self._wake()
+        elif self.running:
+            self._cancel_wakeup()
+            self.paused_at = self.clock()
+            self.paused = True
+            self.running = False
+            self._emit('pause')
+
+    def skip(self):
+        # Jump to the end of the current phase (resumes after the boss)
+        if self.paused_for_boss:
+            self.resume()
+        elif self.running:
+            self._cancel_wakeup()
+            self.origin = self.clock() - self.timeline.offsets[self.phase + 1]
+            self._wake()
+
+    def resync(self, phase, at=None):
+        # Line the run up so that phase starts at clock time at (default now),
+        # e.g. when the game shows it starting. Only moves within the stretch
+        # between boss pauses the run is in. Moving forward plays the skipped
+        # phase ends as usual; moving back emits restore to redraw everything.
+        if not self.running:
+            return
+        first, last = self.timeline.segment(self.phase)
+        if not first <= phase <= last:
+            return
+        self._cancel_wakeup()
+        self.origin = (self.clock() if at is None else at) - self.timeline.offsets[phase]
+        if phase <= self.phase:
+            self.phase = phase
+            self.warned = False
+            self._emit('restore')
+        self._wake()
+
+    def refresh(self):
+        # Wake now and plan the next wakeup again, e.g. after the pacing changed
+        if self.running:
+            self._cancel_wakeup()
+            self._wake()
+
+    # --- Queries (seconds) ---
+
+    def duration(self):
+        return self.timeline.durations[min(self.phase, len(self.timeline) - 1)]
+
+    def elapsed(self, now=None):
+        if self.paused:
+            now = self.paused_at
+        elif not self.running:
+            return 0
+        if now is None:
+            now = self.now if self.now is not None else self.clock()
+        phase_start = self.origin + self.timeline.offsets[self.phase]
+        return min((now - phase_start) / NS, self.duration())
+
+    def remaining(self, now=None):
+        return self.duration() - self.elapsed(now)
+
+    def run_elapsed(self, now=None):
+        # Expedition time excluding the boss pause
+        return self.timeline.offsets[min(self.phase, len(self.timeline))] / NS + self.elapsed(now)
+
+    def warning_in(self, now=None):
+        # Seconds until the current phase's warning cue, or None
+        if not self.running or self.warned or self.timeline.cues[self.phase] is None:
+            return None
+        if now is None:
+            now = self.clock()
+        return max(0, (self.origin + self.timeline.cues[self.phase] - now) / NS)
+
+    def can_undo(self):
+        return self._undo is not None
+
+    def is_closing(self, phase=None):
+        if phase is None:
+            phase = self.phase
+        return self.timeline.closing[min(phase, len(self.timeline) - 1)]
+
+    def jitter_report(self):
+        values = sorted(self.lateness)
+        cues = sorted(self.cue_lateness)
+        return {
+            'transitions': len(values),
+            'wakeups': self.wakeups,
+            'p50_ms': percentile(values, 0.50) / 1e6,
+            'p99_ms': percentile(values, 0.99) / 1e6,
+            'max_ms': (values[-1] if values else 0) / 1e6,
+            'cues': len(cues),
+            'cue_max_ms': (cues[-1] if cues else 0) / 1e6,
+        }
+
+    def format_jitter_report(self):
+        report = self.jitter_report()
+        return (f"{report['transitions']} transitions, {report['wakeups']} wakeups, deadline lateness "
+                f"p50 {report['p50_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms, max {report['max_ms']:.1f} ms; "
+                f"{report['cues']} cues, max {report['cue_max_ms']:.1f} ms late")
+
+    # --- Scheduling ---
+
+    def _cancel_wakeup(self):
+        if self._handle is not None:
+            self._cancel(self._handle)
+            self._handle = None
+        self._target = None
+
+    def _wake(self):
+        self._handle = None
+        if not self.running:
+            return
+        start = time.perf_counter_ns()
+        now = self.clock()
+        self.wakeups += 1
+        WAKEUPS.inc()
+        late = 0
+        if self._target is not None:
+            late = now - self._target
+            WAKEUP_LATENESS.add(max(late, 0))
+            # Ask for the next wakeup earlier by (half) the lateness seen on this one
+            self._correction = min(max(self._correction + late // 2, 0), MAX_CORRECTION_NS)
+            if -EARLY_TOLERANCE_NS <= late < 0:
+                # Slightly early thanks to the correction: act as if on time
+                now = self._target
+            if self._target_kind is not None and late >= -EARLY_TOLERANCE_NS:
+                (self.lateness if self._target_kind == 'transition' else self.cue_lateness).append(max(late, 0))
+            self._target = None
+        self.now = now
+        try:
+            self._advance(now)
+        finally:
+            self.now = None
+        if self.running:
+            self._target, self._target_kind = self._next_deadline(now)
+            delay_ns = self._target - now - self._correction
+            self._handle = self._schedule(max(1, -(-delay_ns // 1_000_000)), self._wake)
+        cost = time.perf_counter_ns() - start
+        WAKEUP_COST.add(cost)
+        self._record(tracing.WAKEUP, late, cost)
+
+    def _advance(self, now):
+        timeline = self.timeline
+        position = now - self.origin
+        if position >= timeline.offsets[self.phase + 1]:
+            # Usually just the one phase ending, but a long stall can skip several
+            target, _ = timeline.locate(position)
+            pause = timeline.next_pause(self.phase)
+            if pause is not None:
+                target = min(target, pause + 1)
+            while self.phase < target:
+                self._emit('phase_end')
+                if self.phase == pause:
+                    self.paused_for_boss = True
+                    self.running = False
+                    self._emit('boss')
+                    return
+                self.phase += 1
+                self.warned = False
+                if self.phase >= len(timeline):
+                    self.running = False
+                    self._emit('done')
+                    return
+                self._emit('phase')
+        cue = timeline.cues[self.phase]
+        if not self.warned and cue is not None and position >= cue:
+            self.warned = True
+            self._emit('warning')
+        self._emit('tick')
+
+    def _next_deadline(self, now):
+        # Returns (deadline, kind) on the engine clock, kind as in _target_kind
+        timeline = self.timeline
+        phase_start = self.origin + timeline.offsets[self.phase]
+        phase_end = self.origin + timeline.offsets[self.phase + 1]
+        deadline, kind = phase_end, 'transition'
+        # Warning cue
+        if not self.warned:
+            cue = timeline.next_cue(now - self.origin)
+            if cue is not None and self.origin + cue < deadline:
+                deadline, kind = self.origin + cue, 'cue'
+        if not self.readout:
+            return deadline, kind
+        if self.pacing is not None:
+            frame = self.pacing.next_frame(now, phase_start, phase_end, timeline.closing[self.phase])
+        else:
+            # Next whole second on either the elapsed or the remaining readout
+            frame = now + NS - (now - phase_start) % NS
+            frame = min(frame, now + ((phase_end - now) % NS or NS))
+        if frame is not None and frame < deadline:
+            deadline, kind = frame, None
+        return deadline, kind
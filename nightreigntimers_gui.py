@@ -1,59 +1,66 @@
-import time
 import tkinter as tk
 from tkinter import ttk
-import keyboard
+import argparse
 import logging
 import math
-import threading
 
-minute = 60
+from nightreigntimers_engine import COMMANDS, TimerEngine
+import nightreigntimers_schedule as schedule
+import nightreigntimers_metrics as metrics
+import nightreigntimers_trace as tracing
+import nightreigntimers_detect as detect
+import nightreigntimers_history as run_history
+import nightreigntimers_pace as pace
+from nightreigntimers_scheduler import CommandQueue
+from nightreigntimers_view import WidgetView
+from nightreigntimers_audio import AudioCues
+from nightreigntimers_hotkeys import HotkeyDispatcher, parse_bindings
+from nightreigntimers_pacing import RenderPacing
+from nightreigntimers_pace import PaceTracker
+import nightreigntimers_runes as runes
+
 dbgflag = True  # Set to True for debugging mode
 if dbgflag:
-    minute = 3 # Debugging mode: speed up to x seconds per minute
     logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+DEBUG_MINUTE = 3  # Debugging mode: speed up to x seconds per minute
 
-# 8 phases: [Safe, Closing, Safe, Closing] x 2 days
-PHASE_DURATIONS = [
-    4.5 * minute, 3 * minute,  # Day 1, First Storm Safe/Closing
-    3.5 * minute, 3 * minute,  # Day 1, Second Storm Safe/Closing
-    4.5 * minute, 3 * minute,  # Day 2, First Storm Safe/Closing
-    3.5 * minute, 3 * minute,  # Day 2, Second Storm Safe/Closing
-]
-PHASE_LABELS = [
-    "First Storm Safe",
-    "First Storm Closing",
-    "Second Storm Safe",
-    "Second Storm Closing",
-    "First Storm Safe",
-    "First Storm Closing",
-    "Second Storm Safe",
-    "Second Storm Closing",
-]
-SECTION_TITLES = {
-    0: "Day 1",
-    4: "Day 2"
-}
-BOSS_PAUSE_AFTER = 3  # Pause after phase 3 (Day 1, Second Storm Closing)
-BEEP_WARNING_SECONDS = 5 # Tones when 5 seconds left before a closing phase
-
-try:
-    import winsound
-    HAS_WINSOUND = True
-except ImportError:
-    HAS_WINSOUND = False
+ROW_HEIGHT = 22  # Window grows by this per phase or section row beyond the standard schedule's 10
+BAR_LENGTH = 200
+PACE_COLORS = {-1: '#00aa00', 0: '#cccccc', 1: '#ff0000'}  # Ahead, level, behind
 
 class NIGHTREIGNTimers:
-    def __init__(self, window):
+    def __init__(self, window, clock=None, audio=None, bindings=None, timeline=None,
+                 engine=None, history=None, reference=None):
         self.window = window
-        self.phase = 0
-        self.running = False
-        self.paused_for_boss = False
-        self.start_time = None
-        self.phase_start_time = None
+        if engine is None:
+            engine = TimerEngine(self.window.after, self.window.after_cancel, clock=clock, timeline=timeline)
+        self.engine = engine  # Or a RemoteEngine mirroring the timer daemon
+        self.timeline = self.engine.timeline
+        self.engine.subscribe(self.on_timer_event)
+        self.commands = CommandQueue(self.window, self.on_command)
+        self.view = WidgetView()
+        self.audio = audio if audio is not None else AudioCues(post=self.commands.post)
+        self.hotkeys = HotkeyDispatcher(self.commands.post, bindings, clock=self.engine.clock)
+        self.phase_sync = None  # PhaseSync while following the game's screen, see --detect
         self.progress = []
         self.labels = []
+        self.pacing = RenderPacing(bar_pixels=BAR_LENGTH, flash=False)
+        self.engine.pacing = self.pacing
+        self.history = history  # RunHistory recording this engine's runs, shown in a panel
+        self.pace = None  # PaceTracker against a reference run, shown under the phase time
+        self._pace_readout = None
+        if reference is not None:
+            self.pace = PaceTracker(self.engine, reference, self.window.after, self.window.after_cancel,
+                                    self.update_pace, self.pacing)
         self.setup_gui()
-        self.window.after(200, self.update_instruction)
+        if history is not None:
+            history.attach(self.engine)
+            # After the frame answering the hotkey, the summary reads the file again
+            history.on_run_end = lambda: self.window.after_idle(self.on_run_end)
+            self.update_history()
+        # Stop drawing while minimized
+        self.window.bind('<Unmap>', lambda e: e.widget is self.window and self.set_visible(False), add='+')
+        self.window.bind('<Map>', lambda e: e.widget is self.window and self.set_visible(True), add='+')
 
     def setup_gui(self):
         self.window.title("Corwin's Vibecode NIGHTREIGN Timers")
@@ -74,15 +81,16 @@ class NIGHTREIGNTimers:
         self.progress = []
         labeltitle = tk.Label(frame, text="NIGHTREIGN Timers", font=("Helvetica", 16, "bold"), bg='#000000', fg='#ffffff')
         labeltitle.grid(row=0, column=0, columnspan=2, pady=(0, 10), sticky='w')
-        for i, label in enumerate(PHASE_LABELS):
+        timeline = self.timeline
+        for i, label in enumerate(timeline.labels):
             # Insert section title if needed
-            if i in SECTION_TITLES:
-                section = tk.Label(frame, text=SECTION_TITLES[i], font=("Helvetica", 13, "bold"), bg='#000000', fg='#447efb')
+            if timeline.sections[i] and (i == 0 or timeline.sections[i] != timeline.sections[i - 1]):
+                section = tk.Label(frame, text=timeline.sections[i], font=("Helvetica", 13, "bold"), bg='#000000', fg='#447efb')
                 section.grid(row=row, column=0, columnspan=2, sticky='w', pady=(10,2))
                 row += 1
             lbl = tk.Label(frame, text=label, font=("Helvetica", 10), bg='#000000', fg='#cccccc', width=18, anchor='w')
             lbl.grid(row=row, column=0, sticky='w', padx=(0, 2), pady=1)
-            bar = ttk.Progressbar(frame, length=200, mode='determinate', maximum=PHASE_DURATIONS[i], style='Green.Horizontal.TProgressbar')
+            bar = ttk.Progressbar(frame, length=BAR_LENGTH, mode='determinate', maximum=timeline.durations[i], style='Green.Horizontal.TProgressbar')
             bar.grid(row=row, column=1, sticky='w', pady=1)
             self.labels.append(lbl)
             self.progress.append(bar)
@@ -98,9 +106,14 @@ class NIGHTREIGNTimers:
         self.phase_time_label.grid(row=row, column=0, columnspan=2, pady=(10, 0), sticky='w')
         row += 1
 
+        if self.pace is not None:
+            self.pace_label = tk.Label(frame, text="", font=("Helvetica", 11, "bold"), bg='#000000', fg=PACE_COLORS[0])
+            self.pace_label.grid(row=row, column=0, columnspan=2, sticky='w')
+            row += 1
+
         self.instruction = tk.Label(
             frame,
-            text="Press [F8] to start/reset timer",
+            text=self.idle_text(),
             font=("Helvetica", 13),
             bg='#000000',
             fg='#ffffff',
@@ -109,161 +122,293 @@ class NIGHTREIGNTimers:
         )
         self.instruction.grid(row=row, column=0, columnspan=2, pady=(10, 15), sticky='w')
 
-        keyboard.add_hotkey('f8', self.on_hotkey)
-
         # --- Info Panel (right side) ---
         info_frame = tk.Frame(self.window, bg='#222222', bd=2, relief='groove')
         info_frame.place(x=400, y=20, width=220, height=425)
 
         info_title = tk.Label(info_frame, text="Leveling Rune Cost", font=("Helvetica", 12, "bold"), bg='#222222', fg="#447efb")
-        info_title.grid(row=0, column=0, columnspan=3, pady=(5, 2))
-
-        headers = ["Level", "Level Cost", "Total Spent"]
-        for col, text in enumerate(headers):
-            tk.Label(info_frame, text=text, font=("Helvetica", 10, "bold"), bg='#222222', fg='#cccccc').grid(row=1, column=col, padx=4, pady=2, sticky='w')
-
-        # Level and cost data
-        level_costs = [
-            (0),
-            (3698),
-            (7922),
-            (12348),
-            (16978),
-            (21818),
-            (26869),
-            (32137),
-            (37624),
-            (43335),
-            (49271),
-            (55439),
-            (61840),
-            (68479),
-            (75358),
-        ]
-        running_total = 0
-        level = 0
-        for row_idx, (cost) in enumerate(level_costs, start=2):
-            running_total += cost
-            level += 1
-            tk.Label(info_frame, text=level, bg='#222222', fg='#ffffff', font=("Helvetica", 10)).grid(row=row_idx, column=0, padx=4, pady=1, sticky='w')
-            tk.Label(info_frame, text=str(cost), bg='#222222', fg='#ffffff', font=("Helvetica", 10)).grid(row=row_idx, column=1, padx=4, pady=1, sticky='w')
-            tk.Label(info_frame, text=str(running_total), bg='#222222', fg='#ffffff', font=("Helvetica", 10)).grid(row=row_idx, column=2, padx=4, pady=1, sticky='w')
+        info_title.grid(row=0, column=0, columnspan=4, pady=(5, 2))
+
+        # Whole table in one Text widget instead of a Label per cell
+        table = tk.Text(info_frame, bg='#222222', fg='#ffffff', font=("Helvetica", 10), bd=0, highlightthickness=0,
+                        width=26, height=runes.MAX_LEVEL + 1, tabs=(60, 140), cursor='arrow')
+        table.tag_configure('header', font=("Helvetica", 10, "bold"), foreground='#cccccc')
+        table.insert('end', "Level\tLevel Cost\tTotal Spent\n", 'header')
+        table.insert('end', "\n".join(f"{level}\t{cost}\t{total}" for level, cost, total in runes.table_rows()))
+        table.config(state='disabled')
+        table.grid(row=1, column=0, columnspan=4, padx=4, pady=2, sticky='w')
+
+        # "What can I reach" readout: runes held + current level
+        tk.Label(info_frame, text="Runes", font=("Helvetica", 10), bg='#222222', fg='#cccccc').grid(row=2, column=0, padx=(4, 0), sticky='w')
+        self.runes_entry = tk.Entry(info_frame, width=8, bg='#333333', fg='#ffffff', insertbackground='#ffffff', relief='flat')
+        self.runes_entry.grid(row=2, column=1, sticky='w')
+        tk.Label(info_frame, text="Lv", font=("Helvetica", 10), bg='#222222', fg='#cccccc').grid(row=2, column=2, padx=(6, 0), sticky='w')
+        self.level_entry = tk.Entry(info_frame, width=3, bg='#333333', fg='#ffffff', insertbackground='#ffffff', relief='flat')
+        self.level_entry.insert(0, "1")
+        self.level_entry.grid(row=2, column=3, sticky='w')
+        self.affordable_label = tk.Label(info_frame, text="", font=("Helvetica", 10), bg='#222222', fg="#447efb", wraplength=200, justify='left')
+        self.affordable_label.grid(row=3, column=0, columnspan=4, padx=4, pady=(4, 0), sticky='w')
+        for entry in (self.runes_entry, self.level_entry):
+            entry.bind('<KeyRelease>', lambda e: self.update_affordable())
+
+        # --- Run history panel (further right) ---
+        width = 640
+        if self.history is not None:
+            history_frame = tk.Frame(self.window, bg='#222222', bd=2, relief='groove')
+            history_frame.place(x=630, y=20, width=240, height=425)
+            history_title = tk.Label(history_frame, text=f"Run History ({run_history.SUMMARY_DAYS} days)", font=("Helvetica", 12, "bold"), bg='#222222', fg="#447efb")
+            history_title.pack(pady=(5, 2))
+            self.history_label = tk.Label(history_frame, text="", font=("Helvetica", 10), bg='#222222', fg='#ffffff', justify='left', anchor='nw', wraplength=225)
+            self.history_label.pack(fill='x', padx=4)
+            width = 880
 
         # Adjust window size and progress bar frame position to fit layout
-        self.window.geometry("640x465")
+        self.window.geometry(f"{width}x{465 + max(0, row - 11) * ROW_HEIGHT}")
         frame.place(x=20, y=20) 
 
+    def update_affordable(self):
+        try:
+            held = int(self.runes_entry.get().replace(',', '') or 0)
+            level = int(self.level_entry.get() or 1)
+            reached, left = runes.affordable_level(held, level)
+        except ValueError:
+            self.view.config(self.affordable_label, text="")
+            return
+        text = f"Affordable: level {reached}"
+        if reached < runes.MAX_LEVEL:
+            text += f" ({runes.LEVEL_COSTS[reached] - left} more for {reached + 1})"
+        self.view.config(self.affordable_label, text=text)
+
+    def update_history(self):
+        # Summary of this schedule's recent runs, read off the history file
+        since = run_history.wall_ms() - run_history.SUMMARY_DAYS * 86_400_000
+        try:
+            with run_history.HistoryReader(self.history.path) as reader:
+                summary = reader.summary(since, timeline=self.timeline)
+        except OSError as e:
+            self.view.config(self.history_label, text=f"Run history unavailable: {e}")
+            return
+        lines = run_history.format_summary(summary, self.timeline, compact=True)
+        self.view.config(self.history_label, text="\n".join(lines))
+
+    def on_run_end(self):
+        self.update_history()
+        if self.pace is not None:
+            self.pace.on_run_end()
+
+    def update_pace(self):
+        # Ahead/behind the reference run; a Tk call only when the readout changes
+        if self.pace is None:
+            return
+        if not self.pacing.visible:
+            self.pacing.stale = True
+            return
+        readout = self.pace.readout()
+        if readout is self._pace_readout:
+            return
+        self._pace_readout = readout
+        text, sign = readout
+        self.view.config(self.pace_label, text=text, fg=PACE_COLORS[sign])
+
     def on_hotkey(self):
-        window.attributes('-topmost', True)  # Push the window to the top
-        window.update
-        window.attributes('-topmost', False)  # Don't keep forcing always on top
-        if self.paused_for_boss:
-            self.paused_for_boss = False
-            self.phase += 1
-            self.phase_start_time = time.time()
-            self.running = True
-            self.instruction.config(text="")
-            self.window.after(100, self.run_phase)
-        else:
-            self.reset_all()
-            self.running = True
-            self.phase = 0
-            self.start_time = time.time()
-            self.phase_start_time = self.start_time
-            self.instruction.config(text="")
-            self.window.after(100, self.run_phase)
+        self.hotkeys.press('hotkey')
+
+    def on_command(self, command, *args):
+        # Runs on the Tk thread, see CommandQueue
+        if command == 'key':
+            if not self.hotkeys.accept(*args):
+                return
+            command = args[0]
+            self.window.after_idle(self.hotkeys.rendered)
+        if command == 'hotkey':
+            self.window.attributes('-topmost', True)  # Push the window to the top
+            self.window.attributes('-topmost', False)  # Don't keep forcing always on top
+            self.engine.on_hotkey()
+        elif command in COMMANDS:
+            getattr(self.engine, command)()
+        elif command == 'remote':
+            self.engine.apply(*args)
+        elif command == 'detect':
+            if self.phase_sync is not None:
+                self.phase_sync.on_detection(*args)
+        elif command == 'bell':
+            self.window.bell()
+        elif command == 'trace':
+            self.save_trace()
+
+    def save_trace(self):
+        path = tracing.save(self.timeline.title)
+        logging.info(f"Saving the event trace to {path}")
+
+    def idle_text(self):
+        return f"Press [{self.hotkeys.key_for('hotkey')}] to start/reset timer"
 
     def reset_all(self):
-        self.running = False
-        self.paused_for_boss = False
         for i, bar in enumerate(self.progress):
-            bar.config(value=0, style='Green.Horizontal.TProgressbar')
-            self.labels[i].config(bg='#000000', fg='#cccccc')
-        self.instruction.config(text="Press [F8] to start/reset timer")
-
-    def beep_notice(self):
-        # Run the beep in a separate thread so the UI doesn't freeze
-        def do_beep():
-            if HAS_WINSOUND:
-                winsound.Beep(130, 400)
-                winsound.Beep(110, 300)
-                winsound.Beep(98, 500)
-            else:
-                self.window.bell()
-        threading.Thread(target=do_beep, daemon=True).start()
+            self.view.config(bar, value=0, style='Green.Horizontal.TProgressbar')
+            self.view.config(self.labels[i], bg='#000000', fg='#cccccc')
+        self.view.config(self.phase_time_label, text="00:00 / 00:00")
+        self.update_instruction()
+
+    def redraw(self):
+        # Rebuild the whole phase list from the engine, e.g. after undo_reset
+        self.reset_all()
+        # In the boss pause the phase that ran into it has finished too
+        finished = self.engine.phase + 1 if self.engine.paused_for_boss else self.engine.phase
+        for phase in range(min(finished, len(self.progress))):
+            self.on_timer_event('phase_end', phase)
+        if self.engine.running or self.engine.paused:
+            self.on_timer_event('phase', self.engine.phase)
+            self.update_phase_time()
+        self.update_instruction()
+        self.update_pace()
+
+    def schedule_warning(self):
+        # Hand the storm warning to the audio worker, timed to the phase deadline
+        self.audio.cancel_all()
+        delay = self.engine.warning_in(self.engine.clock())
+        if delay is not None:
+            self.audio.schedule('warning', self.audio.clock() + delay)
 
     def update_instruction(self):
-        if self.paused_for_boss:
-            self.instruction.config(text="Boss fight! Press [F8] when ready to resume.", fg='#447efb')
-        elif not self.running:
-            self.instruction.config(text="Press [F8] to start/reset timer", fg='#ffffff')
+        if self.engine.paused_for_boss:
+            self.view.config(self.instruction, text=f"Boss fight! Press [{self.hotkeys.key_for('hotkey')}] when ready to resume.", fg='#447efb')
+        elif self.engine.paused:
+            self.view.config(self.instruction, text=f"Paused. Press [{self.hotkeys.key_for('pause')}] to continue.", fg='#447efb')
+        elif not self.engine.running:
+            self.view.config(self.instruction, text=self.idle_text(), fg='#ffffff')
         else:
-            self.instruction.config(text="", fg='#ffffff')
-        self.window.after(200, self.update_instruction)
-
-    def run_phase(self):
-        if not self.running or self.phase >= len(PHASE_DURATIONS):
-            self.running = False
-            self.instruction.config(text="Press [F8] to start/reset timer", fg='#ffffff')
-            self.phase_time_label.config(text="00:00 / 00:00")
+            self.view.config(self.instruction, text="", fg='#ffffff')
+
+    def on_timer_event(self, event, phase):
+        # Called by the engine only when something visible changes
+        if event in ('reset', 'pause'):
+            self.audio.cancel_all()
+        elif event in ('phase', 'unpause', 'restore'):
+            self.schedule_warning()
+        elif event == 'done':
+            logging.info(f"Run timing: {self.engine.format_jitter_report()}")
+            logging.info(f"Hotkey to render latency: {self.hotkeys.latency.summary()}")
+        if not self.pacing.visible:
+            # Nothing is drawn while minimized, set_visible() catches up
+            self.pacing.stale = True
             return
+        if event == 'reset':
+            self.reset_all()
+        elif event == 'phase':
+            # Highlight current phase
+            closing = self.timeline.closing[phase]
+            self.view.config(self.labels[phase], bg='#ff0000' if closing else '#00aa00', fg='#ffffff')
+            self.view.config(self.progress[phase], style='Red.Horizontal.TProgressbar' if closing else 'Green.Horizontal.TProgressbar')
+            self.update_instruction()
+        elif event == 'tick':
+            self.update_phase_time()
+            self.update_pace()
+            self.view.end_tick()
+        elif event == 'phase_end':
+            duration = self.timeline.durations[phase]
+            self.view.config(self.progress[phase], value=duration, style='Default.Horizontal.TProgressbar')
+            self.view.config(self.labels[phase], bg='#808080', fg='#ffffff')
+            self.view.config(self.phase_time_label, text=f"{self.format_time(duration)} / {self.format_time(duration)}")
+        elif event == 'boss':
+            self.update_instruction()
+        elif event == 'pause':
+            self.update_instruction()
+        elif event == 'unpause':
+            self.update_instruction()
+        elif event == 'restore':
+            self.redraw()
+        elif event == 'done':
+            self.update_instruction()
+            self.view.config(self.phase_time_label, text="00:00 / 00:00")
+            logging.debug(f"Widget updates: {self.view.calls} Tk calls over {self.view.ticks} ticks "
+                          f"({self.view.calls_per_tick():.2f} per tick, max {self.view.max_tick_calls}), "
+                          f"{self.view.skipped} unchanged skipped")
 
-        # Highlight current phase
-        for i, lbl in enumerate(self.labels):
-            if i == self.phase:
-                lbl.config(bg='#00aa00' if self.phase % 2 == 0 else '#ff0000', fg='#ffffff')
-            else:
-                lbl.config(bg='#000000', fg='#cccccc')
-        bar = self.progress[self.phase]
-        bar.config(style='Green.Horizontal.TProgressbar' if self.phase % 2 == 0 else 'Red.Horizontal.TProgressbar')
-
-        duration = PHASE_DURATIONS[self.phase]
-        elapsed = time.time() - self.phase_start_time
+    def set_visible(self, visible):
+        # Rendering stops while minimized; restoring the window redraws in one frame
+        if visible == self.pacing.visible:
+            return
+        if visible:
+            if self.pacing.show():
+                self.redraw()
+                self.view.end_tick()
+        else:
+            self.pacing.hide()
+        self.engine.refresh()
+        if self.pace is not None:
+            self.pace.refresh()
+
+    def update_phase_time(self):
+        duration = self.engine.duration()
+        elapsed = self.engine.elapsed()
         remaining = duration - elapsed
-        #logging.debug(f"Phase {self.phase + 1}: Elapsed: {elapsed:.2f}s, Remaining: {remaining:.2f}s")
-        bar['value'] = elapsed
+        self.view.config(self.progress[self.engine.phase], value=elapsed)
+        self.view.config(
+            self.phase_time_label,
+            text=f"{self.format_time(elapsed)} / {self.format_time(duration)} ({math.ceil(remaining)} seconds remaining)"
+        )
 
-        # Update phase time label
-        def format_time(secs):
-            mins = int(secs) // 60
-            s = int(secs) % 60
-            return f"{mins:02}:{s:02}"
+    def format_time(self, secs):
+        mins = int(secs) // 60
+        s = int(secs) % 60
+        return f"{mins:02}:{s:02}"
 
-        self.phase_time_label.config(
-            text=f"{format_time(elapsed)} / {format_time(duration)} ({math.ceil(remaining)} seconds remaining)"
-        )
+def main():
+    parser = argparse.ArgumentParser(description="NIGHTREIGN Timers")
+    parser.add_argument('--hotkey', action='append', metavar='ACTION=KEY',
+                        help="rebind a hotkey (actions: hotkey, pause, skip, undo_reset, trace)")
+    parser.add_argument('--connect', nargs='?', const='', metavar='SOCKET',
+                        help="show the timer daemon's timer instead of running one (see nightreigntimers_daemon.py)")
+    schedule.add_arguments(parser)
+    metrics.add_arguments(parser)
+    detect.add_arguments(parser)
+    run_history.add_arguments(parser)
+    pace.add_arguments(parser)
+    if dbgflag:
+        parser.set_defaults(minute=DEBUG_MINUTE)
+    args = parser.parse_args()
+    try:
+        bindings = parse_bindings(args.hotkey)
+    except ValueError as e:
+        parser.error(str(e))
+    timeline = schedule.from_arguments(parser, args)
+    metrics.start_from_arguments(args)
 
-        # Beep warning
-        if 0 < remaining < BEEP_WARNING_SECONDS and abs(bar['value'] - (duration - BEEP_WARNING_SECONDS)) < 0.3 and self.phase % 2 == 0:
-            self.beep_notice()
-
-        if elapsed >= duration:
-            bar['value'] = duration
-            bar.config(style='Default.Horizontal.TProgressbar')
-            self.labels[self.phase].config(bg='#808080', fg='#ffffff')
-            self.phase_time_label.config(text=f"{format_time(duration)} / {format_time(duration)}")
-            if self.phase == BOSS_PAUSE_AFTER:
-                self.paused_for_boss = True
-                self.running = False
-                self.instruction.config(text="Boss fight! Press [F8] when ready to resume.", fg='#447efb')
-                return
-            self.phase += 1
-            if self.phase < len(PHASE_DURATIONS):
-                self.phase_start_time = time.time()
-                self.window.after(100, self.run_phase)
-            else:
-                self.running = False
-                self.instruction.config(text="Press [F8] to start/reset timer", fg='#ffffff')
-                self.phase_time_label.config(text="00:00 / 00:00")
-            return
+    engine = None
+    if args.connect is not None:
+        import nightreigntimers_daemon as daemon
+        try:
+            engine = daemon.RemoteEngine(daemon.parse_address(args.connect))
+        except OSError as e:
+            parser.exit(1, f"cannot connect to the timer daemon: {e}\n")
 
-        self.window.after(200, self.run_phase)
+    # With the daemon's timer the daemon records the runs
+    history = run_history.start_from_arguments(args) if engine is None else None
+    try:
+        reference = pace.start_from_arguments(args, timeline) if engine is None else None
+    except pace.PaceError as e:
+        parser.exit(1, f"{e}\n")
 
-def main():
     global window 
     window = tk.Tk()
-    app = NIGHTREIGNTimers(window)
+    app = NIGHTREIGNTimers(window, bindings=bindings, timeline=timeline, engine=engine, history=history,
+                           reference=reference)
+    if engine is not None:
+        # The daemon owns the hotkeys
+        engine.listen(app.commands.post)
+    else:
+        import keyboard
+        app.hotkeys.register(keyboard)
+    try:
+        app.phase_sync, detector = detect.start_from_arguments(args, app.engine, app.commands.post)
+    except detect.DetectError as e:
+        parser.exit(1, f"{e}\n")
     window.mainloop()
+    if detector is not None:
+        detector.stop()
+    if history is not None:
+        history.close()
 
 if __name__ == "__main__":
     main()
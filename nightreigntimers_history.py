@@ -0,0 +1,514 @@
+import argparse
+import bisect
+import collections
+import datetime
+import itertools
+import logging
+import mmap
+import operator
+import os
+import statistics
+import struct
+import time
+import zlib
+
+import nightreigntimers_schedule as schedule
+from nightreigntimers_startup import data_dir, timed_import
+
+HISTORY_FILE = os.path.join(data_dir(), 'nightreigntimers_history.bin')
+INDEX_SUFFIX = '.idx'
+SUMMARY_DAYS = 30  # Window of the GUI's history panel and the CLI default
+
+# One record per event of a run: wall clock ms, run number, schedule id
+# (see schedule_id()), kind, phase, value (ms, see the kinds below)
+RECORD = struct.Struct('<qIIBBxxi')
+RECORD_SIZE = RECORD.size  # 24 bytes
+# One index entry per run: wall clock ms of its start, number of its START record
+INDEX = struct.Struct('<qq')
+INDEX_SIZE = INDEX.size
+
+START = 0  # value 0
+PHASE = 1  # phase ended; value = ms since the run started, pauses included
+BOSS = 2  # boss pause after phase ended; value = its length in ms
+DONE = 3  # value = ms since the run started
+RESET = 4  # run reset during phase; value = ms since the run started
+UNDO = 5  # the last RESET of this run (same phase) was undone
+
+# Field offsets inside a record, for reading columns straight off the map
+WALL, RUN, SCHEDULE, KIND, PHASE_FIELD, VALUE = 0, 8, 12, 16, 17, 20
+MAX_VALUE = 2 ** 31 - 1
+
+
+def schedule_id(timeline):
+    # Name and length, so runs of a sped-up (--minute) or edited schedule
+    # don't mix with the real ones
+    return zlib.crc32(f"{timeline.name}:{timeline.total_ns}".encode('utf-8'))
+
+
+def wall_ms(ns=None):
+    return (time.time_ns() if ns is None else ns) // 1_000_000
+
+
+class RunHistory:
+    # Appends every run of one engine to the history file as it happens:
+    # START, the end of each phase, each boss pause, then DONE, or RESET
+    # with the phase the run was cut short in (followed by UNDO if the
+    # reset was undone). Records are fixed-width and written with a single
+    # unbuffered append each, so a crash loses at most the event under way;
+    # each START also gets an index entry (written after its record, so
+    # the index can always be rebuilt from the records, see _recover()).
+    #
+    # One writer per file: when windows share the timer daemon, the daemon
+    # records and the windows don't.
+
+    def __init__(self, path=HISTORY_FILE, wall=time.time_ns):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.wall = wall
+        self.engine = None
+        self.schedule = 0
+        self.on_run_end = None  # Called after a run's DONE or RESET is written
+        self.run = None  # Run number being recorded, None between runs
+        self.phase = 0
+        self.started = 0  # Engine clock time of the run's start
+        self.boss_started = None
+        self._undoable = None  # State of the last reset run, for undo_reset
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.count, self.next_run = self._recover()
+        self._records = open(path, 'ab', buffering=0)
+        self._index = open(self.index_path, 'ab', buffering=0)
+        self._failed = False
+
+    def _recover(self):
+        # Cut a torn last record, and index any run the index missed.
+        # Returns (records, next run number)
+        count = 0
+        if os.path.exists(self.path):
+            size = os.path.getsize(self.path)
+            count = size // RECORD_SIZE
+            if size % RECORD_SIZE:
+                os.truncate(self.path, count * RECORD_SIZE)
+        entries = 0
+        if os.path.exists(self.index_path):
+            size = os.path.getsize(self.index_path)
+            entries = size // INDEX_SIZE
+            if size % INDEX_SIZE:
+                os.truncate(self.index_path, entries * INDEX_SIZE)
+        if not count:
+            if entries:
+                os.truncate(self.index_path, 0)
+            return 0, 1
+        with open(self.index_path, 'a+b') as index, open(self.path, 'rb') as records:
+            # Drop entries past the records (records cut short), then index what follows the last entry
+            position = 0
+            while entries:
+                index.seek((entries - 1) * INDEX_SIZE)
+                _, position = INDEX.unpack(index.read(INDEX_SIZE))
+                if position < count:
+                    break
+                entries -= 1
+            if not entries:
+                position = 0
+            index.truncate(entries * INDEX_SIZE)
+            records.seek(position * RECORD_SIZE)
+            last_run = 0
+            for number, record in enumerate(RECORD.iter_unpack(records.read()), position):
+                wall, run, _, kind, _, _ = record
+                if kind == START:
+                    last_run = run
+                    if not entries or number > position:
+                        index.write(INDEX.pack(wall, number))
+        return count, last_run + 1
+
+    def attach(self, engine):
+        self.engine = engine
+        self.schedule = schedule_id(engine.timeline)
+        engine.subscribe(self.on_timer_event)
+        return self
+
+    def close(self):
+        self._records.close()
+        self._index.close()
+
+    def _now(self):
+        engine = self.engine
+        return engine.now if engine.now is not None else engine.clock()
+
+    def _since(self, now):
+        return min((now - self.started) // 1_000_000, MAX_VALUE)
+
+    def _write(self, kind, phase, value=0):
+        wall = wall_ms(self.wall())
+        try:
+            self._records.write(RECORD.pack(wall, self.run, self.schedule, kind, phase, value))
+            self.count += 1
+            if kind == START:
+                self._index.write(INDEX.pack(wall, self.count - 1))
+        except OSError as e:
+            # Never let the history stop the timer; a missed index entry is rebuilt on the next start
+            if not self._failed:
+                logging.warning(f"Run history not saved: {e}")
+                self._failed = True
+
+    def _end_run(self):
+        self.run = None
+        if self.on_run_end is not None:
+            self.on_run_end()
+
+    def on_timer_event(self, event, phase):
+        if event == 'start':
+            self.run, self.next_run = self.next_run, self.next_run + 1
+            self.started = self._now()
+            self.phase = 0
+            self.boss_started = None
+            self._write(START, 0)
+        elif event == 'reset':
+            if self.run is None:
+                self._undoable = None  # Like the engine: nothing to undo after an idle reset
+                return
+            self._write(RESET, self.phase, self._since(self._now()))
+            self._undoable = (self.run, self.phase, self.started, self.boss_started)
+            self._end_run()
+        elif event == 'restore':
+            if self._undoable is not None and not self.engine.can_undo():
+                # undo_reset (rather than a resync): the reset run carries on
+                if self.run is not None:
+                    self._write(RESET, self.phase, self._since(self._now()))
+                self.run, undone_phase, self.started, self.boss_started = self._undoable
+                self._undoable = None
+                self._write(UNDO, undone_phase, self._since(self._now()))
+            self.phase = phase
+        elif self.run is None:
+            return
+        elif event == 'phase':
+            self.phase = phase
+        elif event == 'phase_end':
+            self._write(PHASE, phase, self._since(self._now()))
+        elif event == 'boss':
+            self.boss_started = self._now()
+        elif event == 'resume':
+            if self.boss_started is not None:
+                self._write(BOSS, self.phase, min((self._now() - self.boss_started) // 1_000_000, MAX_VALUE))
+                self.boss_started = None
+        elif event == 'done':
+            self._write(DONE, self.phase, self._since(self._now()))
+            self._end_run()
+
+
+class HistoryReader:
+    # Read-only view of a history file through mmap: the index finds the
+    # records of the runs started in a date range by bisection, and the
+    # summary reads its columns straight out of the mapped records, with
+    # numpy when it is installed and strided memoryviews otherwise, so no
+    # record ever becomes a Python object.
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self._files = []
+        self.records = self._map(path, RECORD_SIZE)
+        self.index = self._map(path + INDEX_SUFFIX, INDEX_SIZE)
+        self.count = len(self.records) // RECORD_SIZE
+        # Entries past the records come from a crash mid-write; the next writer drops them
+        starts = self.index.cast('q')
+        entries = len(self.index) // INDEX_SIZE
+        while entries and starts[2 * entries - 1] >= self.count:
+            entries -= 1
+        self.starts = starts[0:2 * entries:2]  # Wall clock ms of each run's start
+        self.positions = starts[1:2 * entries:2]  # Record number of each run's START
+
+    def _map(self, path, size):
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return memoryview(b'')
+        self._files.append(f)
+        length = os.fstat(f.fileno()).st_size // size * size
+        if not length:
+            return memoryview(b'')
+        mapped = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ)
+        self._files.append(mapped)
+        return memoryview(mapped)
+
+    def close(self):
+        for view in (self.starts, self.positions, self.records, self.index):
+            view.release()
+        for f in reversed(self._files):
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def runs(self):
+        return len(self.starts)
+
+    def span(self, since=None, until=None):
+        # Record numbers [first, end) of the runs started in [since, until), wall clock ms
+        first = 0 if since is None else bisect.bisect_left(self.starts, since)
+        last = len(self.starts) if until is None else bisect.bisect_left(self.starts, until)
+        if first >= last:
+            return 0, 0
+        end = self.positions[last] if last < len(self.starts) else self.count
+        return self.positions[first], end
+
+    def _run_at(self, entry):
+        return struct.unpack_from('<I', self.records, self.positions[entry] * RECORD_SIZE + RUN)[0]
+
+    def run_records(self, run):
+        # The records of one run as tuples, found by bisecting the index
+        # (run numbers only grow; by hand, bisect's key= needs Python 3.10).
+        # Only the stretch up to the next START is read, so a run undone
+        # after another one started loses its tail
+        entries = len(self.positions)
+        entry, hi = 0, entries
+        while entry < hi:
+            mid = (entry + hi) // 2
+            if self._run_at(mid) < run:
+                entry = mid + 1
+            else:
+                hi = mid
+        if entry == entries or self._run_at(entry) != run:
+            return []
+        end = self.positions[entry + 1] if entry + 1 < entries else self.count
+        with self.records[self.positions[entry] * RECORD_SIZE:end * RECORD_SIZE] as view:
+            return [record for record in RECORD.iter_unpack(view) if record[1] == run]
+
+    def best_run(self, timeline=None, use_numpy=None):
+        # Number of the fastest completed run of timeline's schedule (default any), or None.
+        # use_numpy None: when importable
+        wanted = None if timeline is None else schedule_id(timeline)
+        view = self.records[:self.count * RECORD_SIZE]
+        try:
+            if use_numpy is None:
+                use_numpy = _have_numpy()
+            return best_run_numpy(view, wanted) if use_numpy else best_run_plain(view, wanted)
+        finally:
+            view.release()
+
+    def summary(self, since=None, until=None, timeline=None, use_numpy=None):
+        # Runs, completions, aborts and reach by phase, median phase splits,
+        # run and boss pause times, of timeline's runs (default all).
+        # use_numpy None: when importable
+        first, end = self.span(since, until)
+        wanted = None if timeline is None else schedule_id(timeline)
+        view = self.records[first * RECORD_SIZE:end * RECORD_SIZE]
+        try:
+            if use_numpy is None:
+                use_numpy = _have_numpy()
+            return summarize_numpy(view, wanted) if use_numpy else summarize_plain(view, wanted)
+        finally:
+            view.release()
+
+
+def _have_numpy():
+    try:
+        return timed_import('numpy') is not None
+    except ImportError:
+        return False
+
+
+def best_run_plain(view, wanted=None):
+    # Smallest DONE value over strided columns, without numpy
+    kinds = view[KIND::RECORD_SIZE]
+    values = view.cast('i')[VALUE // 4::RECORD_SIZE // 4]
+    runs = view.cast('I')[RUN // 4::RECORD_SIZE // 4]
+    schedules = view.cast('I')[SCHEDULE // 4::RECORD_SIZE // 4]
+    try:
+        matches = map(operator.eq, kinds, itertools.repeat(DONE))
+        if wanted is not None:
+            matches = map(operator.and_, matches, map(operator.eq, schedules, itertools.repeat(wanted)))
+        best = min(itertools.compress(zip(values, runs), matches), default=None)
+        return None if best is None else best[1]
+    finally:
+        for column in (kinds, values, runs, schedules):
+            column.release()
+
+
+def best_run_numpy(view, wanted=None):
+    # The same off the structured array: argmin over the DONE values. Ties
+    # go to the earliest record, i.e. the lowest run number, as above
+    np = timed_import('numpy')
+    records = np.frombuffer(view, dtype=record_dtype(np))
+    complete = records['kind'] == DONE
+    if wanted is not None:
+        complete &= records['schedule'] == wanted
+    done = records[complete]
+    if not len(done):
+        return None
+    return int(done['run'][np.argmin(done['value'])])
+
+
+def _medians(groups):
+    return {key: statistics.median(values) for key, values in sorted(groups.items())}
+
+
+def summarize_plain(view, wanted=None):
+    # Columns are strided memoryviews over the records; only the values
+    # selected for each figure are turned into Python ints
+    kinds = view[KIND::RECORD_SIZE]
+    phases = view[PHASE_FIELD::RECORD_SIZE]
+    values = view.cast('i')[VALUE // 4::RECORD_SIZE // 4]
+    schedules = view.cast('I')[SCHEDULE // 4::RECORD_SIZE // 4]
+
+    def select(kind, column):
+        matches = map(operator.eq, kinds, itertools.repeat(kind))
+        if wanted is not None:
+            matches = map(operator.and_, matches, map(operator.eq, schedules, itertools.repeat(wanted)))
+        return list(itertools.compress(column, matches))
+
+    try:
+        runs = len(select(START, phases))
+        finished = select(DONE, values)
+        bosses = select(BOSS, values)
+        aborts = collections.Counter(select(RESET, phases))
+        aborts.subtract(select(UNDO, phases))
+        splits = collections.defaultdict(list)
+        for phase, value in select(PHASE, zip(phases, values)):
+            splits[phase].append(value)
+        reached = {0: runs}
+        reached.update((phase + 1, len(ends)) for phase, ends in splits.items())
+        return _summary(runs, finished, bosses, aborts, reached, _medians(splits))
+    finally:
+        for column in (kinds, phases, values, schedules):
+            column.release()
+
+
+RECORD_DTYPE = None
+
+
+def record_dtype(np):
+    global RECORD_DTYPE
+    if RECORD_DTYPE is None:
+        RECORD_DTYPE = np.dtype({'names': ['wall', 'run', 'schedule', 'kind', 'phase', 'value'],
+                                 'formats': ['<i8', '<u4', '<u4', 'u1', 'u1', '<i4'],
+                                 'offsets': [WALL, RUN, SCHEDULE, KIND, PHASE_FIELD, VALUE],
+                                 'itemsize': RECORD_SIZE})
+    return RECORD_DTYPE
+
+
+def summarize_numpy(view, wanted=None):
+    # The same figures with the records viewed as a numpy structured array
+    np = timed_import('numpy')
+    records = np.frombuffer(view, dtype=record_dtype(np))
+    kinds, phases, values = records['kind'], records['phase'], records['value']
+    keep = np.ones(len(records), dtype=bool) if wanted is None else records['schedule'] == wanted
+
+    def select(kind, column):
+        return column[(kinds == kind) & keep]
+
+    runs = int(np.count_nonzero((kinds == START) & keep))
+    finished = select(DONE, values).tolist()
+    bosses = select(BOSS, values).tolist()
+    aborts = collections.Counter(select(RESET, phases).tolist())
+    aborts.subtract(select(UNDO, phases).tolist())
+    end_phases, end_values = select(PHASE, phases), select(PHASE, values)
+    splits = {}
+    reached = {0: runs}
+    for phase in np.unique(end_phases).tolist():
+        ends = end_values[end_phases == phase]
+        splits[phase] = np.median(ends).item()
+        reached[phase + 1] = len(ends)
+    return _summary(runs, finished, bosses, aborts, reached, splits)
+
+
+def _summary(runs, finished, bosses, aborts, reached, splits):
+    return {
+        'runs': runs,
+        'completed': len(finished),
+        'aborted': sum(count for count in aborts.values() if count > 0),
+        'median_run_ms': statistics.median(finished) if finished else None,
+        'best_run_ms': min(finished) if finished else None,
+        'bosses': len(bosses),
+        'median_boss_ms': statistics.median(bosses) if bosses else None,
+        # phase -> (runs that reached it, runs reset in it)
+        'phases': {phase: (count, max(aborts.get(phase, 0), 0)) for phase, count in sorted(reached.items())},
+        'median_split_ms': splits,  # phase -> median ms from the start to its end
+    }
+
+
+def format_ms(ms):
+    if ms is None:
+        return "-"
+    seconds = int(ms) // 1000
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+    return f"{seconds // 60:02}:{seconds % 60:02}"
+
+
+def format_summary(summary, timeline=None, compact=False):
+    # Lines of text; compact (phase labels only, no splits) for the GUI panel
+    def name(phase):
+        if timeline is None or phase >= len(timeline):
+            return f"phase {phase}"
+        return timeline.labels[phase] if compact else timeline.title(phase)
+
+    runs = summary['runs']
+    if not runs:
+        return ["No runs recorded"]
+    lines = [f"Runs: {runs}, completed {summary['completed']}, reset {summary['aborted']}",
+             f"Median run: {format_ms(summary['median_run_ms'])} (best {format_ms(summary['best_run_ms'])})",
+             f"Median boss: {format_ms(summary['median_boss_ms'])} ({summary['bosses']} fights)"]
+    aborts = [(phase, reached, reset) for phase, (reached, reset) in summary['phases'].items() if reset]
+    if aborts:
+        lines.append("Resets by phase:")
+        for phase, reached, reset in aborts:
+            lines.append(f"  {name(phase)}: {reset} of {reached} ({reset / reached:.0%})" if reached
+                         else f"  {name(phase)}: {reset}")
+    if not compact and summary['median_split_ms']:
+        lines.append("Median split at the end of each phase:")
+        for phase, ms in summary['median_split_ms'].items():
+            lines.append(f"  {format_ms(ms)}  {name(phase)}")
+    return lines
+
+
+def parse_date(text):
+    # YYYY-MM-DD in local time -> wall clock ms
+    try:
+        return int(datetime.datetime.strptime(text, '%Y-%m-%d').timestamp() * 1000)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a date like 2026-01-31, got {text!r}") from None
+
+
+def add_arguments(parser):
+    parser.add_argument('--history', default=HISTORY_FILE, metavar='FILE', help="run history file")
+    parser.add_argument('--no-history', action='store_true', help="don't record runs")
+
+
+def start_from_arguments(args):
+    # RunHistory to attach() to the engine, or None
+    if args.no_history:
+        return None
+    try:
+        return RunHistory(args.history)
+    except OSError as e:
+        logging.warning(f"Run history disabled: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the NIGHTREIGN Timers run history")
+    parser.add_argument('--history', default=HISTORY_FILE, metavar='FILE', help="run history file")
+    parser.add_argument('--days', type=float, default=SUMMARY_DAYS,
+                        help=f"runs started in the last DAYS days (default {SUMMARY_DAYS}, 0 for all)")
+    parser.add_argument('--since', type=parse_date, metavar='DATE', help="runs started on or after DATE (YYYY-MM-DD)")
+    parser.add_argument('--until', type=parse_date, metavar='DATE', help="runs started before DATE (YYYY-MM-DD)")
+    schedule.add_arguments(parser)
+    args = parser.parse_args()
+    since = args.since
+    if since is None and args.days:
+        since = wall_ms() - int(args.days * 86_400_000)
+    timeline = schedule.from_arguments(parser, args)
+    try:
+        reader = HistoryReader(args.history)
+    except OSError as e:
+        parser.exit(1, f"{e}\n")
+    with reader:
+        summary = reader.summary(since, args.until, timeline)
+        print(f"{args.history}: {reader.runs()} runs, {reader.count} records")
+    print("\n".join(format_summary(summary, timeline)))
+
+
+if __name__ == "__main__":
+    main()
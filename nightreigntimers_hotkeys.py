@@ -0,0 +1,89 @@
+import time
+
+import nightreigntimers_metrics as metrics
+import nightreigntimers_trace as tracing
+
+# action -> key; 'hotkey' is the classic start/reset/resume key
+DEFAULT_BINDINGS = {
+    'hotkey': 'f8',
+    'pause': 'f7',
+    'skip': 'f9',
+    'undo_reset': 'f10',
+    'trace': 'ctrl+f10',  # Save the event trace
+}
+DEBOUNCE_MS = 250  # Presses of the same action closer than this are key repeat
+
+LATENCY = metrics.histogram('nightreign_hotkey_latency_seconds',
+                            "Hotkey press to the first frame rendered after handling it")
+DEBOUNCED = metrics.counter('nightreign_hotkey_debounced_total', "Hotkey presses dropped as key repeat")
+
+
+def parse_bindings(specs):
+    # ["pause=f6", "skip=ctrl+f9"] -> bindings dict on top of the defaults
+    bindings = dict(DEFAULT_BINDINGS)
+    for spec in specs or []:
+        action, sep, key = spec.partition('=')
+        if not sep or action not in DEFAULT_BINDINGS:
+            raise ValueError(f"bad hotkey binding {spec!r}, expected ACTION=KEY with ACTION one of "
+                             f"{', '.join(DEFAULT_BINDINGS)}")
+        bindings[action] = key.strip().lower()
+    return bindings
+
+
+class HotkeyDispatcher:
+    # Global hotkeys are delivered on the keyboard library's hook thread,
+    # which the game shares. The hook callback only timestamps the press and
+    # posts ('key', action, pressed_ns) to the command queue; debouncing and
+    # the actual work happen on the Tk thread via accept().
+    #
+    # Latency from the press to the first frame rendered after handling it
+    # is recorded in the process-wide LATENCY histogram, see rendered().
+
+    def __init__(self, post, bindings=None, debounce_ms=DEBOUNCE_MS, clock=time.monotonic_ns):
+        self.post = post
+        self.bindings = dict(bindings if bindings is not None else DEFAULT_BINDINGS)
+        self.debounce_ns = int(debounce_ms * 1_000_000)
+        self.clock = clock
+        self.latency = LATENCY
+        self.debounced = 0
+        self._last_press = {}
+        self._unrendered = []
+
+    def key_for(self, action):
+        return self.bindings.get(action, '?').upper()
+
+    def register(self, keyboard):
+        for action, key in self.bindings.items():
+            keyboard.add_hotkey(key, self._hook(action))
+
+    def _hook(self, action):
+        post, clock = self.post, self.clock
+
+        def on_press():
+            post('key', action, clock())
+        return on_press
+
+    def press(self, action):
+        # Same as the hook firing, for anything other than the keyboard library
+        self.post('key', action, self.clock())
+
+    def accept(self, action, pressed_ns):
+        # Runs on the Tk thread. False for key repeat within the debounce window
+        last = self._last_press.get(action)
+        self._last_press[action] = pressed_ns
+        if last is not None and pressed_ns - last < self.debounce_ns:
+            self.debounced += 1
+            DEBOUNCED.inc()
+            return False
+        tracing.record(tracing.HOTKEY, action, pressed_ns)
+        self._unrendered.append(pressed_ns)
+        return True
+
+    def rendered(self):
+        # Call once the frame after handling the press has been drawn
+        now = self.clock()
+        if self._unrendered:
+            tracing.record(tracing.RENDERED, len(self._unrendered))
+        for pressed_ns in self._unrendered:
+            self.latency.add(now - pressed_ns)
+        self._unrendered.clear()
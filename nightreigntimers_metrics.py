@@ -0,0 +1,189 @@
+import bisect
+import os
+import threading
+import time
+
+# Bucket upper bounds, in the exported unit (seconds unless noted)
+LATENCY_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0]
+FAST_BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025]
+COUNT_BUCKETS = [0, 1, 2, 3, 4, 6, 8, 12, 16, 24]
+
+SNAPSHOT_INTERVAL = 10.0  # Seconds between --metrics-file writes
+
+
+class Histogram:
+    # Fixed buckets, counts only, so memory never grows; the last count
+    # catches everything above the top bound. add() takes raw values (ns
+    # for timings) that scale converts to the exported unit.
+    # One thread writes to a histogram; render() from another thread may
+    # see it mid-update, which is fine for monitoring.
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, scale=1e-9):
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets)
+        self.scale = scale
+        self.bounds = [b / scale for b in self.buckets]
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def summary(self):
+        if not self.total:
+            return "no samples"
+        timed = self.scale == 1e-9
+        unit = " ms" if timed else ""
+        factor = 1e-6 if timed else self.scale
+        shown = [b * 1000 if timed else b for b in self.buckets]
+        parts = [f"<={b:g}{unit.strip()}: {c}" for b, c in zip(shown, self.counts) if c]
+        if self.counts[-1]:
+            parts.append(f">{shown[-1]:g}{unit.strip()}: {self.counts[-1]}")
+        return (f"{self.total} samples, mean {self.sum / self.total * factor:.1f}{unit}, "
+                f"max {self.max * factor:.1f}{unit} ({', '.join(parts)})")
+
+    def render(self):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.total}')
+        lines.append(f"{self.name}_sum {self.sum * self.scale:.9g}")
+        lines.append(f"{self.name}_count {self.total}")
+        return lines
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self):
+        return [f"{self.name} {self.value}"]
+
+
+class Gauge:
+    # Read from a callback when rendered
+    kind = 'gauge'
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        return [f"{self.name} {self.read():.9g}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _get(self, cls, name, *args):
+        # Every instance of a component shares one process-wide metric
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, *args)
+        return metric
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, scale=1e-9):
+        return self._get(Histogram, name, help, buckets, scale)
+
+    def counter(self, name, help):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help, read):
+        gauge = self._get(Gauge, name, help, read)
+        gauge.read = read  # The latest component wins
+        return gauge
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+histogram = REGISTRY.histogram
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+
+
+def write_snapshot(path, registry=REGISTRY):
+    # Written to a temporary file first so readers never see half a snapshot
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as f:
+        f.write(registry.render())
+    os.replace(temporary, path)
+
+
+def start_snapshots(path, interval=SNAPSHOT_INTERVAL, registry=REGISTRY):
+    # Rewrite the snapshot file every interval seconds, and once more at exit
+    import atexit
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(path, registry)
+            except OSError:
+                pass
+    threading.Thread(target=run, name='metrics-snapshot', daemon=True).start()
+    atexit.register(write_snapshot, path, registry)
+
+
+def start_server(port, host='127.0.0.1', registry=REGISTRY):
+    # Serve /metrics on a local port from a background thread
+    import http.server
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="serve Prometheus-style metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help=f"write a metrics snapshot to PATH every {SNAPSHOT_INTERVAL:g} s and on exit")
+
+
+def start_from_arguments(args):
+    if args.metrics_port is not None:
+        start_server(args.metrics_port)
+    if args.metrics_file:
+        start_snapshots(args.metrics_file)
@@ -1,272 +1,358 @@
-import time
+import nightreigntimers_startup as startup
 import tkinter as tk
-from tkinter import ttk
+import os
 import threading
-import psutil
-import pygetwindow as gw
-import pystray
-from PIL import Image, ImageDraw
+import argparse
+import logging
+
+from nightreigntimers_engine import COMMANDS, TimerEngine
+import nightreigntimers_schedule as schedule
+import nightreigntimers_metrics as metrics
+import nightreigntimers_trace as tracing
+import nightreigntimers_detect as detect
+import nightreigntimers_history as run_history
+import nightreigntimers_pace as pace
+from nightreigntimers_scheduler import CommandQueue
+from nightreigntimers_view import WidgetView
+import nightreigntimers_render as render
+from nightreigntimers_render import CLOSING, FLASH, IDLE, SAFE, STATUS, TOTAL
+from nightreigntimers_audio import AudioCues
+from nightreigntimers_pacing import RenderPacing
+from nightreigntimers_pace import PaceTracker
+from nightreigntimers_hotkeys import HotkeyDispatcher, parse_bindings
+from nightreigntimers_watch import GameWatcher
+
+TRAY_ICON = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nightreigntimers_tray.png')
+TRAY_ICON_CACHE = os.path.join(startup.data_dir(), 'nightreigntimers_tray.png')  # Drawn when TRAY_ICON is missing
+
+PROFILE_SECONDS = 2  # --profile-startup: time to let lazy features load before reporting
 
-minute = 60
 dbgflag = False  # Set to True for debugging mode
-if dbgflag:
-    minute = 3  # Debugging mode: speed up to x seconds per minute
-
-# 8 phases: [Safe, Closing, Safe, Closing] x 2 days
-PHASE_DURATIONS = [
-    4.5 * minute, 3 * minute,  # Day 1, First Storm Safe/Closing
-    3.5 * minute, 3 * minute,  # Day 1, Second Storm Safe/Closing
-    4.5 * minute, 3 * minute,  # Day 2, First Storm Safe/Closing
-    3.5 * minute, 3 * minute,  # Day 2, Second Storm Safe/Closing
-]
-PHASE_LABELS = [
-    "Day 1: First Storm Safe",
-    "Day 1: First Storm Closing",
-    "Day 1: Second Storm Safe",
-    "Day 1: Second Storm Closing",
-    "Day 2: First Storm Safe",
-    "Day 2: First Storm Closing",
-    "Day 2: Second Storm Safe",
-    "Day 2: Second Storm Closing",
-]
-BOSS_PAUSE_AFTER = 3  # Pause after phase 3 (Day 1, Second Storm Closing)
-BEEP_WARNING_SECONDS = 5
-
-try:
-    import winsound
-    HAS_WINSOUND = True
-except ImportError:
-    HAS_WINSOUND = False
+DEBUG_MINUTE = 3  # Debugging mode: speed up to x seconds per minute
+
+PACE_COLORS = {-1: SAFE, 0: IDLE, 1: CLOSING}  # Ahead, level, behind
+
 
 class OverlayTimers:
-    def __init__(self, window):
+    def __init__(self, window, process_watcher=None, focus_watcher=None, clock=None, audio=None, bindings=None,
+                 renderer=render.DEFAULT_RENDERER, timeline=None, engine=None, reference=None):
         self.window = window
-        self.phase = 0
-        self.running = False
-        self.paused_for_boss = False
-        self.start_time = None
-        self.phase_start_time = None
-        self.total_duration = sum(PHASE_DURATIONS)
-        self.total_elapsed = 0
+        if engine is None:
+            engine = TimerEngine(self.window.after, self.window.after_cancel, clock=clock, timeline=timeline)
+        self.engine = engine  # Or a RemoteEngine mirroring the timer daemon
+        self.timeline = self.engine.timeline
+        self.engine.subscribe(self.on_timer_event)
+        self.commands = CommandQueue(self.window, self.on_command)
+        self.view = WidgetView()
+        self.audio = audio if audio is not None else AudioCues(post=self.commands.post)
+        self.hotkeys = HotkeyDispatcher(self.commands.post, bindings, clock=self.engine.clock)
+        self.phase_sync = None  # PhaseSync while following the game's screen, see --detect
+        self.total_duration = self.timeline.total
+        self._color = SAFE
+        self.pacing = RenderPacing(bar_pixels=render.BAR_LENGTH)
+        self.engine.pacing = self.pacing
         self.tray_icon = None
-        self._setup_overlay()
-        self._setup_gui()
-        self.window.after(200, self.update_ui)
-        self.check_game_focus()  # Start periodic check
-        threading.Thread(target=self.setup_tray, daemon=True).start()
-
-    def _setup_overlay(self):
-        # Make the window borderless, always on top, and transparent background
-        self.window.overrideredirect(True) # also hides from taskbar
-        self.window.attributes('-topmost', True)
-        self.window.attributes('-alpha', 0.70)  # Slight transparency
-        self.window.configure(bg='#222222')
-        # Place overlay at top center of the screen
-        screen_width = self.window.winfo_screenwidth()
-        self.window.geometry(f"420x110+{screen_width//2-210}+5")
-
-    def _setup_gui(self):
-        style = ttk.Style(self.window)
-        style.theme_use('default')
-        style.configure('Current.Horizontal.TProgressbar', troughcolor="#222222", background='#00aa00', thickness=16)
-        style.configure('Red.Horizontal.TProgressbar', troughcolor="#222222", background='#ff2222', thickness=16)
-        style.configure('Flash.Horizontal.TProgressbar', troughcolor="#222222", background='#992222', thickness=16)
-        style.configure('Total.Horizontal.TProgressbar', troughcolor="#222222", background='#447efb', thickness=10)
-
-        # --- [x] Close Button ---
-        close_btn = tk.Label(self.window, text="[x]", font=("Segoe UI", 11, "bold"), bg="#222222", fg="#ff6666", cursor="hand2")
-        close_btn.place(relx=1.0, x=-8, y=2, anchor="ne")
-        close_btn.bind("<Button-1>", lambda e: self.window.destroy())
-
-        # Use place instead of pack for the main frame to avoid covering the [x] button
-        frame = tk.Frame(self.window, bg='#222222')
-        frame.place(x=0, y=0, relwidth=1, relheight=1, anchor='nw')
-
-        # Phase label and [x] close button on the same row
-        phase_row = tk.Frame(frame, bg='#222222')
-        phase_row.pack(fill='x', pady=(0, 0))
-
-        self.phase_label = tk.Label(phase_row, text="[Phase]", font=("Segoe UI", 13, "bold"), bg='#222222', fg='#ffffff')
-        self.phase_label.pack(side='left', anchor='w')
-
-        close_btn = tk.Label(phase_row, text="[x]", font=("Segoe UI", 11, "bold"), bg="#222222", fg="#ff6666", cursor="hand2")
-        close_btn.pack(side='right', anchor='e', padx=(0, 2))
-        close_btn.bind("<Button-1>", lambda e: self.window.destroy())
-
-        # Current phase progress bar
-        self.phase_bar = ttk.Progressbar(frame, length=380, mode='determinate', maximum=1, style='Current.Horizontal.TProgressbar')
-        self.phase_bar.pack(pady=(4, 8))
-
-        # Total progress bar
-        self.total_bar = ttk.Progressbar(frame, length=380, mode='determinate', maximum=1, style='Total.Horizontal.TProgressbar')
-        self.total_bar.pack(pady=(0, 0))
-
-        # Combined time/instruction label
-        self.status_label = tk.Label(frame, text="Press [F8] to start/reset timer", font=("Segoe UI", 11), bg='#222222', fg='#ffffcc', wraplength=400, justify="left")
-        self.status_label.pack(anchor='w', pady=(8, 0))
-
-        # Hotkey
-        import keyboard
-        keyboard.add_hotkey('f8', self.on_hotkey)
+        self.pace = None  # PaceTracker against a reference run, on the line under the status
+        self._pace_readout = None
+        if reference is not None:
+            self.pace = PaceTracker(self.engine, reference, self.window.after, self.window.after_cancel,
+                                    self.update_pace, self.pacing)
+        self._setup_gui(renderer)
+        self.game_watcher = GameWatcher(self.on_game_focus, self.window.after, self.window.after_cancel,
+                                        self.commands.post, process=process_watcher, focus=focus_watcher)
+        self.game_watcher.start()
+
+    def _setup_gui(self, renderer):
+        render.setup_window(self.window)
+        self.renderer = render.RENDERERS[renderer](self.window, self.view, self.window.destroy)
+        self.renderer.reset(self.idle_text())
 
     def on_hotkey(self):
-        self.window.attributes('-topmost', True)
-        self.window.update()
-        if self.paused_for_boss:
-            self.paused_for_boss = False
-            self.phase += 1
-            self.phase_start_time = time.time()
-            self.running = True
-            self.status_label.config(text="")
-            threading.Thread(target=self.run_timer, daemon=True).start()
-        else:
-            self.reset_all()
-            self.running = True
-            self.phase = 0
-            self.start_time = time.time()
-            self.phase_start_time = self.start_time
-            self.total_elapsed = 0
-            self.status_label.config(text="")
-            threading.Thread(target=self.run_timer, daemon=True).start()
+        self.hotkeys.press('hotkey')
+
+    def on_command(self, command, *args):
+        # Runs on the Tk thread, see CommandQueue
+        if command == 'key':
+            if not self.hotkeys.accept(*args):
+                return
+            command = args[0]
+            self.window.after_idle(self.hotkeys.rendered)
+        if command == 'hotkey':
+            self.window.attributes('-topmost', True)
+            self.window.update_idletasks()
+            self.engine.on_hotkey()
+        elif command in COMMANDS:
+            getattr(self.engine, command)()
+        elif command == 'remote':
+            self.engine.apply(*args)
+        elif command == 'detect':
+            if self.phase_sync is not None:
+                self.phase_sync.on_detection(*args)
+        elif command == 'bell':
+            self.window.bell()
+        elif command == 'focus':
+            self.game_watcher.on_focus(*args)
+        elif command == 'trace':
+            self.save_trace()
+        elif command == 'exit':
+            if self.tray_icon:
+                self.tray_icon.stop()
+            self.window.quit()
+
+    def save_trace(self):
+        path = tracing.save(self.timeline.title)
+        logging.info(f"Saving the event trace to {path}")
+        if self.tray_icon is not None and getattr(self.tray_icon, 'HAS_NOTIFICATION', False):
+            self.tray_icon.notify(f"Event trace saved to {path}")
 
     def reset_all(self):
-        self.running = False
-        self.paused_for_boss = False
-        self.phase = 0
-        self.total_elapsed = 0
-        self.phase_bar.config(value=0, maximum=1)
-        self.total_bar.config(value=0, maximum=1)
-        self.phase_label.config(text="Phase")
-        self.status_label.config(text="Press [F8] to start/reset timer", fg='#cccccc')
-
-    def beep_notice(self):
-        def do_beep():
-            if HAS_WINSOUND:
-                winsound.Beep(130, 400)
-                winsound.Beep(110, 300)
-                winsound.Beep(98, 500)
-            else:
-                self.window.bell()
-        threading.Thread(target=do_beep, daemon=True).start()
+        self.renderer.reset(self.idle_text())
+
+    def idle_text(self):
+        return f"Press [{self.hotkeys.key_for('hotkey')}] to start/reset timer"
+
+    def schedule_warning(self):
+        # Hand the storm warning to the audio worker, timed to the phase deadline
+        self.audio.cancel_all()
+        delay = self.engine.warning_in(self.engine.clock())
+        if delay is not None:
+            self.audio.schedule('warning', self.audio.clock() + delay)
+
+    def on_timer_event(self, event, phase):
+        # Called by the engine only when something visible changes
+        if event in ('reset', 'pause'):
+            self.audio.cancel_all()
+        elif event in ('phase', 'unpause', 'restore'):
+            self.schedule_warning()
+        elif event == 'done':
+            logging.info(f"Run timing: {self.engine.format_jitter_report()}")
+            logging.info(f"Hotkey to render latency: {self.hotkeys.latency.summary()}")
+            logging.info(f"Frame cost: {self.renderer.stats.summary()}")
+        if not self.pacing.visible:
+            # Nothing is drawn while hidden, set_visible() catches up
+            self.pacing.stale = True
+            return
+        if event == 'reset':
+            self.reset_all()
+        elif event == 'phase':
+            duration = self.timeline.durations[phase]
+            self.renderer.phase(f"{self.timeline.title(phase)} ({self._format_time(duration)})", duration,
+                                self.total_duration)
+            self.renderer.status(color=STATUS)
+        elif event == 'tick':
+            with self.renderer.frame():
+                self.update_ui()
+                self.update_pace()
+            self.view.end_tick()
+        elif event == 'phase_end':
+            self.renderer.progress(self.timeline.durations[phase], self.engine.run_elapsed(), self._color)
+        elif event == 'boss':
+            self.renderer.status(f"Boss fight! Press [{self.hotkeys.key_for('hotkey')}] when ready to resume.", TOTAL)
+        elif event == 'pause':
+            self.renderer.status(f"Paused. Press [{self.hotkeys.key_for('pause')}] to continue.", TOTAL)
+        elif event == 'unpause':
+            self.renderer.status(color=STATUS)
+            self.update_ui()
+        elif event == 'restore':
+            self.redraw()
+        elif event == 'done':
+            self.renderer.status(self.idle_text(), IDLE)
+
+    def redraw(self):
+        # Everything from the engine's state, e.g. after undo_reset or when shown again
+        phase = self.engine.phase
+        self.reset_all()
+        if self.engine.paused_for_boss:
+            # The phase that ran into the pause, finished, under the boss prompt
+            self.on_timer_event('phase', phase)
+            self.on_timer_event('phase_end', phase)
+            self.on_timer_event('boss', phase)
+        elif self.engine.running or self.engine.paused:
+            self.on_timer_event('phase', phase)
+            self.update_ui()
+            if self.engine.paused:
+                self.on_timer_event('pause', phase)
+        self.update_pace()
 
     def update_ui(self):
-        # Called every 200ms to update the overlay UI
-        if self.running and self.phase < len(PHASE_DURATIONS):
-            duration = PHASE_DURATIONS[self.phase]
-            elapsed = time.time() - self.phase_start_time
-            total_elapsed = (self.total_elapsed + elapsed)
-            remaining = max(0, duration - elapsed)
-            # Update progress bars
-            self.phase_bar.config(maximum=duration, value=min(elapsed, duration))
-            self.total_bar.config(maximum=self.total_duration, value=min(total_elapsed, self.total_duration))
-            # Update labels
-            self.phase_label.config(text=f"{PHASE_LABELS[self.phase]} ({self._format_time(duration)})")
-            self.status_label.config(
-                text=f"{self._format_time(remaining)} remaining"
-            )
-            # Change color: green for safe, flashing red for closing
-            if self.phase % 2 == 0:
-                self.phase_bar.config(style='Current.Horizontal.TProgressbar')
-            else:
-                if hasattr(self, '_flash') and self._flash:
-                    self.phase_bar.config(style='Flash.Horizontal.TProgressbar')
-                else:
-                    self.phase_bar.config(style='Red.Horizontal.TProgressbar')
-                self._flash = not getattr(self, '_flash', False)
-        else:
-            # Show instructions if not running
-            if self.paused_for_boss:
-                self.status_label.config(text="Boss fight! Press [F8] when ready to resume.", fg='#447efb')
-            else:
-                self.status_label.config(text="Press [F8] to start/reset timer", fg='#cccccc')
-        self.window.after(200, self.update_ui)
-
-    def run_timer(self):
-        while self.running and self.phase < len(PHASE_DURATIONS):
-            duration = PHASE_DURATIONS[self.phase]
-            elapsed = time.time() - self.phase_start_time
-            remaining = duration - elapsed
-
-            # Beep warning
-            if 0 < remaining < BEEP_WARNING_SECONDS and abs(elapsed - (duration - BEEP_WARNING_SECONDS)) < 0.3 and self.phase % 2 == 0:
-                self.beep_notice()
-
-            if elapsed >= duration:
-                self.phase_bar.config(value=duration)
-                self.total_elapsed += duration
-                if self.phase == BOSS_PAUSE_AFTER:
-                    self.paused_for_boss = True
-                    self.running = False
-                    self.status_label.config(text="Boss fight! Press [F8] when ready to resume.", fg='#447efb')
-                    return
-                self.phase += 1
-                if self.phase < len(PHASE_DURATIONS):
-                    self.phase_start_time = time.time()
-                continue
-            time.sleep(0.1)
-        self.running = False
-        self.status_label.config(text="Press [F8] to start/reset timer", fg='#cccccc')
+        # Called on each frame the pacing asks for while a phase runs
+        duration = self.engine.duration()
+        elapsed = self.engine.elapsed()
+        remaining = max(0, duration - elapsed)
+        self._color = self._bar_color(elapsed, remaining)
+        self.renderer.progress(elapsed, min(self.engine.run_elapsed(), self.total_duration), self._color)
+        self.renderer.status(f"{self._format_time(remaining)} remaining")
+
+    def update_pace(self):
+        # Ahead/behind the reference run; drawn only when the readout changes
+        if self.pace is None:
+            return
+        if not self.pacing.visible:
+            self.pacing.stale = True
+            return
+        readout = self.pace.readout()
+        if readout is self._pace_readout:
+            return
+        self._pace_readout = readout
+        text, sign = readout
+        self.renderer.pace(text, PACE_COLORS[sign])
+
+    def _bar_color(self, elapsed, remaining):
+        # Green for safe, flashing red for closing (faster near the end)
+        if not self.engine.is_closing():
+            return SAFE
+        return CLOSING if self.pacing.flash_lit(elapsed, remaining) else FLASH
 
     def _format_time(self, secs):
         mins = int(secs) // 60
         s = int(secs) % 60
         return f"{mins:02}:{s:02}"
 
-    def check_game_focus(self):
-        # Check if nightreign.exe is running and in focus
-        game_running = False
-        game_focused = False
-
-        # Check if process is running
-        for proc in psutil.process_iter(['name']):
-            if proc.info['name'] and proc.info['name'].lower() == 'nightreign.exe':
-                game_running = True
-                break
-
-        # Check if window is focused
-        if game_running:
-            try:
-                active = gw.getActiveWindow()
-                if active and 'nightreign' in active.title.lower():
-                    game_focused = True
-            except Exception:
-                pass
-
-        if game_running and game_focused:
+    def on_game_focus(self, visible):
+        # Show the overlay only while nightreign.exe is running and in focus
+        if visible:
             self.window.deiconify()
             self.window.attributes('-topmost', True)
         else:
             self.window.withdraw()
+        self.set_visible(visible)
+
+    def set_visible(self, visible):
+        # Rendering stops while hidden; showing again redraws in one frame
+        if visible == self.pacing.visible:
+            return
+        if visible:
+            if self.pacing.show():
+                with self.renderer.frame():
+                    self.redraw()
+        else:
+            self.pacing.hide()
+        self.engine.refresh()
+        if self.pace is not None:
+            self.pace.refresh()
 
-        # Check again in 1 second
-        self.window.after(1000, self.check_game_focus)
+    def start_tray(self):
+        threading.Thread(target=self.setup_tray, daemon=True).start()
 
-    def setup_tray(self):
-        # Create a simple icon
+    def load_tray_icon(self):
+        # Pre-rendered icon shipped next to the script; drawn (and cached in
+        # the data folder, the install may be read-only) only if missing
+        Image = startup.timed_import('PIL.Image')
+        for path in (TRAY_ICON, TRAY_ICON_CACHE):
+            try:
+                return Image.open(path)
+            except OSError:
+                pass
+        ImageDraw = startup.timed_import('PIL.ImageDraw')
         icon_size = 64
         image = Image.new('RGBA', (icon_size, icon_size), (34, 34, 34, 255))
         draw = ImageDraw.Draw(image)
         draw.ellipse((16, 16, 48, 48), fill=(68, 126, 251, 255))  # blue circle
         draw.rectangle((28, 28, 36, 36), fill=(0, 170, 0, 255))   # green square
+        try:
+            os.makedirs(os.path.dirname(TRAY_ICON_CACHE), exist_ok=True)
+            image.save(TRAY_ICON_CACHE)
+        except OSError:
+            pass
+        return image
+
+    def setup_tray(self):
+        pystray = startup.timed_import('pystray')
+        image = self.load_tray_icon()
 
         menu = pystray.Menu(
             pystray.MenuItem('[Overlay hidden while nightreign.exe not in foreground]', '', enabled=False),
             pystray.Menu.SEPARATOR,
+            pystray.MenuItem('Save event trace', self.on_tray_trace),
             pystray.MenuItem('Exit', self.on_tray_exit)            
         )
         self.tray_icon = pystray.Icon("NightreignTimers", image, "Nightreign Timers Overlay", menu)
         self.tray_icon.run()
 
+    def on_tray_trace(self, icon, item):
+        self.commands.post('trace')
+
     def on_tray_exit(self, icon, item):
         # Clean exit for both tray and app
-        if self.tray_icon:
-            self.tray_icon.stop()
-        self.window.quit()
+        self.commands.post('exit')
 
 def main():
+    parser = argparse.ArgumentParser(description="NIGHTREIGN Timers overlay")
+    parser.add_argument('--hotkey', action='append', metavar='ACTION=KEY',
+                        help="rebind a hotkey (actions: hotkey, pause, skip, undo_reset, trace)")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help=f"print import times and peak RSS {PROFILE_SECONDS} s after launch, then exit")
+    parser.add_argument('--renderer', choices=list(render.RENDERERS), default=render.DEFAULT_RENDERER,
+                        help="label/progress bar widgets (default) or canvas items")
+    parser.add_argument('--frame-cost', action='store_true',
+                        help="include Tk's redraw in each frame's measured cost and print a summary on exit")
+    parser.add_argument('--connect', nargs='?', const='', metavar='SOCKET',
+                        help="show the timer daemon's timer instead of running one (see nightreigntimers_daemon.py)")
+    schedule.add_arguments(parser)
+    metrics.add_arguments(parser)
+    detect.add_arguments(parser)
+    run_history.add_arguments(parser)
+    pace.add_arguments(parser)
+    if dbgflag:
+        parser.set_defaults(minute=DEBUG_MINUTE)
+    args = parser.parse_args()
+    try:
+        bindings = parse_bindings(args.hotkey)
+    except ValueError as e:
+        parser.error(str(e))
+    timeline = schedule.from_arguments(parser, args)
+    metrics.start_from_arguments(args)
+
+    engine = None
+    if args.connect is not None:
+        daemon = startup.timed_import('nightreigntimers_daemon')
+        try:
+            engine = daemon.RemoteEngine(daemon.parse_address(args.connect))
+        except OSError as e:
+            parser.exit(1, f"cannot connect to the timer daemon: {e}\n")
+
+    # With the daemon's timer the daemon records the runs
+    history = run_history.start_from_arguments(args) if engine is None else None
+    try:
+        reference = pace.start_from_arguments(args, timeline) if engine is None else None
+    except pace.PaceError as e:
+        parser.exit(1, f"{e}\n")
+
+    startup.mark("modules loaded")
     window = tk.Tk()
-    app = OverlayTimers(window)
+    app = OverlayTimers(window, bindings=bindings, renderer=args.renderer, timeline=timeline, engine=engine,
+                        reference=reference)
+    if history is not None:
+        history.attach(app.engine)
+        if app.pace is not None:
+            # The first or a new personal best is the reference from the next run on
+            history.on_run_end = lambda: window.after_idle(app.pace.on_run_end)
+    app.renderer.flush = args.frame_cost
+    if engine is not None:
+        # The daemon owns the hotkeys
+        engine.listen(app.commands.post)
+    else:
+        app.hotkeys.register(startup.timed_import('keyboard'))
+    try:
+        app.phase_sync, detector = detect.start_from_arguments(args, app.engine, app.commands.post)
+    except detect.DetectError as e:
+        parser.exit(1, f"{e}\n")
+    startup.mark("overlay ready")
+    # Tray icon once the window is up, off the startup path
+    window.after_idle(app.start_tray)
+    if args.profile_startup:
+        def finish_profile():
+            print(startup.report())
+            window.quit()
+        window.after_idle(lambda: startup.mark("first idle"))
+        window.after(PROFILE_SECONDS * 1000, finish_profile)
     window.mainloop()
+    if detector is not None:
+        detector.stop()
+    if history is not None:
+        history.close()
+    if args.frame_cost:
+        print(f"Frame cost ({args.renderer}): {app.renderer.stats.summary()}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
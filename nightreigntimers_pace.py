@@ -0,0 +1,333 @@
+import argparse
+import json
+import logging
+
+import nightreigntimers_history as run_history
+import nightreigntimers_schedule as schedule
+
+NS = 1_000_000_000
+
+# Readout kinds: delta of the run so far, of the boss fight under way, of the finished run
+PACE, BOSS, RUN = 'Pace', 'Boss', 'Run'
+NO_READOUT = ("", 0)
+NO_REFERENCE = ("No personal best yet", 0)
+
+
+class PaceError(ValueError):
+    pass
+
+
+class Reference:
+    # The splits of a reference run lined up with a timeline, for comparing
+    # runs against it:
+    #
+    #   shift_ns[phase]  how much later than the schedule alone the reference
+    #                    reached the start of phase: its boss fights, pauses
+    #                    and wakeup lateness so far
+    #   boss_ns[phase]   length of its boss fight after phase, or None
+    #   run_ns           its length start to finish, or None if it was reset
+    #
+    # Storms run on the game's clock, so only pauses move one run against
+    # another: a run's delta in a phase is how much more it has paused than
+    # the reference had by then, which is one tuple lookup away.
+    #
+    # ends_ms and boss_ms are the splits as recorded (phase -> ms since the
+    # start at the end of the phase, phase -> boss fight ms), kept to print
+    # and save them. An empty reference (see empty()) stands in for a
+    # personal best not set yet.
+
+    def __init__(self, timeline, ends_ms, boss_ms, run_ms=None, label="PB", source='best', path=None):
+        self.timeline = timeline
+        self.ends_ms = dict(ends_ms)
+        self.boss_ms = dict(boss_ms)
+        self.run_ms = run_ms
+        self.label = label
+        self.source = source  # 'best', a run number or a splits file
+        self.path = path  # History file the splits came from
+        self.is_empty = False
+        shift = [0] * len(timeline)
+        for phase in range(1, len(timeline)):
+            end = self.ends_ms.get(phase - 1)
+            if end is None:
+                # Reset before here: hold the last known lead
+                shift[phase] = shift[phase - 1]
+            else:
+                start_ns = (end + self.boss_ms.get(phase - 1, 0)) * 1_000_000
+                shift[phase] = start_ns - timeline.offsets[phase]
+        self.shift_ns = tuple(shift)
+        self.boss_ns = tuple(self.boss_ms[phase] * 1_000_000 if phase in self.boss_ms else None
+                             for phase in range(len(timeline)))
+        self.run_ns = None if run_ms is None else run_ms * 1_000_000
+
+    @classmethod
+    def empty(cls, timeline, path=run_history.HISTORY_FILE):
+        # No completed run yet: nothing to compare with until one is in path
+        reference = cls(timeline, {}, {}, path=path)
+        reference.is_empty = True
+        return reference
+
+    @classmethod
+    def from_history(cls, path, timeline, run=None):
+        # The fastest completed run of timeline's schedule (None if there is
+        # none yet), or the given run number
+        with run_history.HistoryReader(path) as reader:
+            best = run is None
+            if best:
+                run = reader.best_run(timeline)
+                if run is None:
+                    return None
+            records = reader.run_records(run)
+        if not records:
+            raise PaceError(f"no run {run} in {path}")
+        if records[0][2] != run_history.schedule_id(timeline):
+            raise PaceError(f"run {run} is not a run of the {timeline.name} schedule at this speed")
+        ends, bosses, run_ms = {}, {}, None
+        for _, _, _, kind, phase, value in records:
+            if kind == run_history.PHASE:
+                ends[phase] = value
+            elif kind == run_history.BOSS:
+                bosses[phase] = value
+            elif kind == run_history.DONE:
+                run_ms = value
+        return cls(timeline, ends, bosses, run_ms, label="PB" if best else f"run {run}",
+                   source='best' if best else run, path=path)
+
+    @classmethod
+    def load(cls, path, timeline):
+        # Splits saved with save()
+        try:
+            with open(path, encoding='utf-8') as f:
+                spec = json.load(f)
+            if spec['schedule'] != timeline.name or spec['total_ns'] != timeline.total_ns:
+                raise PaceError(f"{path} holds splits of another schedule or speed ({spec['schedule']})")
+            ends = {int(phase): int(ms) for phase, ms in spec['ends_ms'].items()}
+            bosses = {int(phase): int(ms) for phase, ms in spec['boss_ms'].items()}
+            run_ms = spec.get('run_ms')
+            label = str(spec.get('label', "reference"))
+        except PaceError:
+            raise
+        except OSError as e:
+            raise PaceError(f"cannot read {path}: {e}") from None
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            raise PaceError(f"{path} is not a splits file: {e!r}") from None
+        return cls(timeline, ends, bosses, None if run_ms is None else int(run_ms), label=label, source=path)
+
+    def save(self, path):
+        spec = {
+            'schedule': self.timeline.name,
+            'total_ns': self.timeline.total_ns,
+            'label': self.label,
+            'run_ms': self.run_ms,
+            'ends_ms': {str(phase): ms for phase, ms in sorted(self.ends_ms.items())},
+            'boss_ms': {str(phase): ms for phase, ms in sorted(self.boss_ms.items())},
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(spec, f, indent=2)
+
+
+class PaceTracker:
+    # Live ahead/behind readout of one engine's run against a Reference.
+    # It only notes when the run started; everything else is read off the
+    # engine when asked, so readout() on a tick is a few attribute reads,
+    # a subtraction and a lookup in the reference's tuples, and hands back
+    # the same (text, sign) tuple until the shown second changes.
+    #
+    # The engine sleeps through a boss fight, so while one is on the
+    # tracker wakes itself on each of the fight's whole seconds (not while
+    # the frontend is hidden) to keep the boss delta moving. on_change() is
+    # called then and after every engine event but the tick, which the
+    # frontend handles in its own frame.
+
+    def __init__(self, engine, reference, schedule=None, cancel=None, on_change=None, pacing=None):
+        self.engine = engine
+        self.reference = reference
+        self._schedule = schedule
+        self._cancel = cancel
+        self.on_change = on_change
+        self.pacing = pacing  # Frontend's RenderPacing: no boss fight wakeups while hidden
+        self.started = None  # Engine clock time of the run's start
+        self.final_ns = None  # Delta of the finished run, until the next start or reset
+        self._undo = None
+        self._handle = None
+        self._kind = None
+        self._seconds = None
+        self._readout = NO_READOUT
+        engine.subscribe(self.on_timer_event)
+
+    def _now(self):
+        engine = self.engine
+        return engine.now if engine.now is not None else engine.clock()
+
+    def on_timer_event(self, event, phase):
+        if event == 'tick':
+            return
+        engine = self.engine
+        if event == 'start':
+            self.started = self._now()
+            self.final_ns = None
+        elif event == 'reset':
+            # Like the engine: only a reset of a live run can be undone
+            self._undo = (self.started, self.final_ns) if engine.can_undo() else None
+            self.final_ns = None
+        elif event == 'restore':
+            if self._undo is not None and not engine.can_undo():
+                (self.started, self.final_ns), self._undo = self._undo, None
+        elif event == 'done':
+            run_ns = self.reference.run_ns
+            if run_ns is not None and self.started is not None:
+                self.final_ns = self._now() - self.started - run_ns
+        self.refresh()
+        if self.on_change is not None:
+            self.on_change()
+
+    def refresh(self):
+        # Restart the boss fight wakeups, e.g. when the frontend is shown again
+        if self._handle is not None:
+            self._cancel(self._handle)
+            self._handle = None
+        if self.engine.paused_for_boss:
+            self._plan()
+
+    def _boss_start(self):
+        engine = self.engine
+        return engine.origin + engine.timeline.offsets[engine.phase + 1]
+
+    def _plan(self):
+        if self._schedule is None or (self.pacing is not None and not self.pacing.visible):
+            return
+        into_ms = (self.engine.clock() - self._boss_start()) // 1_000_000
+        self._handle = self._schedule(1000 - into_ms % 1000, self._boss_tick)
+
+    def _boss_tick(self):
+        self._handle = None
+        if not self.engine.paused_for_boss:
+            return
+        if self.on_change is not None:
+            self.on_change()
+        self._plan()
+
+    def delta_ns(self, now=None):
+        # (kind, ns ahead (negative) or behind (positive) the reference), or None between runs
+        engine = self.engine
+        reference = self.reference
+        if self.final_ns is not None:
+            return RUN, self.final_ns
+        if self.started is None:
+            return None
+        phase = engine.phase
+        if engine.paused_for_boss:
+            boss = reference.boss_ns[phase]
+            if boss is not None:
+                return BOSS, (self._now() if now is None else now) - self._boss_start() - boss
+        elif engine.paused:
+            # The pause so far counts, as it will once the run goes on
+            return PACE, (engine.origin + (self._now() if now is None else now) - engine.paused_at
+                          - self.started - reference.shift_ns[phase])
+        elif not engine.running:
+            return None
+        return PACE, engine.origin - self.started - reference.shift_ns[phase]
+
+    def readout(self, now=None):
+        # (text, sign) for the pace line: sign -1 ahead of the reference, 1
+        # behind, 0 level. Formatted only when the whole second shown changes
+        if self.reference.is_empty:
+            return NO_REFERENCE
+        delta = self.delta_ns(now)
+        if delta is None:
+            self._kind = None
+            self._readout = NO_READOUT
+            return NO_READOUT
+        kind, ns = delta
+        seconds = ns // NS if ns >= 0 else -(-ns // NS)
+        if seconds == self._seconds and kind is self._kind:
+            return self._readout
+        self._kind, self._seconds = kind, seconds
+        self._readout = (f"{kind} {format_delta(seconds)} vs {self.reference.label}",
+                         (seconds > 0) - (seconds < 0))
+        return self._readout
+
+    def on_run_end(self):
+        # A new personal best becomes the reference for the next run
+        reference = self.reference
+        if reference.source != 'best' or reference.path is None:
+            return
+        try:
+            best = Reference.from_history(reference.path, reference.timeline)
+        except (OSError, PaceError) as e:
+            logging.warning(f"Personal best not reloaded: {e}")
+            return
+        if best is not None:
+            self.reference = best
+
+
+def format_delta(seconds):
+    sign = '+' if seconds > 0 else '-' if seconds < 0 else ''
+    seconds = abs(seconds)
+    return f"{sign}{seconds // 60}:{seconds % 60:02}"
+
+
+def load_reference(source, timeline, history=run_history.HISTORY_FILE):
+    # 'best', a run number from the history, or a splits file. Before the
+    # first completed run the best is an empty reference, replaced once a
+    # run completes (PaceTracker.on_run_end())
+    if source == 'best':
+        best = Reference.from_history(history, timeline)
+        return best if best is not None else Reference.empty(timeline, history)
+    if source.isdigit():
+        return Reference.from_history(history, timeline, int(source))
+    return Reference.load(source, timeline)
+
+
+def add_arguments(parser):
+    parser.add_argument('--pace', default='best', metavar='SOURCE',
+                        help="compare runs against: best (personal best from the run history, default), a run "
+                             "number from the history, or a splits file saved with nightreigntimers_pace.py --save")
+    parser.add_argument('--no-pace', action='store_true', help="don't show the pace comparison")
+
+
+def start_from_arguments(args, timeline):
+    # Reference for the frontend, or None with --no-pace. Raises PaceError for a bad --pace
+    if args.no_pace:
+        return None
+    try:
+        return load_reference(args.pace, timeline, args.history)
+    except OSError as e:
+        if args.pace != 'best':
+            raise PaceError(f"cannot read {args.history}: {e}") from None
+        # The history may be readable once a run has been recorded
+        logging.warning(f"No personal best to compare with: {e}")
+        return Reference.empty(timeline, args.history)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or save the reference splits of the NIGHTREIGN Timers pace "
+                                                 "comparison")
+    parser.add_argument('--history', default=run_history.HISTORY_FILE, metavar='FILE', help="run history file")
+    parser.add_argument('--run', type=int, help="a run number from the history instead of the personal best")
+    parser.add_argument('--save', metavar='FILE', help="save the splits, for --pace FILE")
+    schedule.add_arguments(parser)
+    args = parser.parse_args()
+    timeline = schedule.from_arguments(parser, args)
+    try:
+        reference = Reference.from_history(args.history, timeline, args.run)
+    except (OSError, PaceError) as e:
+        parser.exit(1, f"{e}\n")
+    if reference is None:
+        parser.exit(1, f"no completed {timeline.name} run in {args.history} yet\n")
+    print(f"{reference.label} ({timeline.name}): {run_history.format_ms(reference.run_ms)}")
+    for phase in range(len(timeline)):
+        end = reference.ends_ms.get(phase)
+        line = f"  {run_history.format_ms(end)}  {timeline.title(phase)}"
+        if phase in reference.boss_ms:
+            line += f", boss {run_history.format_ms(reference.boss_ms[phase])}"
+        print(line)
+    if args.save:
+        try:
+            reference.save(args.save)
+        except OSError as e:
+            parser.exit(1, f"{e}\n")
+        print(f"Saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+NS = 1_000_000_000
+
+NEAR_SECONDS = 10  # Final stretch of a phase that gets the smooth bar and fast flash
+FLASH_MS = 250  # Flash half-period in the final stretch of a closing phase; a second before it
+
+
+class RenderPacing:
+    # When a frontend needs a frame between the engine's own deadlines
+    # (phase ends and warning cues), asked by TimerEngine for its next
+    # wakeup:
+    #
+    #   - while hidden (withdrawn or minimized) never: the frontend skips
+    #     drawing, marks itself stale and redraws everything in one frame
+    #     once shown again
+    #   - otherwise the next whole second on either readout
+    #   - in the last near_seconds of a phase, also each time the bar grows
+    #     by a pixel (bar_pixels long) and, in a closing phase, each flash
+    #     half-period
+    #
+    # flash_lit() is the flash state for a moment, so the colour follows
+    # the clock rather than how many frames happened to be drawn.
+
+    def __init__(self, bar_pixels=0, flash=True, near_seconds=NEAR_SECONDS, flash_ms=FLASH_MS):
+        self.bar_pixels = bar_pixels
+        self.flash = flash
+        self.near_ns = int(near_seconds * NS)
+        self.flash_ns = int(flash_ms * 1_000_000)
+        self.visible = True
+        self.stale = False  # Something was not drawn while hidden
+
+    def hide(self):
+        self.visible = False
+
+    def show(self):
+        # True if the frontend must redraw everything
+        self.visible = True
+        stale, self.stale = self.stale, False
+        return stale
+
+    def next_frame(self, now, phase_start, phase_end, closing):
+        # Clock time of the next frame, or None for no frames at all
+        if not self.visible:
+            return None
+        into = now - phase_start
+        frame = min(now + NS - into % NS, now + ((phase_end - now) % NS or NS))
+        if phase_end - now > self.near_ns:
+            return frame
+        if closing and self.flash:
+            frame = min(frame, now + self.flash_ns - into % self.flash_ns)
+        if self.bar_pixels:
+            duration = phase_end - phase_start
+            pixel = into * self.bar_pixels // duration + 1
+            frame = min(frame, phase_start + -(-pixel * duration // self.bar_pixels))
+        return frame
+
+    def flash_lit(self, elapsed, remaining):
+        # Whether a flashing bar shows its bright colour, elapsed and remaining in seconds
+        period = self.flash_ns if remaining * NS <= self.near_ns else NS
+        return int(elapsed * NS) // period % 2 == 0
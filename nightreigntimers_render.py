@@ -0,0 +1,261 @@
+import abc
+import collections
+import contextlib
+import time
+import tkinter as tk
+from tkinter import ttk
+
+from nightreigntimers_engine import percentile
+import nightreigntimers_metrics as metrics
+
+BG = '#222222'
+SAFE = '#00aa00'
+CLOSING = '#ff2222'
+FLASH = '#992222'
+TOTAL = '#447efb'
+STATUS = '#ffffcc'
+IDLE = '#cccccc'
+CLOSE = '#ff6666'
+
+WIDTH, HEIGHT = 420, 110
+BAR_X, BAR_LENGTH = 20, 380
+PHASE_BAR_Y, PHASE_BAR_THICKNESS = 30, 16
+TOTAL_BAR_Y, TOTAL_BAR_THICKNESS = 54, 10
+STATUS_Y = 72
+PACE_Y = 90
+
+FRAME_HISTORY = 3600  # Frame costs kept for the percentiles, about an hour of ticks
+
+FRAME_COST = metrics.histogram('nightreign_overlay_frame_seconds', "Time to render one overlay frame",
+                               metrics.FAST_BUCKETS)
+
+
+def setup_window(window):
+    # Make the window borderless, always on top, and transparent background
+    window.overrideredirect(True)  # also hides from taskbar
+    window.attributes('-topmost', True)
+    window.attributes('-alpha', 0.70)  # Slight transparency
+    window.configure(bg=BG)
+    # Place overlay at top center of the screen
+    screen_width = window.winfo_screenwidth()
+    window.geometry(f"{WIDTH}x{HEIGHT}+{screen_width // 2 - WIDTH // 2}+5")
+
+
+class FrameStats:
+    # Wall time of each rendered frame, in ns. Only covers the Tk calls
+    # unless the renderer flushes, in which case the redraw is included.
+    def __init__(self, history=FRAME_HISTORY):
+        self.costs = collections.deque(maxlen=history)
+        self.frames = 0
+        self.sum_ns = 0
+        self.max_ns = 0
+
+    def add(self, ns):
+        self.costs.append(ns)
+        self.frames += 1
+        self.sum_ns += ns
+        self.max_ns = max(self.max_ns, ns)
+        FRAME_COST.add(ns)
+
+    def summary(self):
+        if not self.frames:
+            return "no frames"
+        costs = sorted(self.costs)
+        return (f"{self.frames} frames, mean {self.sum_ns / self.frames / 1000:.1f} us, "
+                f"p50 {percentile(costs, 0.5) / 1000:.1f} us, p99 {percentile(costs, 0.99) / 1000:.1f} us, "
+                f"max {self.max_ns / 1000:.1f} us")
+
+
+class Renderer(abc.ABC):
+    # What the overlay draws: phase title, phase and total progress bars, a
+    # status line and the pace line. Subclasses only send Tk the parts that changed, through
+    # the shared WidgetView.
+    #
+    # With flush set, frame() runs update_idletasks() before stopping the
+    # clock so the measured cost includes Tk's redraw, not just the calls.
+
+    def __init__(self, window, view, on_close):
+        self.window = window
+        self.view = view
+        self.on_close = on_close
+        self.flush = False
+        self.stats = FrameStats()
+        self.duration = 1
+        self.total = 1
+
+    @contextlib.contextmanager
+    def frame(self):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            if self.flush:
+                self.window.update_idletasks()
+            self.stats.add(time.perf_counter_ns() - start)
+
+    def reset(self, text):
+        self.duration = self.total = 1
+        self.title("Phase")
+        self.progress(0, 0, SAFE)
+        self.status(text, IDLE)
+
+    def phase(self, title, duration, total):
+        self.duration = duration or 1
+        self.total = total or 1
+        self.title(title)
+
+    @abc.abstractmethod
+    def title(self, text):
+        pass
+
+    @abc.abstractmethod
+    def progress(self, elapsed, run_elapsed, color):
+        pass
+
+    @abc.abstractmethod
+    def status(self, text=None, color=None):
+        pass
+
+    @abc.abstractmethod
+    def pace(self, text, color):
+        pass
+
+
+class CanvasRenderer(Renderer):
+    # One tk.Canvas with persistent items created up front; a frame only
+    # moves the bar rectangles, swaps a fill colour or replaces a text.
+    # Bar ends are rounded to whole pixels so a second that does not move
+    # the bar on screen costs no Tk call at all. That makes fewer Tk calls
+    # per frame than WidgetRenderer, yet measured per frame it comes out
+    # slower, so it is not the default (--renderer canvas, bench.py frames).
+
+    def __init__(self, window, view, on_close):
+        super().__init__(window, view, on_close)
+        canvas = tk.Canvas(window, width=WIDTH, height=HEIGHT, bg=BG, highlightthickness=0)
+        canvas.place(x=0, y=0, relwidth=1, relheight=1, anchor='nw')
+        self.canvas = canvas
+        self.title_item = canvas.create_text(2, 2, anchor='nw', text="[Phase]", font=("Segoe UI", 13, "bold"),
+                                             fill='#ffffff')
+        close = canvas.create_text(WIDTH - 8, 2, anchor='ne', text="[x]", font=("Segoe UI", 11, "bold"), fill=CLOSE)
+        canvas.tag_bind(close, "<Button-1>", lambda e: self.on_close())
+        canvas.tag_bind(close, "<Enter>", lambda e: canvas.config(cursor="hand2"))
+        canvas.tag_bind(close, "<Leave>", lambda e: canvas.config(cursor=""))
+        self.phase_item = canvas.create_rectangle(BAR_X, PHASE_BAR_Y, BAR_X, PHASE_BAR_Y + PHASE_BAR_THICKNESS,
+                                                  fill=SAFE, width=0)
+        self.total_item = canvas.create_rectangle(BAR_X, TOTAL_BAR_Y, BAR_X, TOTAL_BAR_Y + TOTAL_BAR_THICKNESS,
+                                                  fill=TOTAL, width=0)
+        self.status_item = canvas.create_text(2, STATUS_Y, anchor='nw', text="", font=("Segoe UI", 11), fill=STATUS,
+                                              width=400)
+        self.pace_item = canvas.create_text(2, PACE_Y, anchor='nw', text="", font=("Segoe UI", 10, "bold"), fill=IDLE)
+
+    def _bar(self, item, y, thickness, fraction):
+        end = BAR_X + round(BAR_LENGTH * min(max(fraction, 0), 1))
+        return self.view.item(self.canvas, item, coords=(BAR_X, y, end, y + thickness))
+
+    def title(self, text):
+        self.view.item(self.canvas, self.title_item, text=text)
+
+    def progress(self, elapsed, run_elapsed, color):
+        self._bar(self.phase_item, PHASE_BAR_Y, PHASE_BAR_THICKNESS, elapsed / self.duration)
+        self._bar(self.total_item, TOTAL_BAR_Y, TOTAL_BAR_THICKNESS, run_elapsed / self.total)
+        self.view.item(self.canvas, self.phase_item, fill=color)
+
+    def status(self, text=None, color=None):
+        options = {}
+        if text is not None:
+            options['text'] = text
+        if color is not None:
+            options['fill'] = color
+        self.view.item(self.canvas, self.status_item, **options)
+
+    def pace(self, text, color):
+        self.view.item(self.canvas, self.pace_item, text=text, fill=color)
+
+
+class WidgetRenderer(Renderer):
+    # The original layout: labels and themed ttk.Progressbars, with the bar
+    # colour switched by swapping the whole ttk style. The default: the
+    # cheapest per frame of the two as measured with bench.py frames.
+    STYLES = {
+        SAFE: 'Current.Horizontal.TProgressbar',
+        CLOSING: 'Red.Horizontal.TProgressbar',
+        FLASH: 'Flash.Horizontal.TProgressbar',
+    }
+
+    def __init__(self, window, view, on_close):
+        super().__init__(window, view, on_close)
+        style = ttk.Style(window)
+        style.theme_use('default')
+        for color, name in self.STYLES.items():
+            style.configure(name, troughcolor=BG, background=color, thickness=PHASE_BAR_THICKNESS)
+        style.configure('Total.Horizontal.TProgressbar', troughcolor=BG, background=TOTAL,
+                        thickness=TOTAL_BAR_THICKNESS)
+
+        # Use place instead of pack for the main frame to avoid covering the [x] button
+        frame = tk.Frame(window, bg=BG)
+        frame.place(x=0, y=0, relwidth=1, relheight=1, anchor='nw')
+
+        # Phase label and [x] close button on the same row
+        phase_row = tk.Frame(frame, bg=BG)
+        phase_row.pack(fill='x', pady=(0, 0))
+
+        self.phase_label = tk.Label(phase_row, text="[Phase]", font=("Segoe UI", 13, "bold"), bg=BG, fg='#ffffff')
+        self.phase_label.pack(side='left', anchor='w')
+
+        close_btn = tk.Label(phase_row, text="[x]", font=("Segoe UI", 11, "bold"), bg=BG, fg=CLOSE, cursor="hand2")
+        close_btn.pack(side='right', anchor='e', padx=(0, 2))
+        close_btn.bind("<Button-1>", lambda e: self.on_close())
+
+        # Current phase progress bar
+        self.phase_bar = ttk.Progressbar(frame, length=BAR_LENGTH, mode='determinate', maximum=1,
+                                         style=self.STYLES[SAFE])
+        self.phase_bar.pack(pady=(4, 8))
+
+        # Total progress bar
+        self.total_bar = ttk.Progressbar(frame, length=BAR_LENGTH, mode='determinate', maximum=1,
+                                         style='Total.Horizontal.TProgressbar')
+        self.total_bar.pack(pady=(0, 0))
+
+        # Combined time/instruction label
+        self.status_label = tk.Label(frame, text="", font=("Segoe UI", 11), bg=BG, fg=STATUS, wraplength=400,
+                                     justify="left")
+        self.status_label.pack(anchor='w', pady=(8, 0))
+
+        # Ahead/behind the reference run
+        self.pace_label = tk.Label(frame, text="", font=("Segoe UI", 10, "bold"), bg=BG, fg=IDLE)
+        self.pace_label.pack(anchor='w')
+
+    def phase(self, title, duration, total):
+        super().phase(title, duration, total)
+        self.view.config(self.phase_bar, maximum=self.duration)
+        self.view.config(self.total_bar, maximum=self.total)
+
+    def reset(self, text):
+        super().reset(text)
+        self.view.config(self.phase_bar, maximum=1)
+        self.view.config(self.total_bar, maximum=1)
+
+    def title(self, text):
+        self.view.config(self.phase_label, text=text)
+
+    def progress(self, elapsed, run_elapsed, color):
+        self.view.config(self.phase_bar, value=min(elapsed, self.duration), style=self.STYLES[color])
+        self.view.config(self.total_bar, value=min(run_elapsed, self.total))
+
+    def status(self, text=None, color=None):
+        options = {}
+        if text is not None:
+            options['text'] = text
+        if color is not None:
+            options['fg'] = color
+        self.view.config(self.status_label, **options)
+
+    def pace(self, text, color):
+        self.view.config(self.pace_label, text=text, fg=color)
+
+
+RENDERERS = {
+    'canvas': CanvasRenderer,
+    'widgets': WidgetRenderer,
+}
+DEFAULT_RENDERER = 'widgets'
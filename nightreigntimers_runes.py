@@ -0,0 +1,88 @@
+import argparse
+import bisect
+import itertools
+
+# Runes needed to reach each level from the one before it, starting at level 1
+LEVEL_COSTS = [
+    0,
+    3698,
+    7922,
+    12348,
+    16978,
+    21818,
+    26869,
+    32137,
+    37624,
+    43335,
+    49271,
+    55439,
+    61840,
+    68479,
+    75358,
+]
+MAX_LEVEL = len(LEVEL_COSTS)
+# TOTAL_COSTS[level - 1]: runes spent getting from level 1 to level
+TOTAL_COSTS = list(itertools.accumulate(LEVEL_COSTS))
+
+
+def _check_level(level):
+    if not 1 <= level <= MAX_LEVEL:
+        raise ValueError(f"level must be between 1 and {MAX_LEVEL}, got {level}")
+
+
+def level_cost(level):
+    _check_level(level)
+    return LEVEL_COSTS[level - 1]
+
+
+def total_cost(level):
+    _check_level(level)
+    return TOTAL_COSTS[level - 1]
+
+
+def runes_needed(from_level, to_level):
+    # Runes to level up from from_level to to_level
+    _check_level(from_level)
+    _check_level(to_level)
+    return max(0, TOTAL_COSTS[to_level - 1] - TOTAL_COSTS[from_level - 1])
+
+
+def affordable_level(runes, from_level=1):
+    # Highest level reachable from from_level with runes, and the runes left over
+    _check_level(from_level)
+    budget = TOTAL_COSTS[from_level - 1] + max(0, runes)
+    level = bisect.bisect_right(TOTAL_COSTS, budget)
+    return level, budget - TOTAL_COSTS[level - 1]
+
+
+def table_rows():
+    # (level, level cost, total spent) as shown in the GUI panel
+    return [(level, LEVEL_COSTS[level - 1], TOTAL_COSTS[level - 1]) for level in range(1, MAX_LEVEL + 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NIGHTREIGN leveling rune costs")
+    parser.add_argument('--runes', type=int, help="runes held: print the level you can reach")
+    parser.add_argument('--level', type=int, default=1, help="current level (default 1)")
+    parser.add_argument('--to', type=int, help="target level: print the runes needed from --level")
+    args = parser.parse_args()
+
+    try:
+        if args.to is not None:
+            print(f"Level {args.level} -> {args.to}: {runes_needed(args.level, args.to)} runes")
+        if args.runes is not None:
+            level, left = affordable_level(args.runes, args.level)
+            line = f"{args.runes} runes at level {args.level}: reach level {level}, {left} left over"
+            if level < MAX_LEVEL:
+                line += f", {LEVEL_COSTS[level] - left} more for level {level + 1}"
+            print(line)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.to is None and args.runes is None:
+        print(f"{'Level':>5} {'Level Cost':>10} {'Total Spent':>11}")
+        for level, cost, total in table_rows():
+            print(f"{level:>5} {cost:>10} {total:>11}")
+
+
+if __name__ == "__main__":
+    main()
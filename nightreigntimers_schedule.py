@@ -0,0 +1,234 @@
+import argparse
+import bisect
+import json
+import os
+
+NS = 1_000_000_000
+MINUTE = 60  # Seconds per game minute; lower it to speed schedules up for debugging
+
+SCHEDULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nightreigntimers_schedules.json')
+DEFAULT_SCHEDULE = 'standard'
+
+SCHEDULE_KEYS = {'description', 'warning_seconds', 'phases'}
+PHASE_KEYS = {'section', 'label', 'minutes', 'seconds', 'closing', 'pause_after'}
+
+
+class ScheduleError(ValueError):
+    pass
+
+
+class Timeline:
+    # A schedule compiled once for the engine. Offsets are ns from the start
+    # of the run with boss pauses left out (a pause shifts the run's origin
+    # instead), so the phase, position in it and next warning cue for any
+    # point of a run are bisect lookups on precomputed tables.
+
+    def __init__(self, name, phases, warning_seconds, description=''):
+        # phases: (section, label, seconds, closing, pause_after) tuples
+        self.name = name
+        self.description = description
+        self.sections = tuple(p[0] for p in phases)
+        self.labels = tuple(p[1] for p in phases)
+        self.durations = tuple(p[2] for p in phases)
+        self.closing = tuple(p[3] for p in phases)
+        self.pauses = tuple(i for i, p in enumerate(phases) if p[4])  # Phases followed by a boss pause
+        self.warning_seconds = warning_seconds
+        offsets = [0]
+        for seconds in self.durations:
+            offsets.append(offsets[-1] + int(seconds * NS))
+        self.offsets = tuple(offsets)
+        self.total_ns = offsets[-1]
+        self.total = sum(self.durations)
+        # Warning cue of each phase that leads into a closing one, or None
+        warning_ns = int(warning_seconds * NS)
+        cues = []
+        for i in range(len(phases)):
+            leads_to_closing = i + 1 < len(phases) and self.closing[i + 1] and not self.closing[i]
+            cues.append(max(offsets[i], offsets[i + 1] - warning_ns) if leads_to_closing else None)
+        self.cues = tuple(cues)
+        self._cue_offsets = [cue for cue in cues if cue is not None]
+
+    def __len__(self):
+        return len(self.durations)
+
+    def title(self, phase):
+        section = self.sections[phase]
+        return f"{section}: {self.labels[phase]}" if section else self.labels[phase]
+
+    def locate(self, position_ns):
+        # (phase, ns into that phase) for a run position; phase is len(self) once the run is over
+        phase = bisect.bisect_right(self.offsets, position_ns) - 1
+        if phase < 0:
+            return 0, 0
+        if phase >= len(self):
+            return len(self), position_ns - self.total_ns
+        return phase, position_ns - self.offsets[phase]
+
+    def next_cue(self, position_ns):
+        # Run position of the first warning cue after position_ns, or None
+        i = bisect.bisect_right(self._cue_offsets, position_ns)
+        return self._cue_offsets[i] if i < len(self._cue_offsets) else None
+
+    def next_pause(self, phase):
+        # First phase from phase on that is followed by a boss pause, or None
+        i = bisect.bisect_left(self.pauses, phase)
+        return self.pauses[i] if i < len(self.pauses) else None
+
+    def segment(self, phase):
+        # (first, last) phase of the stretch between boss pauses holding phase
+        i = bisect.bisect_left(self.pauses, phase)
+        first = self.pauses[i - 1] + 1 if i else 0
+        last = self.pauses[i] if i < len(self.pauses) else len(self) - 1
+        return first, last
+
+
+def _number(value, where, what):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ScheduleError(f"{where}: {what} must be a number, got {value!r}")
+    return value
+
+
+def _flag(value, where, what):
+    if not isinstance(value, bool):
+        raise ScheduleError(f"{where}: {what} must be true or false, got {value!r}")
+    return value
+
+
+def compile_schedule(spec, name='custom', minute=MINUTE, source='<schedule>'):
+    # Validate one schedule from the config file and build its Timeline
+    where = f"{source}: schedule {name!r}"
+    if not isinstance(spec, dict):
+        raise ScheduleError(f"{where}: expected an object, got {type(spec).__name__}")
+    unknown = set(spec) - SCHEDULE_KEYS
+    if unknown:
+        raise ScheduleError(f"{where}: unknown keys {', '.join(sorted(unknown))}")
+    if _number(minute, where, "minute") <= 0:
+        raise ScheduleError(f"{where}: minute must be positive, got {minute}")
+    warning_seconds = _number(spec.get('warning_seconds', 5), where, "warning_seconds")
+    if warning_seconds < 0:
+        raise ScheduleError(f"{where}: warning_seconds must not be negative")
+    phases = spec.get('phases')
+    if not isinstance(phases, list) or not phases:
+        raise ScheduleError(f"{where}: phases must be a non-empty list")
+
+    compiled = []
+    for i, phase in enumerate(phases):
+        at = f"{where}, phase {i + 1}"
+        if not isinstance(phase, dict):
+            raise ScheduleError(f"{at}: expected an object, got {type(phase).__name__}")
+        unknown = set(phase) - PHASE_KEYS
+        if unknown:
+            raise ScheduleError(f"{at}: unknown keys {', '.join(sorted(unknown))}")
+        label = phase.get('label')
+        section = phase.get('section', '')
+        if not isinstance(label, str) or not label:
+            raise ScheduleError(f"{at}: label must be a non-empty string")
+        if not isinstance(section, str):
+            raise ScheduleError(f"{at}: section must be a string")
+        if ('minutes' in phase) == ('seconds' in phase):
+            raise ScheduleError(f"{at}: give exactly one of minutes or seconds")
+        if 'minutes' in phase:
+            seconds = _number(phase['minutes'], at, "minutes") * minute
+        else:
+            seconds = _number(phase['seconds'], at, "seconds")
+        if seconds <= 0:
+            raise ScheduleError(f"{at}: duration must be positive")
+        closing = _flag(phase.get('closing', False), at, "closing")
+        pause_after = _flag(phase.get('pause_after', False), at, "pause_after")
+        if pause_after and i == len(phases) - 1:
+            raise ScheduleError(f"{at}: pause_after on the last phase, the run just ends there")
+        compiled.append((section, label, seconds, closing, pause_after))
+    return Timeline(name, compiled, warning_seconds, spec.get('description', ''))
+
+
+_files = {}  # Absolute path -> ((mtime_ns, size), parsed config)
+_timelines = {}  # (absolute path, (mtime_ns, size), name, minute) -> Timeline
+
+
+def read_schedules(path=SCHEDULES_FILE):
+    # Parsed config file and its (mtime_ns, size) stamp; only re-read when the file changes
+    path = os.path.abspath(path)
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        raise ScheduleError(f"cannot read schedules from {path}: {e.strerror}") from None
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = _files.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached
+    try:
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+    except OSError as e:
+        raise ScheduleError(f"cannot read schedules from {path}: {e.strerror}") from None
+    except json.JSONDecodeError as e:
+        raise ScheduleError(f"{path}: {e}") from None
+    if not isinstance(config, dict) or not config:
+        raise ScheduleError(f"{path}: expected an object mapping schedule names to schedules")
+    # Timelines compiled from the old contents are stale now
+    for key in [key for key in _timelines if key[0] == path]:
+        del _timelines[key]
+    _files[path] = (stamp, config)
+    return _files[path]
+
+
+def schedule_names(path=SCHEDULES_FILE):
+    return list(read_schedules(path)[1])
+
+
+def load(name=DEFAULT_SCHEDULE, path=SCHEDULES_FILE, minute=MINUTE):
+    # Compiled Timeline for a named schedule, cached until the file changes
+    path = os.path.abspath(path)
+    stamp, config = read_schedules(path)
+    key = (path, stamp, name, minute)
+    timeline = _timelines.get(key)
+    if timeline is None:
+        if name not in config:
+            raise ScheduleError(f"{path}: no schedule named {name!r} (available: {', '.join(config)})")
+        timeline = compile_schedule(config[name], name, minute, path)
+        _timelines[key] = timeline
+    return timeline
+
+
+def add_arguments(parser):
+    # --schedule/--schedules/--minute, shared by the frontends
+    parser.add_argument('--schedule', default=DEFAULT_SCHEDULE, help=f"schedule to run (default {DEFAULT_SCHEDULE})")
+    parser.add_argument('--schedules', default=SCHEDULES_FILE, metavar='FILE', help="schedules config file")
+    parser.add_argument('--minute', type=float, default=MINUTE, help="seconds per game minute (debugging)")
+
+
+def from_arguments(parser, args):
+    try:
+        return load(args.schedule, args.schedules, args.minute)
+    except ScheduleError as e:
+        parser.error(str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and print NIGHTREIGN Timers schedules")
+    parser.add_argument('names', nargs='*', help="schedules to print (default: all)")
+    parser.add_argument('--schedules', default=SCHEDULES_FILE, metavar='FILE', help="schedules config file")
+    parser.add_argument('--minute', type=float, default=MINUTE, help="seconds per game minute")
+    args = parser.parse_args()
+
+    try:
+        names = args.names or schedule_names(args.schedules)
+        timelines = [load(name, args.schedules, args.minute) for name in names]
+    except ScheduleError as e:
+        parser.error(str(e))
+    for timeline in timelines:
+        print(f"{timeline.name}: {timeline.description}" if timeline.description else timeline.name)
+        for phase in range(len(timeline)):
+            start = timeline.offsets[phase] // NS
+            kind = "closing" if timeline.closing[phase] else "safe"
+            line = f"  {start // 60:02}:{start % 60:02}  {timeline.title(phase)} ({timeline.durations[phase]:g} s, {kind})"
+            if timeline.cues[phase] is not None:
+                cue = timeline.cues[phase] // NS
+                line += f", warning at {cue // 60:02}:{cue % 60:02}"
+            if phase in timeline.pauses:
+                line += ", then boss pause"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
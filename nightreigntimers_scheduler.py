@@ -0,0 +1,133 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+COMMAND_EVENT = '<<NightreignCommand>>'
+FALLBACK_POLL_MS = 100
+
+
+class CommandQueue:
+    # Thread-safe hand-off from background threads (keyboard hook, tray menu)
+    # to the Tk main loop. Other threads only ever call post(); every command
+    # is executed by handler(command, *args) on the Tk thread, so timer state
+    # and widgets are never touched from two threads at once.
+    #
+    # The main loop is woken with a virtual event, which Tk marshals across
+    # threads when Tcl is built threaded. Without threaded Tcl we fall back
+    # to draining the queue on a slow poll.
+
+    def __init__(self, window, handler):
+        self.window = window
+        self.handler = handler
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._wakeup_pending = False
+        self.threaded = _tcl_threaded(window)
+        if self.threaded:
+            self.window.bind(COMMAND_EVENT, lambda e: self.drain())
+        else:
+            self.window.after(FALLBACK_POLL_MS, self._poll)
+
+    def post(self, command, *args):
+        # Safe to call from any thread
+        self._queue.put((command, args))
+        if not self.threaded:
+            return
+        with self._lock:
+            if self._wakeup_pending:
+                return
+            self._wakeup_pending = True
+        try:
+            self.window.event_generate(COMMAND_EVENT, when='tail')
+        except RuntimeError:
+            # Main loop already gone (window closed)
+            pass
+
+    def drain(self):
+        # Runs on the Tk thread
+        with self._lock:
+            self._wakeup_pending = False
+        while True:
+            try:
+                command, args = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self.handler(command, *args)
+
+    def _poll(self):
+        self.drain()
+        self.window.after(FALLBACK_POLL_MS, self._poll)
+
+
+class DeadlineScheduler:
+    # One heap of deadlines shared by many TimerEngines, with the engine's
+    # schedule(delay_ms, callback) / cancel(handle) interface. Whoever owns
+    # the scheduler sleeps until next_deadline() and calls run_due(); with
+    # on_earlier set, it is told whenever a new deadline becomes the first.
+    # Cancelled entries stay in the heap until they reach the top, unless
+    # they pile up, so cancel() is O(1) and the heap stays small.
+
+    def __init__(self, clock=None, on_earlier=None):
+        self.clock = clock if clock is not None else time.monotonic_ns
+        self.on_earlier = on_earlier
+        self._heap = []  # [deadline ns, sequence, callback or None once cancelled]
+        self._sequence = itertools.count()
+        self.pending = 0
+        self.fired = 0
+
+    def after(self, ms, callback):
+        entry = [self.clock() + int(ms * 1_000_000), next(self._sequence), callback]
+        heapq.heappush(self._heap, entry)
+        self.pending += 1
+        if self._heap[0] is entry and self.on_earlier is not None:
+            self.on_earlier(entry[0])
+        return entry
+
+    def cancel(self, entry):
+        if entry[2] is None:
+            return
+        entry[2] = None
+        self.pending -= 1
+        if len(self._heap) > 64 and self.pending < len(self._heap) // 2:
+            self._heap = [e for e in self._heap if e[2] is not None]
+            heapq.heapify(self._heap)
+
+    def next_deadline(self):
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def run_due(self, now=None):
+        # Run every callback whose deadline has passed, in deadline order;
+        # returns how many ran
+        heap = self._heap
+        if now is None:
+            now = self.clock()
+        count = 0
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            callback = entry[2]
+            if callback is None:
+                continue
+            entry[2] = None
+            self.pending -= 1
+            count += 1
+            callback()
+        self.fired += count
+        return count
+
+    def __len__(self):
+        return self.pending
+
+
+def _tcl_threaded(window):
+    tk_app = getattr(window, 'tk', None)
+    if tk_app is None:
+        return True
+    try:
+        return bool(int(tk_app.eval('info exists tcl_platform(threaded)')))
+    except Exception:
+        return False
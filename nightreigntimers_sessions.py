@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import json
+import time
+
+from nightreigntimers_daemon import Connection, encode, engine_state, timeline_spec, valid_resync
+from nightreigntimers_engine import COMMANDS, NS, TimerEngine
+import nightreigntimers_metrics as metrics
+import nightreigntimers_schedule as schedule
+import nightreigntimers_trace as tracing
+from nightreigntimers_scheduler import DeadlineScheduler
+
+SESSIONS_PORT = 8766
+MAX_SESSIONS = 5000
+MAX_NAME = 64
+
+SESSION_COMMANDS = COMMANDS + ('hotkey',)
+
+TIMER_COST = metrics.histogram('nightreign_sessions_timer_seconds',
+                               "Time to run every session deadline due at one loop wakeup", metrics.FAST_BUCKETS)
+TIMER_BATCH = metrics.histogram('nightreign_sessions_timer_batch', "Session deadlines run per loop wakeup",
+                                metrics.COUNT_BUCKETS, scale=1)
+COMMANDS_TOTAL = metrics.counter('nightreign_sessions_commands_total', "Session commands from clients")
+
+
+class SessionError(ValueError):
+    pass
+
+
+def check_name(name):
+    # Before the name is used as a key: anything from a client might be unhashable
+    if not isinstance(name, str) or not name or len(name) > MAX_NAME:
+        raise SessionError(f"session names are 1 to {MAX_NAME} characters")
+
+
+class Session:
+    # One player's or stream slot's expedition: a headless TimerEngine on
+    # the service's shared scheduler, and the connections watching it.
+    # Events are only collected while someone is watching.
+
+    def __init__(self, service, name, timeline):
+        self.service = service
+        self.name = name
+        scheduler = service.scheduler
+        # Thousands of sessions would drown each other out in the event trace
+        self.engine = TimerEngine(scheduler.after, scheduler.cancel, clock=scheduler.clock, timeline=timeline,
+                                  readout=False, trace=tracing.OFF)
+        self.engine.subscribe(self.on_timer_event)
+        self.watchers = set()
+        self.state = {}
+        self._events = []
+
+    def on_timer_event(self, event, phase):
+        if self.watchers:
+            self._events.append([event, phase])
+            self.service.changed(self)
+
+    def elapsed_ms(self):
+        return int(self.engine.elapsed() * 1000)
+
+    def snapshot(self):
+        return dict(engine_state(self.engine), session=self.name, full=True,
+                    schedule=timeline_spec(self.engine.timeline), elapsed=self.elapsed_ms())
+
+    def on_command(self, command, *args):
+        if command == 'hotkey':
+            self.engine.on_hotkey()
+        elif command in COMMANDS:
+            getattr(self.engine, command)()
+        elif command == 'resync':
+            self.engine.resync(*args)
+
+    def flush(self):
+        state = engine_state(self.engine)
+        message = {key: value for key, value in state.items() if self.state.get(key) != value}
+        self.state = state
+        message['session'] = self.name
+        message['elapsed'] = self.elapsed_ms()
+        if self._events:
+            message['events'], self._events = self._events, []
+        data = encode(message)
+        for client in list(self.watchers):
+            if not client.send(data):
+                self.watchers.discard(client)
+
+
+class SessionService:
+    # Many independent expeditions in one headless process. Every session's
+    # engine schedules on a single DeadlineScheduler heap and the asyncio
+    # loop holds one timer, for the earliest deadline of them all. Engines
+    # run with readout=False, so a running session costs a wakeup per phase
+    # change or warning cue, and an idle one none at all: load follows the
+    # number of events, not sessions times a tick rate. Clients interpolate
+    # the readout from "elapsed", like the daemon's.
+    #
+    # Line protocol, one JSON object per line:
+    #   {"session": "alice", "command": "open", "schedule": "standard"}  create if needed and watch
+    #   {"session": "alice", "command": "start"}  any engine command; resync takes "args"
+    #   {"session": "alice", "command": "close"}  end the session
+    #   {"command": "list"}
+    # Updates are the daemon's messages with a "session" key added.
+    #
+    # With loop=None nothing drives the scheduler; the owner calls
+    # scheduler.run_due() itself (see the sessions benchmark).
+
+    def __init__(self, loop=None, clock=None, schedules=schedule.SCHEDULES_FILE, minute=schedule.MINUTE,
+                 max_sessions=MAX_SESSIONS):
+        self.loop = loop
+        self.scheduler = DeadlineScheduler(clock, on_earlier=self._arm if loop is not None else None)
+        self.schedules = schedules
+        self.minute = minute
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self._changed = set()
+        self._flush_pending = False
+        self._timer = None
+        self._timer_at = None
+        metrics.gauge('nightreign_sessions', "Open sessions", lambda: len(self.sessions))
+        metrics.gauge('nightreign_sessions_deadlines', "Pending session deadlines", lambda: len(self.scheduler))
+
+    # --- Scheduling ---
+
+    def _arm(self, deadline=None):
+        # Point the loop's single timer at the earliest deadline
+        if deadline is None:
+            deadline = self.scheduler.next_deadline()
+            if deadline is None:
+                return
+        elif self._timer is not None and self._timer_at <= deadline:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(0, deadline - self.scheduler.clock()) / NS
+        self._timer = self.loop.call_later(delay, self._run)
+        self._timer_at = deadline
+
+    def _run(self):
+        self._timer = None
+        start = time.perf_counter_ns()
+        TIMER_BATCH.add(self.scheduler.run_due())
+        TIMER_COST.add(time.perf_counter_ns() - start)
+        if self._timer is None:
+            self._arm()
+
+    # --- Sessions ---
+
+    def open(self, name, schedule_name=schedule.DEFAULT_SCHEDULE):
+        check_name(name)
+        session = self.sessions.get(name)
+        if session is not None:
+            return session
+        if not isinstance(schedule_name, str):
+            raise SessionError("schedule names are strings")
+        if len(self.sessions) >= self.max_sessions:
+            raise SessionError(f"too many sessions (limit {self.max_sessions})")
+        try:
+            # Compiled once per schedule and shared by every session running it
+            timeline = schedule.load(schedule_name, self.schedules, self.minute)
+        except schedule.ScheduleError as e:
+            raise SessionError(str(e)) from None
+        session = self.sessions[name] = Session(self, name, timeline)
+        return session
+
+    def close(self, name):
+        session = self.sessions.pop(name, None)
+        if session is not None:
+            session.engine.reset()
+            session.watchers.clear()
+            self._changed.discard(session)
+
+    def changed(self, session):
+        self._changed.add(session)
+        if not self._flush_pending and self.loop is not None:
+            self._flush_pending = True
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self._flush_pending = False
+        changed, self._changed = self._changed, set()
+        for session in changed:
+            session.flush()
+
+    # --- Clients ---
+
+    def handle_message(self, client, data):
+        try:
+            message = json.loads(data)
+            command = message['command']
+            name = message.get('session')
+        except (ValueError, TypeError, KeyError, AttributeError):
+            client.send(encode({'error': "expected a JSON object with a command"}))
+            return
+        COMMANDS_TOTAL.inc()
+        if command == 'list':
+            client.send(encode({'sessions': sorted(self.sessions)}))
+            return
+        try:
+            check_name(name)
+            if command == 'open':
+                session = self.open(name, message.get('schedule', schedule.DEFAULT_SCHEDULE))
+                session.watchers.add(client)
+                client.send(encode(session.snapshot()))
+                return
+            session = self.sessions.get(name)
+            if session is None:
+                raise SessionError(f"no session named {name!r}")
+            if command == 'close':
+                self.close(name)
+                client.send(encode({'session': name, 'closed': True}))
+            elif command in SESSION_COMMANDS and not message.get('args'):
+                session.on_command(command)
+            elif command == 'resync' and valid_resync(message.get('args')):
+                session.on_command(command, *message['args'])
+            else:
+                raise SessionError(f"unknown command {command!r}")
+        except SessionError as e:
+            client.send(encode({'session': name, 'error': str(e)}))
+
+    async def handle_line(self, reader, writer):
+        client = Connection(writer, 'line')
+        try:
+            async for line in reader:
+                if line.strip():
+                    self.handle_message(client, line)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            for session in self.sessions.values():
+                session.watchers.discard(client)
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=SESSIONS_PORT):
+        return await asyncio.start_server(self.handle_line, host, port)
+
+
+async def run(args):
+    service = SessionService(asyncio.get_running_loop(), schedules=args.schedules, minute=args.minute,
+                             max_sessions=args.max_sessions)
+    server = await service.serve(args.host, args.port)
+    print(f"Session service on {args.host}:{args.port}, up to {args.max_sessions} sessions")
+    await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NIGHTREIGN Timers session service: many headless timers in one process")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=SESSIONS_PORT)
+    parser.add_argument('--max-sessions', type=int, default=MAX_SESSIONS)
+    parser.add_argument('--schedules', default=schedule.SCHEDULES_FILE, metavar='FILE', help="schedules config file")
+    parser.add_argument('--minute', type=float, default=schedule.MINUTE, help="seconds per game minute (debugging)")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    try:
+        schedule.read_schedules(args.schedules)
+    except schedule.ScheduleError as e:
+        parser.error(str(e))
+    metrics.start_from_arguments(args)
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        parser.exit(1, f"{e}\n")
+
+
+if __name__ == "__main__":
+    main()
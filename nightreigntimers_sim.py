@@ -0,0 +1,476 @@
+import asyncio
+import base64
+import contextlib
+import heapq
+import itertools
+import json
+import os
+import random
+import struct
+import time
+import tracemalloc
+
+import nightreigntimers_daemon as daemon
+import nightreigntimers_detect as detection
+from nightreigntimers_engine import NS
+from nightreigntimers_watch import GAME_PROCESS, ProcessWatcher
+
+
+class VirtualClock:
+    # Stands in for time.monotonic_ns(); only moves when the scheduler says so
+    def __init__(self, start_ns=0):
+        self.now_ns = start_ns
+
+    def __call__(self):
+        return self.now_ns
+
+    def monotonic(self):
+        return self.now_ns / NS
+
+
+class VirtualScheduler:
+    # Heap of after() callbacks on a VirtualClock. Each callback can be made
+    # to land late (fixed lateness plus random jitter) like a busy Tk loop.
+    # Callbacks run through run_until() are counted as wakeups and timed;
+    # with trace_allocations the tracemalloc peak of each one is kept too.
+
+    def __init__(self, clock=None, lateness_ms=0.0, jitter_ms=0.0, seed=0):
+        self.clock = clock if clock is not None else VirtualClock()
+        self.lateness_ns = int(lateness_ms * 1_000_000)
+        self.jitter_ns = int(jitter_ms * 1_000_000)
+        self.rng = random.Random(seed)
+        self.trace_allocations = False
+        self._heap = []
+        self._ids = itertools.count()
+        self._pending = set()
+        self._cancelled = set()
+        self.wakeups = 0
+        self.tick_costs = []  # perf_counter_ns per callback
+        self.tick_allocations = []  # Peak bytes allocated per callback
+
+    def after(self, ms, callback=None, *args):
+        late = self.lateness_ns + (self.rng.randint(0, self.jitter_ns) if self.jitter_ns else 0)
+        return self._push(self.clock.now_ns + int(ms * 1_000_000) + late, callback, args)
+
+    def after_idle(self, callback, *args):
+        return self._push(self.clock.now_ns, callback, args)
+
+    def call_at(self, when_ns, callback, *args):
+        # Exact, jitter-free callback outside the Tk loop (e.g. a simulated
+        # audio device); not counted as a wakeup
+        return self._push(when_ns, callback, args, counted=False)
+
+    def _push(self, when_ns, callback, args, counted=True):
+        handle = f"after#{next(self._ids)}"
+        heapq.heappush(self._heap, (when_ns, handle, callback, args, counted))
+        self._pending.add(handle)
+        return handle
+
+    def after_cancel(self, handle):
+        if handle in self._pending:
+            self._cancelled.add(handle)
+
+    def pending(self):
+        return len(self._pending) - len(self._cancelled)
+
+    def run_until(self, until_ns, while_=None):
+        # Run callbacks due up to until_ns, stopping early once while_() is false
+        while self._heap and self._heap[0][0] <= until_ns:
+            if while_ is not None and not while_():
+                return
+            when, handle, callback, args, counted = heapq.heappop(self._heap)
+            self._pending.discard(handle)
+            if handle in self._cancelled:
+                self._cancelled.discard(handle)
+                continue
+            self.clock.now_ns = max(self.clock.now_ns, when)
+            if not counted:
+                callback(*args)
+                continue
+            self.wakeups += 1
+            if self.trace_allocations:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter_ns()
+            callback(*args)
+            self.tick_costs.append(time.perf_counter_ns() - start)
+            if self.trace_allocations:
+                self.tick_allocations.append(tracemalloc.get_traced_memory()[1] - base)
+        if while_ is None or while_():
+            self.clock.now_ns = max(self.clock.now_ns, until_ns)
+
+    def run_for(self, seconds, while_=None):
+        self.run_until(self.clock.now_ns + int(seconds * NS), while_)
+
+
+class DummyWidget:
+    # Accepts any Tk widget call and counts configure calls; unknown methods
+    # (grid, pack, create_rectangle, ...) are no-ops returning an item id
+    calls = 0
+    _items = itertools.count(1)
+
+    def __init__(self, master=None, **options):
+        self.master = master
+        self.options = dict(options)
+
+    def config(self, *args, **options):
+        DummyWidget.calls += 1
+        if args:
+            options = dict(args[1:] and {args[0]: args[1]} or {}, **options)
+        self.options.update(options)
+
+    configure = config
+
+    def cget(self, key):
+        return self.options.get(key)
+
+    def __getitem__(self, key):
+        return self.options.get(key)
+
+    def __setitem__(self, key, value):
+        self.config(**{key: value})
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            DummyWidget.calls += 1
+            return next(DummyWidget._items)
+        return method
+
+
+class DummyStyle(DummyWidget):
+    def theme_use(self, name=None):
+        return 'default'
+
+
+class DummyModule:
+    # Stand-in for the tkinter / tkinter.ttk modules
+    def __init__(self, **overrides):
+        self._overrides = overrides
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._overrides.get(name, DummyWidget)
+
+
+class DummyRoot(DummyWidget):
+    # Just enough of tk.Tk for the frontends, driven by a VirtualScheduler
+    tk = None  # CommandQueue then wakes the loop through event_generate
+
+    def __init__(self, scheduler):
+        super().__init__()
+        self.scheduler = scheduler
+        self.bindings = {}
+        self.bells = 0
+
+    def after(self, ms, callback=None, *args):
+        return self.scheduler.after(ms, callback, *args)
+
+    def after_idle(self, callback, *args):
+        return self.scheduler.after_idle(callback, *args)
+
+    def after_cancel(self, handle):
+        self.scheduler.after_cancel(handle)
+
+    def bind(self, sequence, callback, add=None):
+        self.bindings[sequence] = callback
+
+    def event_generate(self, sequence, when=None):
+        callback = self.bindings.get(sequence)
+        if callback is not None:
+            self.scheduler.after_idle(callback, None)
+
+    def bell(self):
+        self.bells += 1
+
+    def winfo_screenwidth(self):
+        return 1920
+
+
+@contextlib.contextmanager
+def dummy_tk(*modules):
+    # Swap the tk/ttk modules used by the given frontend modules for dummies
+    saved = [(module, name, getattr(module, name)) for module in modules for name in ('tk', 'ttk')
+             if hasattr(module, name)]
+    for module, name, _ in saved:
+        setattr(module, name, DummyModule(Style=DummyStyle) if name == 'ttk' else DummyModule())
+    try:
+        yield
+    finally:
+        for module, name, original in saved:
+            setattr(module, name, original)
+
+
+class VirtualAudio:
+    # AudioCues stand-in that "plays" cues exactly at their deadline on the
+    # virtual clock and records when
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.clock = scheduler.clock.monotonic
+        self.played = []
+        self._handles = set()
+
+    def schedule(self, cue, deadline):
+        handle = self.scheduler.call_at(int(deadline * NS), self._play, cue)
+        self._handles.add(handle)
+        return handle
+
+    def play(self, cue):
+        return self.schedule(cue, self.clock())
+
+    def _play(self, cue):
+        self.played.append((self.scheduler.clock.now_ns, cue))
+
+    def cancel(self, handle):
+        self.scheduler.after_cancel(handle)
+
+    def cancel_all(self):
+        for handle in self._handles:
+            self.scheduler.after_cancel(handle)
+        self._handles.clear()
+
+    def close(self):
+        pass
+
+
+class FakeProcessTable:
+    # Process table with a few hundred entries; the game can come and go
+    def __init__(self, count, game=True):
+        self.procs = {1000 + i: f"proc{i}.exe" for i in range(count)}
+        self.game_pid = 1000 + count
+        self.set_game(game)
+
+    def set_game(self, running):
+        if running:
+            self.procs[self.game_pid] = GAME_PROCESS
+        else:
+            self.procs.pop(self.game_pid, None)
+
+    def __call__(self):
+        return iter(self.procs.items())
+
+    def pid_name(self, pid):
+        return self.procs.get(pid)
+
+
+# Frames of made-up cues for the detect bench: (cue, first frame, frames
+# on screen). A one-frame flicker that must not fire (HOLD_FRAMES), and a
+# day2 back too soon to fire again (REARM_FRAMES), then late enough to
+SYNTHETIC_SCRIPT = [('day1', 10, 20), ('day1', 40, 1), ('day2', 50, 20), ('closing', 65, 10),
+                    ('day2', 72, 2), ('day2', 90, 10)]
+SYNTHETIC_FIRES = [(10, 'day1'), (50, 'day2'), (65, 'closing'), (90, 'day2')]  # (first frame, cue) that fire
+
+
+def draw_cue(draw, cue, width, height):
+    # A stand-in for each cue's graphic inside its region: day1 one block in
+    # the middle, day2 two blocks apart, closing a bar with a marker
+    left, top, w, h = detection.pixel_box(detection.REGIONS[detection.CUES[cue]]['box'], width, height)
+    if cue == 'day1':
+        blocks = [(0.42, 0.2, 0.58, 0.8)]
+    elif cue == 'day2':
+        blocks = [(0.15, 0.2, 0.3, 0.8), (0.7, 0.2, 0.85, 0.8)]
+    else:
+        blocks = [(0.1, 0.35, 0.7, 0.65), (0.78, 0.15, 0.9, 0.85)]
+    for x0, y0, x1, y1 in blocks:
+        draw.rectangle((left + x0 * w, top + y0 * h, left + x1 * w, top + y1 * h), fill=230)
+
+
+def synthetic_frames(directory, count=110, size=(640, 360), seed=0):
+    # Writes count noisy frames with SYNTHETIC_SCRIPT's cues drawn in, and
+    # templates cut from the first frame of each cue. Returns the frames'
+    # and the templates' directories. Needs numpy and pillow
+    np = detection.need_numpy()
+    image = detection.need('PIL.Image', "drawing frames")
+    draw_module = detection.need('PIL.ImageDraw', "drawing frames")
+    rng = np.random.default_rng(seed)
+    width, height = size
+    frames = os.path.join(directory, 'frames')
+    os.makedirs(frames, exist_ok=True)
+    firsts = {}
+    for index in range(count):
+        noise = rng.normal(40, 8, (height, width)).clip(0, 255).astype(np.uint8)
+        picture = image.fromarray(noise, 'L')
+        draw = draw_module.Draw(picture)
+        for cue, first, length in SYNTHETIC_SCRIPT:
+            if first <= index < first + length:
+                draw_cue(draw, cue, width, height)
+                firsts.setdefault(cue, index)
+        picture.convert('RGB').save(os.path.join(frames, f"{index:04}.png"))
+    templates = os.path.join(directory, 'templates')
+    for cue, index in firsts.items():
+        detection.make_template(os.path.join(frames, f"{index:04}.png"), cue, templates)
+    return frames, templates
+
+
+class FakeFocusWatcher:
+    # Event-driven focus source that reports a fixed foreground title
+    event_driven = True
+
+    def __init__(self, title='ELDEN RING NIGHTREIGN'):
+        self.title = title
+
+    def start(self, callback):
+        callback(self.title)
+
+    def stop(self):
+        pass
+
+    def active_title(self):
+        return self.title
+
+
+class StandInClient:
+    # Timer daemon client over the line protocol or a WebSocket that keeps
+    # every message with its perf_counter_ns arrival time, and the state
+    # they add up to
+    def __init__(self):
+        self.messages = []
+        self.arrivals = []
+        self.state = {}
+        self.framing = None
+        self._reader = None
+        self._writer = None
+
+    async def connect_line(self, address):
+        if isinstance(address, str):
+            self._reader, self._writer = await asyncio.open_unix_connection(address)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(*address)
+        self.framing = 'line'
+
+    async def connect_ws(self, host, port, origin=None):
+        # origin: the Origin header a browser would send, None for none
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        extra = f"Origin: {origin}\r\n" if origin is not None else ""
+        self._writer.write((f"GET / HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\n"
+                            f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n{extra}"
+                            f"Sec-WebSocket-Version: 13\r\n\r\n").encode())
+        response = await self._reader.readuntil(b'\r\n\r\n')
+        if b' 101 ' not in response.split(b'\r\n', 1)[0] or daemon.ws_accept(key).encode() not in response:
+            raise ConnectionError(f"WebSocket handshake refused: {response[:80]!r}")
+        self.framing = 'ws'
+
+    async def send(self, command):
+        data = daemon.encode({'command': command})
+        if self.framing == 'ws':
+            # Client frames must be masked
+            mask = os.urandom(4)
+            masked = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+            self._writer.write(struct.pack('!BB', 0x81, 0x80 | len(data)) + mask + masked)
+        else:
+            self._writer.write(data + b'\n')
+        await self._writer.drain()
+
+    async def run(self):
+        try:
+            while True:
+                if self.framing == 'ws':
+                    opcode, payload = await daemon.read_ws_frame(self._reader)
+                    if opcode != 0x1:
+                        break
+                else:
+                    payload = await self._reader.readline()
+                    if not payload:
+                        break
+                self.arrivals.append(time.perf_counter_ns())
+                message = json.loads(payload)
+                if message.get('full'):
+                    self.state = {}
+                self.messages.append(message)
+                self.state.update(message)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def close(self):
+        self._writer.close()
+
+
+def make_gui(scheduler, timeline=None, reference=None, history=None):
+    import nightreigntimers_gui
+    root = DummyRoot(scheduler)
+    return nightreigntimers_gui.NIGHTREIGNTimers(root, clock=scheduler.clock, audio=VirtualAudio(scheduler),
+                                                 timeline=timeline, history=history, reference=reference)
+
+
+def make_overlay(scheduler, timeline=None, reference=None):
+    import nightreigntimers_overlay
+    root = DummyRoot(scheduler)
+    table = FakeProcessTable(300)
+    return nightreigntimers_overlay.OverlayTimers(
+        root, process_watcher=ProcessWatcher(process_table=table, pid_name=table.pid_name),
+        focus_watcher=FakeFocusWatcher(), clock=scheduler.clock, audio=VirtualAudio(scheduler),
+        timeline=timeline, reference=reference)
+
+
+FRONTENDS = {
+    'gui': make_gui,
+    'overlay': make_overlay,
+}
+
+
+class Expedition:
+    # Replays expeditions against a frontend: press the hotkey, fight the
+    # boss for a random time, resume, and now and then reset mid-run.
+    # Cue times are checked against deadlines derived from the presses.
+
+    def __init__(self, app, scheduler, seed=0, reset_rate=0.1, boss_seconds=(60, 300)):
+        self.app = app
+        self.scheduler = scheduler
+        self.engine = app.engine
+        self.rng = random.Random(seed)
+        self.reset_rate = reset_rate
+        self.boss_seconds = boss_seconds
+        self.runs = 0
+        self.resets = 0
+        self.cue_errors = []  # ns between each expected and played cue
+        self.simulated_ns = 0
+
+    def press(self):
+        self.app.on_hotkey()
+        self.scheduler.run_for(0)
+
+    def run(self):
+        engine = self.engine
+        timeline = engine.timeline
+        begin = self.scheduler.clock.now_ns
+        cues_before = len(self.app.audio.played)
+        abort_ns = None
+        if self.rng.random() < self.reset_rate:
+            abort_ns = self.rng.randint(0, timeline.total_ns)
+
+        self.press()
+        start = self.scheduler.clock.now_ns
+        expected = self._expected_cues(start, 0)
+        deadline = start + abort_ns if abort_ns is not None else None
+        self.scheduler.run_until(deadline or start + timeline.total_ns * 2, lambda: engine.running)
+        while engine.paused_for_boss:
+            self.scheduler.run_for(self.rng.uniform(*self.boss_seconds), lambda: engine.paused_for_boss)
+            self.press()
+            resumed = self.scheduler.clock.now_ns
+            expected += self._expected_cues(resumed - timeline.offsets[engine.phase], engine.phase)
+            if deadline is not None:
+                deadline = max(deadline, resumed)
+            self.scheduler.run_until(deadline or resumed + timeline.total_ns * 2, lambda: engine.running)
+        if engine.running or engine.paused_for_boss:
+            self.app.commands.post('reset')
+            self.scheduler.run_for(0)
+            self.resets += 1
+        end = self.scheduler.clock.now_ns
+        played = [t for t, cue in self.app.audio.played[cues_before:]]
+        for t in played:
+            nearest = min(expected, key=lambda e: abs(e - t)) if expected else t
+            self.cue_errors.append(t - nearest)
+        self.runs += 1
+        self.simulated_ns += end - begin
+
+    def _expected_cues(self, origin, first):
+        # Cues from phase first up to the next boss pause, for a run started at origin
+        timeline = self.engine.timeline
+        last = timeline.next_pause(first)
+        if last is None:
+            last = len(timeline) - 1
+        return [origin + cue for cue in timeline.cues[first:last + 1] if cue is not None]
@@ -0,0 +1,90 @@
+import importlib
+import os
+import sys
+import time
+
+# Import this module first: everything is timed from here
+T0 = time.perf_counter()
+IMPORT_TIMES = {}  # Lazily imported module -> seconds spent importing it
+MARKS = []  # (label, seconds since T0)
+
+
+def timed_import(name):
+    # importlib.import_module that remembers how long the first import took
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    IMPORT_TIMES[name] = time.perf_counter() - start
+    return module
+
+
+def mark(label):
+    MARKS.append((label, time.perf_counter() - T0))
+
+
+def peak_rss_mb():
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ('cb', wintypes.DWORD),
+                ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / (1024 * 1024)
+    if sys.platform.startswith('linux'):
+        # ru_maxrss survives exec, so a child started from a big process
+        # would report its parent's peak; VmHWM belongs to this image only
+        try:
+            with open('/proc/self/status') as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def data_dir():
+    # Per-user folder for what the timers write (run history, event traces,
+    # detection templates), rather than next to the scripts, which may be
+    # a checkout or read-only. NIGHTREIGNTIMERS_DATA overrides it. Not
+    # created here: whatever writes into it does, when it first writes
+    override = os.environ.get('NIGHTREIGNTIMERS_DATA')
+    if override:
+        return override
+    if sys.platform == 'win32':
+        base = os.environ.get('APPDATA') or os.path.expanduser('~')
+        return os.path.join(base, 'NIGHTREIGN Timers')
+    if sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Application Support/NIGHTREIGN Timers')
+    base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    return os.path.join(base, 'nightreigntimers')
+
+
+def report():
+    lines = ["Startup profile:"]
+    for label, seconds in MARKS:
+        lines.append(f"  {label}: {seconds * 1000:.1f} ms")
+    for name, seconds in sorted(IMPORT_TIMES.items(), key=lambda item: -item[1]):
+        lines.append(f"  import {name}: {seconds * 1000:.1f} ms")
+    lines.append(f"  peak RSS: {peak_rss_mb():.1f} MB")
+    return "\n".join(lines)
@@ -0,0 +1,290 @@
+import nightreigntimers_startup as startup
+import argparse
+import math
+import sys
+import time
+
+try:
+    import curses
+except ImportError:  # Windows without the windows-curses package
+    curses = None
+
+from nightreigntimers_engine import COMMANDS, TimerEngine
+from nightreigntimers_pacing import RenderPacing
+import nightreigntimers_history as run_history
+import nightreigntimers_schedule as schedule
+import nightreigntimers_trace as tracing
+from nightreigntimers_scheduler import DeadlineScheduler
+
+LABEL_WIDTH = 22
+BAR_WIDTH = 24
+TIME_COLUMN = 2 + LABEL_WIDTH + BAR_WIDTH + 3
+
+# Key -> command; the hotkey starts a run, or resumes after the boss
+KEYS = {
+    ord('\n'): 'hotkey',
+    ord('\r'): 'hotkey',
+    ord(' '): 'hotkey',
+    ord('s'): 'start',
+    ord('r'): 'reset',
+    ord('c'): 'resume',
+    ord('p'): 'pause',
+    ord('n'): 'skip',
+    ord('u'): 'undo_reset',
+    ord('t'): 'trace',
+    ord('q'): 'quit',
+}
+HELP = "Enter start/resume  r reset  p pause  n skip  u undo reset  t save trace  q quit"
+NOTICE_SECONDS = 5  # A notice stands in for the help line this long, or until the next key
+
+# Colour pair numbers
+SAFE, CLOSING, SECTION, DONE, NOTICE = 1, 2, 3, 4, 5
+
+
+class Screen:
+    # Remembers the text and attribute of every segment written, so a frame
+    # only writes the segments that changed and curses only sends the
+    # cells that differ. Nothing is written to the terminal until flush().
+
+    def __init__(self, window):
+        self.window = window
+        self.cells = {}  # (row, col) -> (text, attr)
+        self.writes = 0
+        self._dirty = False
+
+    def put(self, row, col, text, attr=0):
+        key = (row, col)
+        if self.cells.get(key) == (text, attr):
+            return
+        self.cells[key] = (text, attr)
+        try:
+            self.window.addstr(row, col, text, attr)
+        except curses.error:
+            pass  # Off the edge of a small terminal
+        self.writes += 1
+        self._dirty = True
+
+    def clear(self):
+        self.cells.clear()
+        self.window.erase()
+        self._dirty = True
+
+    def flush(self):
+        if self._dirty:
+            self.window.noutrefresh()
+            curses.doupdate()
+            self._dirty = False
+
+
+class TerminalTimers:
+    # The phase list of the GUI in a terminal, driven by the same
+    # TimerEngine on a DeadlineScheduler instead of Tk's after(). The
+    # warning cue rings the terminal bell; the engine wakes for it anyway.
+
+    def __init__(self, screen, scheduler, timeline=None, bell=True, colors=None):
+        self.screen = screen
+        self.scheduler = scheduler
+        self.engine = TimerEngine(scheduler.after, scheduler.cancel, clock=scheduler.clock, timeline=timeline)
+        self.timeline = self.engine.timeline
+        self.pacing = RenderPacing(bar_pixels=BAR_WIDTH, flash=False)
+        self.engine.pacing = self.pacing
+        self.engine.subscribe(self.on_timer_event)
+        self.bell = bell
+        self.colors = colors or {}
+        self.running = True
+        self.rows = []  # Screen row of each phase
+        row = 2
+        for i in range(len(self.timeline)):
+            section = self.timeline.sections[i]
+            if section and (i == 0 or section != self.timeline.sections[i - 1]):
+                row += 1
+            self.rows.append(row)
+            row += 1
+        self.status_row = row + 1
+        self.help_row = row + 2
+        self._notice = None  # Scheduler entry that puts HELP back over a notice
+        self._help_width = len(HELP)  # Widest text on the help line so far, to blank it out
+
+    def color(self, pair, extra=0):
+        return self.colors.get(pair, 0) | extra
+
+    def on_key(self, key):
+        self.draw_help()
+        command = KEYS.get(key)
+        if command == 'quit':
+            self.quit()
+        elif command == 'hotkey':
+            self.engine.on_hotkey()
+        elif command == 'trace':
+            path = tracing.save(self.timeline.title)
+            self.notice(f"Saving the event trace to {path}")
+        elif command in COMMANDS:
+            getattr(self.engine, command)()
+
+    def quit(self):
+        self.engine.reset()
+        self.running = False
+
+    # --- Drawing ---
+
+    def draw_all(self):
+        # Everything from the engine's state: first frame, resize, undo_reset
+        self.screen.clear()
+        self.screen.put(0, 0, f"NIGHTREIGN Timers ({self.timeline.name})", self.color(SECTION, curses.A_BOLD))
+        for i, row in enumerate(self.rows):
+            section = self.timeline.sections[i]
+            if section and (i == 0 or section != self.timeline.sections[i - 1]):
+                self.screen.put(row - 1, 0, section, self.color(SECTION, curses.A_BOLD))
+            if i < self.engine.phase or (i == self.engine.phase and self.engine.paused_for_boss):
+                self.draw_phase(i, self.timeline.durations[i], 'done')
+            elif i == self.engine.phase and (self.engine.running or self.engine.paused):
+                self.draw_phase(i, self.engine.elapsed(), 'current')
+            else:
+                self.draw_phase(i, 0, 'waiting')
+        self.draw_status()
+        self.draw_help()
+
+    def draw_help(self):
+        if self._notice is not None:
+            self.scheduler.cancel(self._notice)
+            self._notice = None
+        self.screen.put(self.help_row, 0, f"{HELP:<{self._help_width}}", curses.A_DIM)
+
+    def notice(self, text):
+        # Shown on the help line until the next key or NOTICE_SECONDS
+        self.draw_help()
+        self._help_width = max(self._help_width, len(text))
+        self.screen.put(self.help_row, 0, f"{text:<{self._help_width}}", curses.A_DIM)
+        self._notice = self.scheduler.after(NOTICE_SECONDS * 1000, self.draw_help)
+
+    def draw_phase(self, phase, elapsed, state):
+        duration = self.timeline.durations[phase]
+        if state == 'current':
+            attr = self.color(CLOSING if self.timeline.closing[phase] else SAFE, curses.A_BOLD)
+        elif state == 'done':
+            attr = self.color(DONE)
+        else:
+            attr = 0
+        row = self.rows[phase]
+        filled = min(BAR_WIDTH, int(BAR_WIDTH * elapsed / duration))
+        self.screen.put(row, 2, f"{self.timeline.labels[phase]:<{LABEL_WIDTH}.{LABEL_WIDTH}}", attr)
+        self.screen.put(row, 2 + LABEL_WIDTH, "[" + "#" * filled + "-" * (BAR_WIDTH - filled) + "]", attr)
+        self.screen.put(row, TIME_COLUMN, f"{format_time(elapsed)} / {format_time(duration)}", attr)
+
+    def draw_status(self):
+        engine = self.engine
+        notice = self.color(NOTICE, curses.A_BOLD)
+        if engine.paused_for_boss:
+            text, attr = "Boss fight! Press Enter when ready to resume.", notice
+        elif engine.paused:
+            text, attr = "Paused. Press p to continue.", notice
+        elif engine.running and engine.warned and not engine.is_closing():
+            text, attr = f"Storm closing in {math.ceil(engine.remaining())} seconds!", notice
+        elif engine.running:
+            text, attr = f"{math.ceil(engine.remaining())} seconds remaining", 0
+        else:
+            text, attr = "Press Enter to start", 0
+        self.screen.put(self.status_row, 0, f"{text:<{TIME_COLUMN + 13}}", attr)
+
+    def on_timer_event(self, event, phase):
+        if event == 'tick':
+            self.draw_phase(phase, self.engine.elapsed(), 'current')
+            self.draw_status()
+        elif event == 'phase':
+            self.draw_phase(phase, self.engine.elapsed(), 'current')
+            self.draw_status()
+        elif event == 'phase_end':
+            self.draw_phase(phase, self.timeline.durations[phase], 'done')
+        elif event == 'warning':
+            if self.bell:
+                curses.beep()
+            self.draw_status()
+        elif event in ('reset', 'restore'):
+            self.draw_all()
+        elif event in ('boss', 'pause', 'unpause', 'done'):
+            self.draw_status()
+
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 60:02}:{seconds % 60:02}"
+
+
+def setup_colors():
+    if not curses.has_colors():
+        return {}
+    curses.start_color()
+    try:
+        curses.use_default_colors()
+        background = -1
+    except curses.error:
+        background = curses.COLOR_BLACK
+    pairs = {
+        SAFE: curses.COLOR_GREEN,
+        CLOSING: curses.COLOR_RED,
+        SECTION: curses.COLOR_BLUE,
+        DONE: curses.COLOR_WHITE,
+        NOTICE: curses.COLOR_YELLOW,
+    }
+    for pair, foreground in pairs.items():
+        curses.init_pair(pair, foreground, background)
+    return {pair: curses.color_pair(pair) for pair in pairs}
+
+
+def run(window, args, timeline, history=None):
+    # One loop: sleep in getch() until a key or the next engine deadline
+    try:
+        curses.curs_set(0)
+    except curses.error:
+        pass
+    window.keypad(True)
+    scheduler = DeadlineScheduler()
+    app = TerminalTimers(Screen(window), scheduler, timeline, bell=not args.no_bell, colors=setup_colors())
+    if history is not None:
+        history.attach(app.engine)
+    if args.profile:
+        app.engine.start()
+        scheduler.after(args.profile * 1000, app.quit)
+    app.draw_all()
+    app.screen.flush()
+    wakeups = 0
+    while app.running:
+        deadline = scheduler.next_deadline()
+        window.timeout(-1 if deadline is None else max(0, -(-(deadline - scheduler.clock()) // 1_000_000)))
+        key = window.getch()
+        wakeups += 1
+        if key == curses.KEY_RESIZE:
+            app.draw_all()
+        elif key != -1:
+            app.on_key(key)
+        scheduler.run_due()
+        app.screen.flush()
+    return app, wakeups
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NIGHTREIGN Timers in a terminal")
+    parser.add_argument('--no-bell', action='store_true', help="don't ring the terminal bell on the storm warning")
+    parser.add_argument('--profile', type=float, metavar='SECONDS',
+                        help="start a run, quit after SECONDS and print peak RSS and CPU time")
+    schedule.add_arguments(parser)
+    run_history.add_arguments(parser)
+    args = parser.parse_args()
+    timeline = schedule.from_arguments(parser, args)
+    if curses is None:
+        parser.exit(1, "the terminal frontend needs curses (on Windows: pip install windows-curses)\n")
+    # A --profile run is not a real one
+    history = None if args.profile else run_history.start_from_arguments(args)
+    startup.mark("modules loaded")
+    try:
+        app, wakeups = curses.wrapper(run, args, timeline, history)
+    finally:
+        if history is not None:
+            history.close()
+    if args.profile:
+        print(f"peak_rss_mb={startup.peak_rss_mb():.1f} cpu_s={time.process_time():.3f} "
+              f"wakeups={wakeups} writes={app.screen.writes}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
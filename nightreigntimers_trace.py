@@ -0,0 +1,151 @@
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from nightreigntimers_startup import data_dir
+
+CAPACITY = 8192  # Events kept, comfortably more than one expedition's worth
+TRACE_DIR = data_dir()
+
+# Event kinds: record(kind, a, b) with
+ENGINE = 'engine'  # a = engine event (start, phase, phase_end, warning, boss, ...), b = phase
+WAKEUP = 'wakeup'  # a = lateness in ns (0 when not aimed at a deadline), b = handling cost in ns
+HOTKEY = 'hotkey'  # a = action, b = clock time of the key press in ns
+RENDERED = 'rendered'  # a = hotkey presses the frame answered
+CUE_SCHEDULED = 'cue_scheduled'  # a = cue, b = deadline in time.monotonic() seconds
+CUE_CANCELLED = 'cue_cancelled'
+CUE_PLAYED = 'cue_played'  # a = cue, b = seconds late
+FOCUS = 'focus'  # a = overlay shown, b = focused window title
+DETECT = 'detect'  # a = cue, b = action taken or None
+
+# Trace viewer row for each kind
+LANES = {
+    ENGINE: (1, 'engine'),
+    WAKEUP: (1, 'engine'),
+    HOTKEY: (2, 'hotkeys'),
+    RENDERED: (2, 'hotkeys'),
+    CUE_SCHEDULED: (3, 'audio'),
+    CUE_CANCELLED: (3, 'audio'),
+    CUE_PLAYED: (3, 'audio'),
+    FOCUS: (4, 'game focus'),
+    DETECT: (5, 'detection'),
+}
+PHASE_CLOSERS = ('phase', 'phase_end', 'reset', 'restore', 'done')  # Engine events that end a phase span
+
+
+def default_path():
+    return os.path.join(TRACE_DIR, time.strftime('nightreigntimers-trace-%Y%m%d-%H%M%S.json'))
+
+
+class Trace:
+    # Always-on flight recorder: the last capacity events as
+    # (clock ns, kind, a, b) tuples in a deque that drops the oldest.
+    # Recording is one clock read and one append of references already at
+    # hand (kind and engine event names are constant strings), with no
+    # formatting and no lock: deque.append is atomic, so the Tk thread, the
+    # audio worker and the hotkey hook can all record. Everything is turned
+    # into text only when the trace is dumped.
+
+    def __init__(self, capacity=CAPACITY, clock=time.monotonic_ns):
+        self.events = collections.deque(maxlen=capacity)
+        self.clock = clock
+        append = self.events.append
+
+        def record(kind, a=None, b=None):
+            # Bound once so recording looks nothing up
+            append((clock(), kind, a, b))
+        self.record = record
+
+    def to_chrome(self, titles=None, events=None):
+        # Chrome trace event format (chrome://tracing, ui.perfetto.dev).
+        # titles(phase) names the phase spans; timestamps are us from the
+        # oldest event kept.
+        if events is None:
+            events = self.events.copy()
+        if not events:
+            return {'traceEvents': [], 'displayTimeUnit': 'ms'}
+        origin = events[0][0]
+        if events[0][1] == WAKEUP:
+            origin -= events[0][3]
+        out = []
+        for tid, name in set(LANES.values()):
+            out.append({'ph': 'M', 'name': 'thread_name', 'pid': 1, 'tid': tid, 'args': {'name': name}})
+        out.append({'ph': 'M', 'name': 'process_name', 'pid': 1, 'args': {'name': 'NIGHTREIGN Timers'}})
+
+        def us(ns):
+            return (ns - origin) / 1000
+
+        open_phase = None  # (phase, start ns)
+        for t, kind, a, b in events:
+            tid = LANES[kind][0]
+            if kind == WAKEUP:
+                out.append({'ph': 'X', 'name': 'wakeup', 'pid': 1, 'tid': tid, 'ts': us(t - b), 'dur': b / 1000,
+                            'args': {'late_ms': a / 1e6}})
+                out.append({'ph': 'C', 'name': 'wakeup lateness (ms)', 'pid': 1, 'tid': tid, 'ts': us(t - b),
+                            'args': {'late': a / 1e6}})
+                continue
+            if kind == ENGINE:
+                if open_phase is not None and a in PHASE_CLOSERS:
+                    phase, start = open_phase
+                    out.append({'ph': 'X', 'name': titles(phase) if titles else f"phase {phase}", 'pid': 1,
+                                'tid': 0, 'ts': us(start), 'dur': (t - start) / 1000, 'args': {'phase': phase}})
+                    open_phase = None
+                if a == 'phase':
+                    open_phase = (b, t)
+                out.append({'ph': 'i', 's': 't', 'name': a, 'pid': 1, 'tid': tid, 'ts': us(t), 'args': {'phase': b}})
+            elif kind == HOTKEY:
+                # From the key press to the Tk thread taking it
+                out.append({'ph': 'X', 'name': a, 'pid': 1, 'tid': tid, 'ts': us(min(b, t)),
+                            'dur': max(t - b, 0) / 1000})
+            elif kind == CUE_SCHEDULED:
+                out.append({'ph': 'i', 's': 't', 'name': f"schedule {a}", 'pid': 1, 'tid': tid, 'ts': us(t),
+                            'args': {'deadline_s': b}})
+            elif kind == CUE_PLAYED:
+                out.append({'ph': 'i', 's': 't', 'name': f"play {a}", 'pid': 1, 'tid': tid, 'ts': us(t),
+                            'args': {'late_ms': b * 1000}})
+            elif kind == FOCUS:
+                out.append({'ph': 'i', 's': 't', 'name': 'shown' if a else 'hidden', 'pid': 1, 'tid': tid,
+                            'ts': us(t), 'args': {'title': b}})
+            else:
+                args = {key: value for key, value in (('a', a), ('b', b)) if value is not None}
+                out.append({'ph': 'i', 's': 't', 'name': kind, 'pid': 1, 'tid': tid, 'ts': us(t), 'args': args})
+        if open_phase is not None:
+            phase, start = open_phase
+            out.append({'ph': 'X', 'name': titles(phase) if titles else f"phase {phase}", 'pid': 1, 'tid': 0,
+                        'ts': us(start), 'dur': (events[-1][0] - start) / 1000, 'args': {'phase': phase}})
+        out.append({'ph': 'M', 'name': 'thread_name', 'pid': 1, 'tid': 0, 'args': {'name': 'phases'}})
+        return {'traceEvents': out, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path=None, titles=None, events=None):
+        # Write the trace as JSON; returns the path. Load it in a trace viewer
+        if path is None:
+            path = default_path()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome(titles, events), f)
+        return path
+
+    def save(self, titles=None, path=None):
+        # dump() off the calling thread: the events are copied now, the
+        # conversion and writing happen on a short-lived worker. Returns the path
+        if path is None:
+            path = default_path()
+        events = self.events.copy()
+
+        def write():
+            try:
+                self.dump(path, titles, events)
+            except OSError as e:
+                logging.warning(f"Could not save the event trace: {e}")
+        threading.Thread(target=write, name='trace-dump').start()
+        return path
+
+
+TRACE = Trace()
+OFF = Trace(capacity=0)  # For engines that should not be traced, e.g. the many headless sessions
+record = TRACE.record
+dump = TRACE.dump
+save = TRACE.save
@@ -0,0 +1,78 @@
+import nightreigntimers_metrics as metrics
+
+_MISSING = object()
+
+CALLS = metrics.counter('nightreign_widget_calls_total', "Tk configure/coords/itemconfig calls sent")
+SKIPPED = metrics.counter('nightreign_widget_skipped_total', "Widget updates skipped because nothing changed")
+TICK_CALLS = metrics.histogram('nightreign_widget_calls_per_tick', "Tk calls sent per rendered tick",
+                               metrics.COUNT_BUCKETS, scale=1)
+
+
+class WidgetView:
+    # Keeps the last options rendered into each widget and only sends Tk
+    # commands for the ones that changed. Counts the Tk calls it actually
+    # makes so the steady-state cost per tick can be checked.
+
+    def __init__(self):
+        self._rendered = {}
+        self.calls = 0  # Tk configure calls since startup
+        self.skipped = 0  # configure requests that changed nothing
+        self.ticks = 0
+        self.tick_calls = 0  # Tk calls since the last end_tick()
+        self.last_tick_calls = 0
+        self.max_tick_calls = 0
+
+    def config(self, widget, **options):
+        changed = self._changed(widget, options)
+        if not changed:
+            return False
+        widget.config(**changed)
+        self._sent(widget, changed)
+        return True
+
+    def item(self, canvas, item, coords=None, **options):
+        # Same for a canvas item: coords moves it, the rest goes to itemconfig
+        key = (canvas, item)
+        sent = False
+        if coords is not None:
+            coords = tuple(coords)
+            if self._changed(key, {'coords': coords}):
+                canvas.coords(item, *coords)
+                self._sent(key, {'coords': coords})
+                sent = True
+        if options:
+            changed = self._changed(key, options)
+            if changed:
+                canvas.itemconfig(item, **changed)
+                self._sent(key, changed)
+                sent = True
+        return sent
+
+    def _changed(self, key, options):
+        rendered = self._rendered.get(key, {})
+        changed = {k: v for k, v in options.items() if rendered.get(k, _MISSING) != v}
+        if not changed:
+            self.skipped += 1
+            SKIPPED.inc()
+        return changed
+
+    def _sent(self, key, changed):
+        self._rendered.setdefault(key, {}).update(changed)
+        self.calls += 1
+        self.tick_calls += 1
+        CALLS.inc()
+
+    def forget(self, widget, item=None):
+        # The widget (or canvas item) was changed behind our back, re-send everything next time
+        self._rendered.pop(widget if item is None else (widget, item), None)
+
+    def end_tick(self):
+        # Call once per rendered tick; calls made since the previous tick count towards it
+        self.ticks += 1
+        self.last_tick_calls = self.tick_calls
+        self.max_tick_calls = max(self.max_tick_calls, self.tick_calls)
+        TICK_CALLS.add(self.tick_calls)
+        self.tick_calls = 0
+
+    def calls_per_tick(self):
+        return self.calls / self.ticks if self.ticks else 0.0
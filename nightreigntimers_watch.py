@@ -0,0 +1,296 @@
+import select
+import sys
+import threading
+import time
+
+import nightreigntimers_metrics as metrics
+import nightreigntimers_trace as tracing
+from nightreigntimers_startup import timed_import
+
+GAME_PROCESS = 'nightreign.exe'
+GAME_TITLE = 'nightreign'
+
+CHECK_INTERVAL = 1.0  # Seconds between checks while the game is running
+HIDDEN_CHECK_INTERVAL = 10.0  # While hidden with focus events: the next one triggers a check anyway
+MIN_BACKOFF = 1.0  # Seconds between full scans right after the game goes away
+X11_STOP_WAIT = 0.25  # Longest X11FocusWatcher.stop() waits for its thread to notice
+MAX_BACKOFF = 16.0
+
+CHECK_COST = metrics.histogram('nightreign_game_check_seconds', "Time for one game process and focus check",
+                               metrics.FAST_BUCKETS)
+SCANS = metrics.counter('nightreign_process_scans_total', "Full process table scans looking for the game")
+PID_CHECKS = metrics.counter('nightreign_process_pid_checks_total', "Checks that the cached game PID is alive")
+
+
+def psutil_process_table():
+    psutil = timed_import('psutil')
+    for proc in psutil.process_iter(['name']):
+        yield proc.pid, proc.info['name']
+
+
+def psutil_pid_name(pid):
+    psutil = timed_import('psutil')
+    try:
+        return psutil.Process(pid).name()
+    except psutil.Error:
+        return None
+
+
+class ProcessWatcher:
+    # Finds the game process once, then only checks that the cached PID is
+    # still alive (and still the game, PIDs get reused). The full process
+    # table is only walked while the game is absent, with exponential backoff.
+    #
+    # process_table() yields (pid, name) and pid_name(pid) returns the name
+    # or None; both can be swapped for fakes.
+
+    def __init__(self, name=GAME_PROCESS, process_table=psutil_process_table, pid_name=psutil_pid_name,
+                 min_backoff=MIN_BACKOFF, max_backoff=MAX_BACKOFF):
+        self.name = name.lower()
+        self.process_table = process_table
+        self.pid_name = pid_name
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.pid = None
+        self.scans = 0
+        self.pid_checks = 0
+
+    def poll(self):
+        # Returns the game PID or None
+        if self.pid is not None:
+            self.pid_checks += 1
+            PID_CHECKS.inc()
+            name = self.pid_name(self.pid)
+            if name and name.lower() == self.name:
+                return self.pid
+            self.pid = None
+            self.backoff = self.min_backoff
+            return None
+        self.scans += 1
+        SCANS.inc()
+        for pid, name in self.process_table():
+            if name and name.lower() == self.name:
+                self.pid = pid
+                self.backoff = self.min_backoff
+                return pid
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+        return None
+
+    def next_interval(self):
+        if self.pid is not None:
+            return CHECK_INTERVAL
+        return self.backoff
+
+
+class PollingFocusWatcher:
+    # Asks pygetwindow for the foreground window each time it is polled
+    event_driven = False
+
+    def start(self, callback):
+        pass
+
+    def stop(self):
+        pass
+
+    def active_title(self):
+        gw = timed_import('pygetwindow')
+        try:
+            active = gw.getActiveWindow()
+        except Exception:
+            return None
+        return active.title if active else None
+
+
+class X11FocusWatcher:
+    # Listens for _NET_ACTIVE_WINDOW changes on the X11 root window (needs
+    # python-xlib) and reports the new foreground title from its own thread.
+    event_driven = True
+
+    def __init__(self):
+        from Xlib import X, display
+        self._X = X
+        self._display = display.Display()
+        self._root = self._display.screen().root
+        self._active_atom = self._display.intern_atom('_NET_ACTIVE_WINDOW')
+        self._name_atom = self._display.intern_atom('_NET_WM_NAME')
+        self._title = None
+        self._running = False
+        self._thread = None
+
+    def start(self, callback):
+        self._root.change_attributes(event_mask=self._X.PropertyChangeMask)
+        self._running = True
+        self._title = self._read_title()
+        callback(self._title)
+        self._thread = threading.Thread(target=self._run, args=(callback,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(2 * X11_STOP_WAIT)
+            self._thread = None
+
+    def active_title(self):
+        return self._title
+
+    def _read_title(self):
+        try:
+            prop = self._root.get_full_property(self._active_atom, self._X.AnyPropertyType)
+            if not prop or not prop.value or not prop.value[0]:
+                return None
+            window = self._display.create_resource_object('window', prop.value[0])
+            name = window.get_full_property(self._name_atom, 0) or window.get_full_property(self._X.XA_WM_NAME, 0)
+            if not name:
+                return None
+            value = name.value
+            return value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
+        except Exception:
+            return None
+
+    def _run(self, callback):
+        # next_event() blocks until the X server sends something, so wait on
+        # the connection with a timeout first and let stop() be noticed
+        while self._running:
+            if not self._display.pending_events():
+                readable, _, _ = select.select([self._display], [], [], X11_STOP_WAIT)
+                if not readable:
+                    continue
+            event = self._display.next_event()
+            if event.type == self._X.PropertyNotify and event.atom == self._active_atom:
+                title = self._read_title()
+                if title != self._title:
+                    self._title = title
+                    callback(title)
+
+
+class WinEventFocusWatcher:
+    # Uses SetWinEventHook(EVENT_SYSTEM_FOREGROUND) so Windows tells us when
+    # the foreground window changes; the hook needs a message loop, which
+    # runs on its own thread.
+    event_driven = True
+    EVENT_SYSTEM_FOREGROUND = 0x0003
+    WINEVENT_OUTOFCONTEXT = 0x0000
+
+    def __init__(self):
+        import ctypes
+        from ctypes import wintypes
+        self._ctypes = ctypes
+        self._wintypes = wintypes
+        self._user32 = ctypes.windll.user32
+        self._title = None
+        self._thread_id = None
+
+    def start(self, callback):
+        self._title = self._foreground_title()
+        callback(self._title)
+        threading.Thread(target=self._run, args=(callback,), daemon=True).start()
+
+    def stop(self):
+        if self._thread_id is not None:
+            self._user32.PostThreadMessageW(self._thread_id, 0x0012, 0, 0)  # WM_QUIT
+
+    def active_title(self):
+        return self._title
+
+    def _foreground_title(self):
+        hwnd = self._user32.GetForegroundWindow()
+        length = self._user32.GetWindowTextLengthW(hwnd)
+        buffer = self._ctypes.create_unicode_buffer(length + 1)
+        self._user32.GetWindowTextW(hwnd, buffer, length + 1)
+        return buffer.value
+
+    def _run(self, callback):
+        ctypes, wintypes = self._ctypes, self._wintypes
+        self._thread_id = ctypes.windll.kernel32.GetCurrentThreadId()
+        WinEventProc = ctypes.WINFUNCTYPE(None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+                                          wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD)
+
+        def on_event(hook, event, hwnd, id_object, id_child, thread, time_ms):
+            title = self._foreground_title()
+            if title != self._title:
+                self._title = title
+                callback(title)
+
+        proc = WinEventProc(on_event)
+        hook = self._user32.SetWinEventHook(self.EVENT_SYSTEM_FOREGROUND, self.EVENT_SYSTEM_FOREGROUND,
+                                            0, proc, 0, 0, self.WINEVENT_OUTOFCONTEXT)
+        msg = wintypes.MSG()
+        while self._user32.GetMessageW(ctypes.byref(msg), 0, 0, 0) > 0:
+            self._user32.TranslateMessage(ctypes.byref(msg))
+            self._user32.DispatchMessageW(ctypes.byref(msg))
+        self._user32.UnhookWinEvent(hook)
+
+
+def make_focus_watcher():
+    # Prefer foreground-change notifications, fall back to polling
+    try:
+        if sys.platform == 'win32':
+            return WinEventFocusWatcher()
+        if sys.platform.startswith('linux'):
+            return X11FocusWatcher()
+    except Exception:
+        pass
+    return PollingFocusWatcher()
+
+
+class GameWatcher:
+    # Decides whether the overlay should be shown: the game must be running
+    # and its window in the foreground. Runs on the Tk thread through
+    # schedule/cancel (window.after/after_cancel); focus notifications from
+    # watcher threads come back through post(), see CommandQueue.
+
+    def __init__(self, on_change, schedule, cancel, post, process=None, focus=None, title=GAME_TITLE):
+        self.on_change = on_change
+        self._schedule = schedule
+        self._cancel = cancel
+        self._post = post
+        self.process = process if process is not None else ProcessWatcher()
+        self.focus = focus if focus is not None else make_focus_watcher()
+        self.title = title.lower()
+        self.visible = None
+        self._focused_title = None
+        self._handle = None
+
+    def start(self):
+        if self.focus.event_driven:
+            self.focus.start(lambda title: self._post('focus', title))
+        self.check()
+
+    def stop(self):
+        self.focus.stop()
+        if self._handle is not None:
+            self._cancel(self._handle)
+            self._handle = None
+
+    def on_focus(self, title):
+        # Runs on the Tk thread. Checks the game right away: while hidden the
+        # cached PID can be HIDDEN_CHECK_INTERVAL old
+        self._focused_title = title
+        if self._handle is not None:
+            self._cancel(self._handle)
+        self.check()
+
+    def check(self):
+        self._handle = None
+        start = time.perf_counter_ns()
+        game_running = self.process.poll() is not None
+        if game_running and not self.focus.event_driven:
+            self._focused_title = self.focus.active_title()
+        CHECK_COST.add(time.perf_counter_ns() - start)
+        self._update(game_running)
+        interval = self.process.next_interval()
+        if self.focus.event_driven and not self.visible:
+            # Hidden: only a focus change can show the overlay, and it checks
+            # straight away, so the game's comings and goings can wait
+            interval = max(interval, HIDDEN_CHECK_INTERVAL)
+        self._handle = self._schedule(int(interval * 1000), self.check)
+
+    def _update(self, game_running):
+        game_focused = bool(self._focused_title) and self.title in self._focused_title.lower()
+        visible = game_running and game_focused
+        if visible != self.visible:
+            self.visible = visible
+            tracing.record(tracing.FOCUS, visible, self._focused_title)
+            self.on_change(visible)